@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.wsgi import WSGIHandler
+from django.utils.module_loading import import_string
+
+
+class APIHandler(WSGIHandler):
+    '''
+    A WSGI handler that loads API_MIDDLEWARE_CLASSES instead of
+    MIDDLEWARE_CLASSES. This mirrors BaseHandler.load_middleware, which always
+    reads MIDDLEWARE_CLASSES.
+    '''
+    def load_middleware(self):
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._response_middleware = []
+        self._exception_middleware = []
+
+        request_middleware = []
+        for middleware_path in settings.API_MIDDLEWARE_CLASSES:
+            middleware_class = import_string(middleware_path)
+            try:
+                middleware = middleware_class()
+            except MiddlewareNotUsed:
+                continue
+
+            if hasattr(middleware, 'process_request'):
+                request_middleware.append(middleware.process_request)
+            if hasattr(middleware, 'process_view'):
+                self._view_middleware.append(middleware.process_view)
+            if hasattr(middleware, 'process_template_response'):
+                self._template_response_middleware.insert(0,
+                    middleware.process_template_response)
+            if hasattr(middleware, 'process_response'):
+                self._response_middleware.insert(0, middleware.process_response)
+            if hasattr(middleware, 'process_exception'):
+                self._exception_middleware.insert(0, middleware.process_exception)
+
+        # Set last, since WSGIHandler uses it to check if loading is done
+        self._request_middleware = request_middleware
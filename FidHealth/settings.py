@@ -51,6 +51,28 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.security.SecurityMiddleware',
 )
 
+# Requests under API_URL_PREFIX are handled by FidHealth.handlers.APIHandler
+# with only these middleware. The API has no user state, so it skips
+# sessions, auth and messages, and uses its own tokens instead of CSRF.
+API_URL_PREFIX = '/api/'
+
+API_MIDDLEWARE_CLASSES = (
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+)
+
+# Lifetime in seconds of the tokens the landing page hands out for the API
+API_TOKEN_MAX_AGE = 60 * 60 * 12
+
+# Maximum API requests per client address per minute, per worker process, or
+# 0 for no limit (as for a load test: HEALTHSIM_API_RATE_LIMIT=0)
+API_RATE_LIMIT = int(os.environ.get('HEALTHSIM_API_RATE_LIMIT', 120))
+
+# Behind a reverse proxy, the request header holding the client's address,
+# like 'HTTP_X_FORWARDED_FOR'. The last address in it is used, which is the
+# one the proxy saw.
+API_CLIENT_ADDRESS_HEADER = None
+
 ROOT_URLCONF = 'FidHealth.urls'
 
 TEMPLATES = [
@@ -99,6 +121,43 @@ USE_L10N = True
 USE_TZ = True
 
 
+# The most services a best/worst case (bounds) request may have
+BOUNDS_MAX_SERVICES = 2000
+
+
+# Procedure price catalog, a CSV of code, description, service category, and
+# a typical price column per region. The first region is the default.
+PROCEDURE_CATALOG = os.path.join(BASE_DIR, 'data', 'procedures.csv')
+
+
+# Per-employer plan catalogs, stored as <employer>/<year>.json, and the
+# memory budget for the ones kept loaded
+PLAN_CATALOG_ROOT = os.path.join(BASE_DIR, 'data', 'plans')
+PLAN_CATALOG_CACHE_BYTES = 64 * 2 ** 20
+
+
+# Asynchronous simulation jobs (see HealthSim/insurance/jobs.py): the queue
+# lives in the project database, results are kept as files for a week (the
+# workers purge older ones every JOBS_PURGE_INTERVAL seconds), and
+# `manage.py run_jobs` runs JOBS_CONCURRENCY worker processes
+JOBS_DATABASE = DATABASES['default']['NAME']
+JOBS_RESULT_DIR = os.path.join(BASE_DIR, 'data', 'jobs')
+JOBS_RESULT_MAX_AGE = 7 * 24 * 60 * 60
+JOBS_PURGE_INTERVAL = 60 * 60
+JOBS_CONCURRENCY = 2
+JOBS_CHUNK_SIZE = 100
+
+
+# Profiling of simulation requests (see HealthSim/insurance/profiling.py).
+# HEALTHSIM_PROFILE=1 profiles every one; otherwise, if allowed with
+# HEALTHSIM_PROFILE_REQUESTS=1, a request can ask for it with ?profile=1.
+# Reports go to HEALTHSIM_PROFILE_DIR.
+PROFILE_SIMULATIONS = os.environ.get('HEALTHSIM_PROFILE', '') == '1'
+PROFILE_REQUESTS_ALLOWED = os.environ.get('HEALTHSIM_PROFILE_REQUESTS', '') == '1'
+PROFILE_REPORT_DIR = os.environ.get('HEALTHSIM_PROFILE_DIR',
+    os.path.join(BASE_DIR, 'data', 'profiles'))
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/1.8/howto/static-files/
 
@@ -106,10 +165,15 @@ USE_TZ = True
 import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-STATIC_ROOT = 'staticfiles'
+STATIC_ROOT = os.path.join(BASE_DIR, '../staticfiles')
 STATIC_URL = '/static/'
 STATICFILES_DIRS = (
     os.path.join(BASE_DIR, '../static'),
     os.path.join(BASE_DIR, 'static'),
 )
 
+# collectstatic content-hashes file names and writes .gz/.br variants; the
+# hashed names are served with a one year immutable cache lifetime
+STATICFILES_STORAGE = 'HealthSim.storage.CompressedManifestStaticFilesStorage'
+STATIC_HASHED_MAX_AGE = 60 * 60 * 24 * 365
+
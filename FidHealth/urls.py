@@ -1,8 +1,12 @@
 from django.conf.urls import include, url
 from django.contrib import admin
 
+from HealthSim.views import static_asset_view
+
 urlpatterns = [
     url(r'^admin/', include(admin.site.urls)),
     url(r'^HealthSim/', include('HealthSim.urls')),
+    url(r'^api/', include('HealthSim.api_urls', namespace='api')),
+    url(r'^static/(?P<path>.*)$', static_asset_view),
 ]
 
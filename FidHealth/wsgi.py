@@ -9,8 +9,23 @@ https://docs.djangoproject.com/en/1.8/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "FidHealth.settings")
 
-application = get_wsgi_application()
+django_application = get_wsgi_application()
+
+from FidHealth.handlers import APIHandler
+
+api_application = APIHandler()
+
+
+def application(environ, start_response):
+    '''
+    Send requests for the API namespace to the handler with the minimal
+    middleware chain, and everything else through the full stack.
+    '''
+    if environ.get('PATH_INFO', '').startswith(settings.API_URL_PREFIX):
+        return api_application(environ, start_response)
+    return django_application(environ, start_response)
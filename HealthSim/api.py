@@ -0,0 +1,292 @@
+'''
+Views for the lightweight /api/ namespace. Requests under API_URL_PREFIX are
+dispatched (see FidHealth/wsgi.py) to a handler that only runs
+API_MIDDLEWARE_CLASSES, so there are no sessions, auth or messages, and a
+simulation does no database I/O. Instead of Django's CSRF middleware, API
+calls must carry a signed token in the X-API-Token header. The landing page
+hands out that token in a cookie; a cross-site page can't read the cookie, and
+the custom header can't be sent cross-site without a CORS preflight. Anyone
+can get a token, so requests are rate limited by client address.
+
+Every endpoint takes optional "employer" and "year" query parameters, which
+pick the plan catalog (see insurance/catalogs.py).
+
+Work too big for one request is submitted as a job (see insurance/jobs.py)
+and polled; only those endpoints touch the job database.
+'''
+
+import json
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed
+from django.views.decorators.csrf import csrf_exempt
+
+from .encoding import results_response
+from .insurance import procedures
+from .insurance.jobs import jobs
+from .insurance.plans import InvalidService
+from .tokens import check_token
+from .views import (profiled_response, request_catalog, service_catalog,
+    simulation_results, too_many_bounds_services)
+
+
+class RateLimiter:
+    '''
+    A per-process fixed window rate limiter, keyed by client address. Windows
+    are dropped wholesale when they roll over, so memory is bounded by the
+    number of clients seen in one window. A limit of 0 allows everything.
+    '''
+    def __init__(self, limit, window=60):
+        self.limit = limit
+        self.window = window
+        self.window_start = 0
+        self.counts = {}
+
+    def allow(self, key):
+        if not self.limit:
+            return True
+
+        now = time.monotonic()
+        if now - self.window_start >= self.window:
+            self.window_start = now
+            self.counts = {}
+
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        return count <= self.limit
+
+
+rate_limiter = RateLimiter(settings.API_RATE_LIMIT)
+
+
+def client_address(request):
+    header = settings.API_CLIENT_ADDRESS_HEADER
+    if header and request.META.get(header):
+        return request.META[header].split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+class BadRequest(Exception):
+    '''
+    Raised by API views for requests they can't make sense of, which are
+    answered with a 400 and the message
+    '''
+
+
+def json_response(value, status=200):
+    return HttpResponse(json.dumps(value), status=status,
+        content_type='application/json')
+
+
+def api_endpoint(method):
+    '''
+    Decorator for API views: check the request method, the API token and the
+    rate limit, and JSON-encode the view's return value. Views may also return
+    an HttpResponse, which is passed through, or raise BadRequest (or let
+    InvalidService through, for services that can't be simulated).
+    '''
+    def decorator(view):
+        @csrf_exempt
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != method:
+                return HttpResponseNotAllowed([method])
+
+            if check_token(request.META.get('HTTP_X_API_TOKEN', '')) is None:
+                return json_response({'error': 'Missing or invalid API token'}, 403)
+
+            if not rate_limiter.allow(client_address(request)):
+                return json_response({'error': 'Rate limit exceeded'}, 429)
+
+            try:
+                result = view(request, *args, **kwargs)
+            except (BadRequest, InvalidService) as error:
+                return json_response({'error': str(error)}, 400)
+            if isinstance(result, HttpResponse):
+                return result
+            return json_response(result)
+        return wrapper
+    return decorator
+
+
+def request_json(request):
+    '''
+    The request body, which must be a JSON object
+    '''
+    try:
+        value = json.loads(request.body.decode('utf-8'))
+    except ValueError:
+        raise BadRequest('The body isn\'t valid JSON')
+
+    if not isinstance(value, dict):
+        raise BadRequest('The body must be a JSON object')
+    return value
+
+
+def scenario_services(scenario):
+    '''
+    Check the shape of a {"me": [services...]} scenario. The services
+    themselves are checked by convert_services.
+    '''
+    if (not isinstance(scenario, dict) or
+            not isinstance(scenario.get('me'), list) or
+            not all(isinstance(service, dict) for service in scenario['me'])):
+        raise BadRequest('Expected {"me": [services...]}')
+    return scenario
+
+
+def request_services(request):
+    '''
+    API requests send the simulation input as a JSON body, in the
+    {"me": [services...]} format expected by convert_services
+    '''
+    return scenario_services(request_json(request))
+
+
+@api_endpoint('POST')
+def simulate_view(request):
+    results, report = simulation_results(request, request_catalog(request.GET),
+        request_services(request), 'simulate')
+    return profiled_response(
+        results_response(request, {'me': results}, single=True), report)
+
+
+@api_endpoint('POST')
+def batch_view(request):
+    '''
+    Simulate many scenarios at once. The body is a JSON object of
+    {scenario name: {"me": [services...]}}.
+    '''
+    scenarios = request_json(request)
+    for scenario in scenarios.values():
+        scenario_services(scenario)
+    return results_response(request,
+        request_catalog(request.GET).run_batch(scenarios))
+
+
+@api_endpoint('POST')
+def bounds_view(request):
+    services = request_services(request)
+    if too_many_bounds_services(services):
+        return json_response({'error': 'At most {} services'.format(
+            settings.BOUNDS_MAX_SERVICES)}, 400)
+    return request_catalog(request.GET).run_bounds(services)
+
+
+@api_endpoint('POST')
+def best_view(request):
+    '''
+    The cheapest plans for the services: ?count=<n> (3 by default). Plans
+    that can't be among them aren't simulated, and are reported as skipped.
+    '''
+    try:
+        count = max(int(request.GET.get('count', 3)), 1)
+    except ValueError:
+        count = 3
+
+    return request_catalog(request.GET).best_plans(request_services(request), count)
+
+
+@api_endpoint('POST')
+def marginal_view(request):
+    '''
+    Simulate with the marginal cost of each service, under every plan. The
+    body is {"me": [services...], "prices": {service: price}}, where the
+    optional prices are for service types to price one more of.
+    '''
+    return request_catalog(request.GET).run_marginal(request_services(request))
+
+
+@api_endpoint('GET')
+def service_list_view(request):
+    return {"service_list" : service_catalog(request_catalog(request.GET))}
+
+
+@api_endpoint('GET')
+def presets_view(request):
+    # Precomputed and serialized when the catalog is loaded
+    return HttpResponse(request_catalog(request.GET).get_preset_results_json(),
+        content_type='application/json')
+
+
+@api_endpoint('GET')
+def procedures_view(request):
+    '''
+    Autocomplete procedures: ?q=<query>&region=<region>&limit=<n>
+    '''
+    try:
+        limit = min(int(request.GET.get('limit', 10)), 50)
+    except ValueError:
+        limit = 10
+
+    return {"procedures" : [procedure.to_dict()
+        for procedure in procedures.search_procedures(
+            request.GET.get('q', ''), request.GET.get('region'), limit)]}
+
+
+def job_status(job_id):
+    try:
+        return jobs.status(job_id)
+    except KeyError:
+        raise Http404("Unknown job")
+
+
+@api_endpoint('POST')
+def job_submit_view(request):
+    '''
+    Queue a simulation job. The body is {"kind": kind, "params": {...}}, for
+    the kinds in insurance/jobs.py; the "employer" and "year" query parameters
+    are passed on to the job. Returns the job's id and status.
+    '''
+    body = request_json(request)
+    params = body.get('params', {})
+    if not isinstance(params, dict):
+        raise BadRequest('The job\'s params must be a JSON object')
+
+    params = dict(params)
+    for name in ('employer', 'year'):
+        if request.GET.get(name):
+            params[name] = request.GET[name]
+
+    try:
+        job_id = jobs.submit(body.get('kind'), params)
+    except ValueError as error:
+        return json_response({'error': str(error)}, 400)
+
+    return json_response(job_status(job_id), 202)
+
+
+@api_endpoint('GET')
+def job_view(request, job_id):
+    '''
+    A job's status, progress and partial summary
+    '''
+    return job_status(job_id)
+
+
+@api_endpoint('POST')
+def job_cancel_view(request, job_id):
+    job_status(job_id)
+    jobs.cancel(job_id)
+    return job_status(job_id)
+
+
+@api_endpoint('GET')
+def job_result_view(request, job_id):
+    '''
+    Download a finished job's result
+    '''
+    status = job_status(job_id)
+    if status['status'] != 'done':
+        return json_response({'error': 'Job is {}'.format(status['status'])}, 409)
+
+    try:
+        result = open(jobs.result_path(job_id), 'rb')
+    except FileNotFoundError:
+        raise Http404("Job result was purged")
+
+    response = FileResponse(result, content_type='application/json')
+    response['Content-Disposition'] = 'attachment; filename="{}.json"'.format(job_id)
+    return response
@@ -0,0 +1,31 @@
+from django.conf.urls import patterns, url
+
+from HealthSim.api import simulate_view
+from HealthSim.api import batch_view
+from HealthSim.api import bounds_view
+from HealthSim.api import best_view
+from HealthSim.api import marginal_view
+from HealthSim.api import service_list_view
+from HealthSim.api import presets_view
+from HealthSim.api import procedures_view
+from HealthSim.api import job_submit_view
+from HealthSim.api import job_view
+from HealthSim.api import job_cancel_view
+from HealthSim.api import job_result_view
+
+urlpatterns = patterns('',
+        url(r'^simulate$', simulate_view, name='simulate'),
+        url(r'^batch$', batch_view, name='batch'),
+        url(r'^bounds$', bounds_view, name='bounds'),
+        url(r'^best$', best_view, name='best'),
+        url(r'^marginal$', marginal_view, name='marginal'),
+        url(r'^service_list$', service_list_view, name='service_list'),
+        url(r'^presets$', presets_view, name='presets'),
+        url(r'^procedures$', procedures_view, name='procedures'),
+        url(r'^jobs$', job_submit_view, name='job_submit'),
+        url(r'^jobs/(?P<job_id>[0-9a-f]{32})$', job_view, name='job'),
+        url(r'^jobs/(?P<job_id>[0-9a-f]{32})/cancel$', job_cancel_view,
+            name='job_cancel'),
+        url(r'^jobs/(?P<job_id>[0-9a-f]{32})/result$', job_result_view,
+            name='job_result'),
+)
@@ -0,0 +1,175 @@
+'''
+Content negotiation for simulation results.
+
+Results are {scenario: {plan: SimResult}}. JSON stays the default, in the
+shape the browser expects. Bulk clients can ask (with the Accept header) for:
+
+application/x-msgpack
+    MessagePack (if the msgpack package is installed) of a columnar
+    {"scenarios", "plans", "fields", "columns"} map, where each column holds
+    one SimResult field for every (scenario, plan) row.
+
+application/x-healthsim-columnar
+    The same columns as raw little-endian float64 arrays:
+
+        b'HSC1'
+        uint32 length of the header
+        header: UTF-8 JSON {"scenarios", "plans", "fields", "rows"}
+        one float64 array of `rows` values per field, in "fields" order
+
+Rows are ordered by scenario, then plan. Any encoding is gzipped if the
+client accepts gzip and the body is big enough to benefit.
+'''
+
+import gzip
+import json
+import struct
+import sys
+from array import array
+
+from django.http import HttpResponse
+
+from .insurance.plans import SimResult
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+json_type = 'application/json'
+msgpack_type = 'application/x-msgpack'
+columnar_type = 'application/x-healthsim-columnar'
+
+columnar_magic = b'HSC1'
+
+# Bodies smaller than this are sent uncompressed
+gzip_minimum_size = 1024
+
+
+def columns(results):
+    '''
+    Flatten {scenario: {plan: SimResult}} into a header and one list of
+    values per SimResult field. Every scenario must have the same plans.
+    '''
+    scenarios = sorted(results)
+    plans = sorted(results[scenarios[0]]) if scenarios else []
+
+    values = {field: [] for field in SimResult._fields}
+    for scenario in scenarios:
+        scenario_results = results[scenario]
+        for plan in plans:
+            for field, value in zip(SimResult._fields, scenario_results[plan]):
+                values[field].append(value)
+
+    header = {
+        'scenarios': scenarios,
+        'plans': plans,
+        'fields': list(SimResult._fields),
+        'rows': len(scenarios) * len(plans),
+    }
+    return header, values
+
+
+def encode_json(results, single):
+    if single:
+        (results,) = results.values()
+        return json.dumps({plan: result.to_dict()
+            for plan, result in results.items()})
+
+    return json.dumps({scenario: {plan: result.to_dict()
+            for plan, result in scenario_results.items()}
+        for scenario, scenario_results in results.items()})
+
+
+def encode_msgpack(results, single):
+    header, values = columns(results)
+    header['columns'] = values
+    return msgpack.packb(header, use_bin_type=True)
+
+
+def encode_columnar(results, single):
+    header, values = columns(results)
+    header = json.dumps(header).encode('utf-8')
+
+    body = [columnar_magic, struct.pack('<I', len(header)), header]
+    for field in SimResult._fields:
+        column = array('d', values[field])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        body.append(column.tobytes())
+
+    return b''.join(body)
+
+
+encoders = {json_type: encode_json, columnar_type: encode_columnar}
+if msgpack is not None:
+    encoders[msgpack_type] = encode_msgpack
+
+
+def header_qualities(header):
+    '''
+    Parse an Accept style header into (value, quality) pairs, in order
+    '''
+    for entry in header.split(','):
+        value, *params = entry.split(';')
+        quality = 1.0
+        for param in params:
+            name, _, param_value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(param_value)
+                except ValueError:
+                    quality = 0.0
+        yield value.strip(), quality
+
+
+def accepted_types(header):
+    '''
+    Parse an Accept header into media types, most preferred first
+    '''
+    accepted = [(-quality, position, media_type)
+        for position, (media_type, quality) in enumerate(header_qualities(header))
+        if quality > 0]
+
+    return [media_type for _, _, media_type in sorted(accepted)]
+
+
+def accepts_encoding(request, encoding):
+    '''
+    Whether the request's Accept-Encoding allows `encoding`, by name or by
+    "*". A quality of 0 means not acceptable.
+    '''
+    qualities = {name.lower(): quality for name, quality in header_qualities(
+        request.META.get('HTTP_ACCEPT_ENCODING', ''))}
+    return qualities.get(encoding, qualities.get('*', 0)) > 0
+
+
+def negotiate(request):
+    for media_type in accepted_types(request.META.get('HTTP_ACCEPT', '')):
+        if media_type in encoders:
+            return media_type
+    return json_type
+
+
+def results_response(request, results, single=False):
+    '''
+    Build an HttpResponse for {scenario: {plan: SimResult}} results, in the
+    encoding the client asked for. If `single` is set there's exactly one
+    scenario, which JSON sends as just {plan: result}.
+    '''
+    media_type = negotiate(request)
+    body = encoders[media_type](results, single)
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+
+    compress = (len(body) >= gzip_minimum_size and
+        accepts_encoding(request, 'gzip'))
+    if compress:
+        body = gzip.compress(body, 6)
+
+    response = HttpResponse(body, content_type=media_type)
+    response['Vary'] = 'Accept, Accept-Encoding'
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    return response
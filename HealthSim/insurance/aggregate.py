@@ -0,0 +1,231 @@
+'''
+Streaming, mergeable summaries of simulation results.
+
+Large runs shouldn't have to keep every SimResult just to summarize them.
+The aggregators here take results one at a time, use memory independent of
+the number of results, and can be merged, so each worker process can
+aggregate its share and the parent merges them (they pickle as plain
+objects).
+'''
+
+import math
+
+
+class Moments:
+    '''
+    Running count, mean and variance (Welford), mergeable with Chan's
+    parallel update.
+    '''
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def merge(self, other):
+        if not other.count:
+            return
+        if not self.count:
+            self.__dict__.update(other.__dict__)
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+
+class QuantileSketch:
+    '''
+    A log-bucketed quantile sketch (in the style of DDSketch). Every quantile
+    estimate is within `relative_accuracy` of the true value. Costs are never
+    negative, and zero is common, so zeros are counted separately. The number
+    of buckets only grows with the log of the range of values, not with the
+    number of values, and sketches with the same accuracy merge exactly.
+    '''
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.zeros = 0
+        self.count = 0
+        self.buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        if value <= 0:
+            self.zeros += 1
+            return
+
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError('Cannot merge sketches with different accuracies')
+
+        self.count += other.count
+        self.zeros += other.zeros
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0
+
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class Histogram:
+    '''
+    A fixed-bin histogram from 0, with `bins` bins of `bin_width`. Values
+    past the last bin are counted in an overflow bin.
+    '''
+    def __init__(self, bin_width=250, bins=80):
+        self.bin_width = bin_width
+        self.counts = [0] * (bins + 1)
+
+    def add(self, value):
+        index = int(max(value, 0) // self.bin_width)
+        self.counts[min(index, len(self.counts) - 1)] += 1
+
+    def merge(self, other):
+        if (other.bin_width, len(other.counts)) != (
+                self.bin_width, len(self.counts)):
+            raise ValueError('Cannot merge histograms with different bins')
+
+        self.counts = [mine + theirs
+            for mine, theirs in zip(self.counts, other.counts)]
+
+
+class PlanAggregator:
+    '''
+    Summary statistics of the annual cost (SimResult.out_of_pocket) of many
+    simulations of a single plan, plus how often each network's deductible
+    and out of pocket maximum were met. Network results are optional, and
+    are the (in_network, out_of_network) pair from Plan.run_network_sims.
+
+    A network without a deductible can't meet it, so along with the network
+    results, pass the networks' (in_network, out_of_network) deductibles:
+    networks without one are left out of the rate the deductible was met at.
+    Without them, every network counts, and those without a deductible count
+    as having met it.
+    '''
+    def __init__(self, bin_width=250, bins=80, relative_accuracy=0.01):
+        self.moments = Moments()
+        self.sketch = QuantileSketch(relative_accuracy)
+        self.histogram = Histogram(bin_width, bins)
+
+        self.with_networks = 0
+        self.with_deductible = [0, 0]
+        self.deductible_met = [0, 0]
+        self.oop_maximum_met = [0, 0]
+
+    def add(self, result, networks=None, deductibles=None):
+        cost = result.out_of_pocket
+        self.moments.add(cost)
+        self.sketch.add(cost)
+        self.histogram.add(cost)
+
+        if networks is not None:
+            self.with_networks += 1
+            for index, network in enumerate(networks):
+                if deductibles is None or deductibles[index] > 0:
+                    self.with_deductible[index] += 1
+                    if network.deductible <= 0:
+                        self.deductible_met[index] += 1
+                if network.oop_maximum <= 0:
+                    self.oop_maximum_met[index] += 1
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        self.histogram.merge(other.histogram)
+
+        self.with_networks += other.with_networks
+        for index in range(2):
+            self.with_deductible[index] += other.with_deductible[index]
+            self.deductible_met[index] += other.deductible_met[index]
+            self.oop_maximum_met[index] += other.oop_maximum_met[index]
+
+    def fractions(self, counts, totals):
+        if not self.with_networks:
+            return None
+        in_network, out_of_network = (
+            count / total if total else None
+            for count, total in zip(counts, totals))
+        return {
+            'in_network': in_network,
+            'out_of_network': out_of_network}
+
+    def summary(self, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95, 0.99)):
+        return {
+            'count': self.moments.count,
+            'mean': self.moments.mean,
+            'variance': self.moments.variance,
+            'min': self.moments.minimum,
+            'max': self.moments.maximum,
+            'quantiles': {str(q): self.sketch.quantile(q) for q in quantiles},
+            'histogram': {
+                'bin_width': self.histogram.bin_width,
+                'counts': self.histogram.counts},
+            'deductible_met': self.fractions(
+                self.deductible_met, self.with_deductible),
+            'oop_maximum_met': self.fractions(
+                self.oop_maximum_met, [self.with_networks] * 2),
+        }
+
+
+class ResultAggregator:
+    '''
+    A PlanAggregator per plan, created on first use.
+    '''
+    def __init__(self, **options):
+        self.options = options
+        self.plans = {}
+
+    def plan(self, plan_name):
+        aggregator = self.plans.get(plan_name)
+        if aggregator is None:
+            aggregator = self.plans[plan_name] = PlanAggregator(**self.options)
+        return aggregator
+
+    def add(self, plan_name, result, networks=None, deductibles=None):
+        self.plan(plan_name).add(result, networks, deductibles)
+
+    def merge(self, other):
+        for plan_name, aggregator in other.plans.items():
+            self.plan(plan_name).merge(aggregator)
+
+    def summary(self):
+        return {plan_name: aggregator.summary()
+            for plan_name, aggregator in self.plans.items()}
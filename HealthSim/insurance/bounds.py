@@ -0,0 +1,229 @@
+from bisect import bisect_right
+from collections import Counter, namedtuple
+
+
+def to_cents(amount):
+    return int(round(amount * 100))
+
+
+def absorption_extra(cost, mod, absorbed):
+    '''
+    The change in out of pocket cost for a single service when `absorbed` of
+    its `cost` goes toward the deductible, compared to the same service being
+    received after the deductible is already met.
+    '''
+    return absorbed + mod(cost - absorbed) - mod(cost)
+
+
+def absorption_rates(cost, mod):
+    '''
+    Bound a service's absorption_extra as a function of the amount absorbed,
+    from 0 up to the whole `cost`, where it's `extra`. Returns
+    (lower_rate, upper_rate, extra), where the extra is at least
+    lower_rate * absorbed, and at most min(upper_rate * absorbed, extra).
+
+    Coinsurance, full coverage and no coverage are linear, so both rates are
+    extra / cost. A copay is min(absorbed, extra): nothing of the copay is
+    owed until the deductible leaves less than it, so it's at most the
+    absorbed amount, and as it's concave, at least the straight line. Nothing
+    is known about untagged mods beyond them charging no more than the cost.
+    '''
+    extra = absorption_extra(cost, mod, cost)
+    kind, _ = getattr(mod, 'rule', (None, None))
+
+    if kind in ('coinsure', 'covered', 'not_covered') or extra <= 0:
+        return extra / cost, extra / cost, extra
+    elif kind == 'copay':
+        return extra / cost, 1, extra
+    else:
+        return 0, 1, extra
+
+
+def filler(items):
+    '''
+    A function filling an amount from (rate, capacity) items in order,
+    returning the sum of rate * the amount taken from each
+    '''
+    rates = []
+    starts = [0]
+    totals = [0]
+    for rate, capacity in items:
+        rates.append(rate)
+        starts.append(starts[-1] + capacity)
+        totals.append(totals[-1] + rate * capacity)
+
+    def filled(amount):
+        index = bisect_right(starts, amount) - 1
+        if index == len(rates):
+            return totals[-1]
+        return totals[index] + rates[index] * (amount - starts[index])
+    return filled
+
+
+class Kind(namedtuple('Kind', ('cost', 'mod', 'count', 'weight', 'extra',
+        'lower_rate', 'upper_rate'))):
+    '''
+    `count` identical services paid toward the deductible, with the cost in
+    cents as the `weight`, and the absorption_extra and absorption_rates of
+    one of them
+    '''
+    @classmethod
+    def create(cls, cost, mod, count):
+        lower_rate, upper_rate, extra = absorption_rates(cost, mod)
+        return cls(cost, mod, count, to_cents(cost), extra, lower_rate,
+            upper_rate)
+
+    def split_extra(self, absorbed_cents):
+        return absorption_extra(self.cost, self.mod, absorbed_cents / 100)
+
+
+def relaxation(kinds, sign):
+    '''
+    A function bounding the highest (sign 1) or lowest (sign -1) total
+    absorption_extra of the kinds for a given amount absorbed, by letting
+    each service be absorbed at its best rate for as long as it lasts
+    '''
+    if sign > 0:
+        return filler(sorted(
+            ((kind.upper_rate, kind.extra / kind.upper_rate * kind.count)
+                for kind in kinds if kind.upper_rate > 0),
+            reverse=True))
+    else:
+        return filler(sorted(
+            (kind.lower_rate, kind.cost * kind.count) for kind in kinds))
+
+
+def ordering_extra(kinds, deductible_cents):
+    '''
+    The total absorption_extra of receiving the kinds in the given order
+    '''
+    total = 0
+    remaining = deductible_cents
+    for kind in kinds:
+        if remaining <= 0:
+            break
+        whole = min(kind.count, remaining // kind.weight)
+        total += whole * kind.extra
+        remaining -= whole * kind.weight
+        if whole < kind.count and remaining > 0:
+            total += kind.split_extra(remaining)
+            remaining = 0
+    return total
+
+
+def extreme_extra(kinds, deductible_cents, sign):
+    '''
+    The highest (sign 1) or lowest (sign -1) total absorption_extra over
+    every ordering of the kinds, which must cost more than the deductible
+    between them.
+
+    In any ordering, some set of whole services is absorbed by the
+    deductible, then one service is split across it, taking whatever's
+    left, and the rest are received after it's met. Which whole services
+    can fill the deductible is a subset sum, so this is a bounded knapsack
+    over the deductible in cents, keeping the best extra for each total.
+    Every kind in turn is the one split, with one of its services held back
+    while the others are added. Rather than redoing the knapsack for each,
+    the kinds are halved recursively, and each half is added to the table
+    before recursing into the other, so a kind is added O(log n) times.
+
+    Most of the table is pruned: the kinds still to be added can add no
+    more (or less) than their relaxation over what's left of the
+    deductible, so a total that can't beat the best ordering found so far
+    is dropped. The greedy ordering starts that off, and when it matches
+    the relaxation of every kind, it's the answer without searching.
+    '''
+    if sign > 0:
+        ordered = sorted(kinds,
+            key=lambda kind: (-kind.upper_rate, -kind.lower_rate))
+    else:
+        ordered = sorted(kinds,
+            key=lambda kind: (kind.lower_rate, kind.upper_rate))
+
+    best = [sign * ordering_extra(ordered, deductible_cents)]
+    if best[0] >= sign * relaxation(kinds, sign)(deductible_cents / 100) - 1e-9:
+        return sign * best[0]
+
+    def add(table, kind, count, pending):
+        relaxed = relaxation(pending, sign)
+        reach = sum(kind.weight * kind.count for kind in pending)
+        grown = {}
+        for total, extra in table.items():
+            for taken in range(count + 1):
+                cents = total + taken * kind.weight
+                if cents > deductible_cents:
+                    break
+                value = sign * (extra + taken * kind.extra)
+                left = deductible_cents - cents
+                if (cents + reach < deductible_cents or
+                        value + sign * relaxed(left / 100) <= best[0] + 1e-9):
+                    continue
+                if cents not in grown or value > sign * grown[cents]:
+                    grown[cents] = sign * value
+        return grown
+
+    def add_all(table, adding, pending):
+        for index, kind in enumerate(adding):
+            table = add(table, kind, kind.count, adding[index + 1:] + pending)
+        return table
+
+    def search(table, pending):
+        if len(pending) == 1:
+            split, = pending
+            table = add(table, split, split.count - 1, pending)
+            for total, extra in table.items():
+                left = deductible_cents - total
+                if left <= split.weight:
+                    best[0] = max(best[0],
+                        sign * (extra + split.split_extra(left)))
+            return
+
+        middle = len(pending) // 2
+        first, second = pending[:middle], pending[middle:]
+        search(add_all(table, second, first), first)
+        search(add_all(table, first, second), second)
+
+    search({0: 0}, ordered)
+    return sign * best[0]
+
+
+def network_bounds(services, deductible, out_of_pocket_max):
+    '''
+    Compute the cheapest and most expensive outcomes of a network simulation
+    over every possible ordering of `services`, which are literal
+    (cost, mod, ignore_deductible, count) services.
+
+    The ordering only matters through which services are paid toward the
+    deductible (see extreme_extra). The out of pocket maximum is a cap on
+    the running total, so it can be applied once at the end. Identical
+    services are grouped into kinds.
+
+    Returns a pair of (out_of_pocket, deductible, oop_maximum) tuples, best
+    case first.
+    '''
+    fixed = 0
+    counts = Counter()
+
+    for cost, mod, ignore_deductible, count in services:
+        fixed += mod(cost) * count
+        if not ignore_deductible and cost > 0:
+            counts[cost, mod] += count
+
+    kinds = [Kind.create(cost, mod, count)
+        for (cost, mod), count in counts.items()]
+    spend = sum(kind.cost * kind.count for kind in kinds)
+    remaining_deductible = max(0, deductible - spend)
+
+    if spend <= deductible:
+        # Every service is absorbed in full, in any order
+        low = high = sum(kind.extra * kind.count for kind in kinds)
+    else:
+        deductible_cents = to_cents(deductible)
+        low = extreme_extra(kinds, deductible_cents, -1)
+        high = extreme_extra(kinds, deductible_cents, 1)
+
+    return tuple(
+        (out_of_pocket, remaining_deductible, out_of_pocket_max - out_of_pocket)
+        for out_of_pocket in (
+            min(out_of_pocket_max, fixed + low),
+            min(out_of_pocket_max, fixed + high)))
@@ -0,0 +1,185 @@
+'''
+Plan catalogs for many employers and plan years.
+
+Each (employer, year) has its own set of plans, stored as a JSON file of
+{plan name: Plan.to_dict()} at <root>/<employer>/<year>.json. Catalogs are
+loaded from storage the first time they're asked for, and kept in a least
+recently used cache with a memory budget, so a process serving many tenants
+only keeps the busy ones resident. Asking for no employer gets the built-in
+catalog, which is always resident.
+'''
+
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from .plans import GlobalPlans, plans
+
+
+# Loaded plans take about this many times the size of their JSON, mostly for
+# the compiled simulations (measured with tracemalloc on the built-in plans)
+resident_size_factor = 30
+
+employer_pattern = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+class PlanCatalogs:
+    def __init__(self, default, root=None, budget=64 * 2 ** 20):
+        self.default = default
+        self.root = root
+        self.budget = budget
+
+        # (employer, year) -> (GlobalPlans, estimated size in bytes)
+        self.resident = OrderedDict()
+        self.resident_size = 0
+        # employer -> latest stored year, refreshed whenever that year isn't
+        # resident, so a request with no year doesn't list the directory
+        self.latest = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, root, budget=None):
+        with self.lock:
+            self.root = root
+            if budget is not None:
+                self.budget = budget
+            self.resident.clear()
+            self.resident_size = 0
+            self.latest.clear()
+
+    def catalog_path(self, employer, year=None):
+        if self.root is None or not employer_pattern.match(employer):
+            raise KeyError(employer)
+        if year is None:
+            return os.path.join(self.root, employer)
+        return os.path.join(self.root, employer, '{}.json'.format(year))
+
+    def years(self, employer):
+        '''
+        The plan years stored for an employer, in order
+        '''
+        try:
+            names = os.listdir(self.catalog_path(employer))
+        except FileNotFoundError:
+            raise KeyError(employer)
+
+        return sorted(int(name[:-5]) for name in names
+            if name.endswith('.json') and name[:-5].isdigit())
+
+    def get(self, employer=None, year=None):
+        '''
+        Get the GlobalPlans for an employer's plan year, loading it if it isn't
+        resident. With no year, the latest stored year is used. With no
+        employer, the built-in catalog is returned. Raises KeyError for
+        unknown employers and years.
+        '''
+        if not employer:
+            return self.default
+
+        if year is None or year == '':
+            year = self.latest_year(employer)
+
+        try:
+            key = (employer, int(year))
+        except ValueError:
+            raise KeyError(year)
+
+        with self.lock:
+            entry = self.resident.get(key)
+            if entry is not None:
+                self.resident.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Loading happens outside the lock, so one slow load doesn't hold up
+        # requests for resident catalogs. Concurrent first requests for the
+        # same catalog may both load it; the first one stored wins.
+        catalog, size = self.load(*key)
+
+        with self.lock:
+            if key in self.resident:
+                self.resident.move_to_end(key)
+                return self.resident[key][0]
+
+            self.resident[key] = (catalog, size)
+            self.resident_size += size
+            self.evict()
+
+        return catalog
+
+    def latest_year(self, employer):
+        '''
+        The latest stored year for an employer, from the cache while that
+        year's catalog is resident
+        '''
+        with self.lock:
+            year = self.latest.get(employer)
+            if year is not None and (employer, year) in self.resident:
+                return year
+
+        years = self.years(employer)
+        if not years:
+            raise KeyError(employer)
+
+        with self.lock:
+            self.latest[employer] = years[-1]
+        return years[-1]
+
+    def load(self, employer, year):
+        try:
+            with open(self.catalog_path(employer, year), 'rb') as source:
+                data = source.read()
+        except FileNotFoundError:
+            raise KeyError((employer, year))
+
+        catalog = GlobalPlans.from_dict(json.loads(data.decode('utf-8')))
+        return catalog, len(data) * resident_size_factor
+
+    def evict(self):
+        '''
+        Drop least recently used catalogs until the budget is met. The most
+        recently used one is always kept, even if it's over budget alone.
+        '''
+        while self.resident_size > self.budget and len(self.resident) > 1:
+            _, (_, size) = self.resident.popitem(last=False)
+            self.resident_size -= size
+            self.evictions += 1
+
+    def save(self, employer, year, catalog):
+        '''
+        Store a GlobalPlans as an employer's plan year, replacing any resident
+        copy
+        '''
+        path = self.catalog_path(employer, year)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as target:
+            json.dump(catalog.to_dict(), target, indent=2, sort_keys=True)
+
+        with self.lock:
+            entry = self.resident.pop((employer, int(year)), None)
+            if entry is not None:
+                self.resident_size -= entry[1]
+            if int(year) > self.latest.get(employer, int(year)):
+                self.latest[employer] = int(year)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'resident': len(self.resident),
+                'resident_bytes': self.resident_size,
+                'budget_bytes': self.budget,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+catalogs = PlanCatalogs(plans)
+configure_catalogs = catalogs.configure
+get_catalog = catalogs.get
@@ -0,0 +1,197 @@
+'''
+Compile a network's coverage rules into a specialized simulation function.
+
+kernel.run_network interprets the plan: for each service it converts to a
+LiteralService, calls the mod closure and builds tuples in
+apply_to_threshold. Plans are static, so instead we generate the source of a
+function with the deductible and out of pocket maximum as default
+arguments, and each distinct coverage rule inlined as a branch. The
+arithmetic is exactly the arithmetic of the kernel, in the same order, so
+results are identical to run_network, including stopping once both
+thresholds are used up. Services the network doesn't list take the
+not-covered branch, as in kernel.coverage.
+
+Variants of the function take run-length encoded (service, count) pairs, or
+services with a count field like the notebook's, resolving each run in
+closed form with run_payments. Passing the remaining deductible and out of
+pocket maximum lets a simulation be resumed, month by month.
+'''
+
+import math
+
+from .kernel import run_payments, uncovered
+
+
+def mod_source(rule, mod_name):
+    '''
+    Source for an expression applying a coverage rule to `cost`. Falls back to
+    calling the mod for mods that don't carry a rule.
+    '''
+    if rule is None:
+        return '{}(cost)'.format(mod_name)
+
+    kind, value = rule
+    if kind == 'copay':
+        # min(cost, amount) returns cost on a tie
+        return '{0!r} if {0!r} < cost else cost'.format(value)
+    elif kind == 'coinsure':
+        return 'cost * {!r}'.format(value / 100)
+    elif kind == 'covered':
+        return '0'
+    elif kind == 'not_covered':
+        return 'cost'
+    else:
+        return '{}(cost)'.format(mod_name)
+
+
+def run_branch_source(rule, mod_name, ignore_deductible):
+    '''
+    Source lines for simulating a run of `count` services under a single
+    coverage rule, at an indent of zero.
+    '''
+    lines = ['if count == 1:']
+    lines.extend('    ' + line
+        for line in branch_source(rule, mod_name, ignore_deductible))
+    lines += [
+        'else:',
+        '    payments, deductible = run_payments(',
+        '        deductible, cost, {}, {!r}, count)'.format(
+            mod_name, ignore_deductible),
+        '    if oop_maximum <= payments:',
+        '        pocket_cost = oop_maximum',
+        '    else:',
+        '        pocket_cost = payments',
+        '    oop_maximum -= pocket_cost',
+        '    year_out_of_pocket += pocket_cost',
+    ]
+    return lines
+
+
+def branch_source(rule, mod_name, ignore_deductible):
+    '''
+    Source lines for simulating one service under a single coverage rule, at
+    an indent of zero.
+    '''
+    lines = []
+
+    if not ignore_deductible:
+        lines += [
+            # apply_to_threshold(deductible, cost)
+            'if deductible <= cost:',
+            '    pre_deduct = deductible',
+            'else:',
+            '    pre_deduct = cost',
+            'deductible -= pre_deduct',
+            'cost -= pre_deduct',
+            # at_threshold(oop_maximum, pre_deduct)
+            'if oop_maximum <= pre_deduct:',
+            '    pocket_cost = oop_maximum',
+            'else:',
+            '    pocket_cost = pre_deduct',
+            'oop_maximum -= pocket_cost',
+            'year_out_of_pocket += pocket_cost',
+        ]
+
+    lines += [
+        'modded = ' + mod_source(rule, mod_name),
+        # at_threshold(oop_maximum, modded)
+        'if oop_maximum <= modded:',
+        '    pocket_cost = oop_maximum',
+        'else:',
+        '    pocket_cost = modded',
+        'oop_maximum -= pocket_cost',
+        'year_out_of_pocket += pocket_cost',
+    ]
+    return lines
+
+
+# How each variant unpacks its input
+loop_targets = {
+    False: ('services', 'name, cost, in_network'),
+    True: ('runs', '(name, cost, in_network), count'),
+    'counted': ('services', 'name, cost, in_network, count'),
+}
+
+
+def network_source(network, runs=False):
+    '''
+    Generate the source for a network's simulation function, taking either
+    Services or, if `runs` is set, (Service, count) pairs, or if `runs` is
+    'counted', (name, cost, in_network, count) services. Returns the source
+    and the namespace it needs to be executed in.
+    '''
+    rule_ids = {}
+    branches = {}
+    # repr() of an unlimited threshold is 'inf'
+    namespace = {
+        'rule_ids': rule_ids, 'inf': math.inf, 'run_payments': run_payments}
+    make_branch = run_branch_source if runs else branch_source
+
+    offered_services = sorted(network.services.items())
+    # Unlisted services; the name can't collide with a real one
+    offered_services.append((None, uncovered))
+
+    for name, offered in offered_services:
+        rule = getattr(offered.mod, 'rule', None)
+        # Mods without a rule can't be shared between branches
+        key = (rule if rule is not None else id(offered.mod),
+            offered.ignore_deductible)
+
+        if key not in branches:
+            mod_name = 'mod_{}'.format(len(branches))
+            namespace[mod_name] = offered.mod
+            branches[key] = (len(branches), make_branch(
+                rule, mod_name, offered.ignore_deductible))
+
+        if name is None:
+            namespace['uncovered_rule'] = branches[key][0]
+        else:
+            rule_ids[name] = branches[key][0]
+
+    argument, target = loop_targets[runs]
+    lines = [
+        'def network_sim({}, deductible={!r}, oop_maximum={!r}):'.format(
+            argument, network.deductible, network.out_of_pocket_max),
+        '    year_out_of_pocket = 0',
+        '',
+        '    for {} in {}:'.format(target, argument),
+        '        if in_network != {!r}:'.format(network.in_network),
+        '            continue',
+        '',
+        '        rule = rule_ids.get(name, uncovered_rule)',
+    ]
+
+    for index, (rule_id, body) in enumerate(sorted(branches.values())):
+        lines.append('        {} rule == {}:'.format(
+            'if' if index == 0 else 'elif', rule_id))
+        lines.extend('            ' + line for line in body)
+
+    lines += [
+        '',
+        '        # Saturated: everything from here on is free',
+        '        if oop_maximum <= 0 and deductible <= 0:',
+        '            break',
+        '',
+        '    return result_type(year_out_of_pocket, deductible, oop_maximum)',
+    ]
+
+    return '\n'.join(lines) + '\n', namespace
+
+
+def compile_network(network, result_type, runs=False):
+    '''
+    Compile a NetworkDetails (or kernel.Network) into a function which takes
+    an iterable of Services (or the input of the `runs` variant, see
+    network_source), and optionally the remaining deductible and out of pocket
+    maximum, and returns a `result_type` of (out_of_pocket, deductible,
+    oop_maximum), identical to kernel.run_network.
+    '''
+    source, namespace = network_source(network, runs)
+    namespace['result_type'] = result_type
+
+    code = compile(source, '<network_sim {:x}>'.format(id(network)), 'exec')
+    exec(code, namespace)
+
+    network_sim = namespace['network_sim']
+    network_sim.source = source
+    return network_sim
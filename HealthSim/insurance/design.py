@@ -0,0 +1,276 @@
+'''
+Plan design grid search.
+
+Evaluates every combination of plan parameters against a member population,
+reporting the employee and employer cost of each design. Most of the grid is
+resolved without simulating, using the structure of a plan:
+
+- The out of pocket maximum only ever caps the running total, so a network's
+  out of pocket cost is min(out_of_pocket_max, uncapped cost). Each network
+  is simulated once per deductible and coverage rule combination with no
+  maximum, and every maximum is applied afterwards.
+- The premium is a constant per member.
+- The HSA contribution is applied to the sum of the network costs. With
+  every other parameter fixed, the sum over members of what's left after
+  the HSA is piecewise linear in whichever of the HSA contribution or
+  either network's maximum is varied, so the members are sorted once for
+  the longest of those three axes, and each of its values is then a
+  bisection into prefix sums.
+
+Identical members are simulated once and weighted.
+'''
+
+from bisect import bisect_left, bisect_right
+from collections import Counter, namedtuple
+from itertools import product
+import math
+
+from .plans import NetworkDetails, OfferedService, convert_services
+
+
+class NetworkAxes(namedtuple('NetworkAxes',
+        ('deductible', 'out_of_pocket_max', 'services'))):
+    '''
+    Ranges for one network of a plan design. `deductible` and
+    `out_of_pocket_max` are sequences of values to try, and `services` maps
+    service names to sequences of OfferedServices (or bare mods, like
+    copay(20)) to try for that service. Anything left as None keeps the base
+    plan's value.
+    '''
+    def __new__(cls, deductible=None, out_of_pocket_max=None, services=None):
+        return super().__new__(cls, deductible, out_of_pocket_max, services)
+
+
+def as_offered(option):
+    return option if isinstance(option, OfferedService) else OfferedService(option)
+
+
+def describe_offered(offered):
+    return {
+        'rule': getattr(offered.mod, 'rule', None),
+        'ignore_deductible': offered.ignore_deductible}
+
+
+def network_variants(base, axes):
+    '''
+    Yield a (description, uncapped NetworkDetails) for every combination of
+    deductible and coverage rules on this network
+    '''
+    service_axes = sorted((axes.services or {}).items())
+    names = [name for name, _ in service_axes]
+
+    for deductible in axes.deductible or (base.deductible,):
+        for choice in product(*(options for _, options in service_axes)):
+            choice = [as_offered(option) for option in choice]
+            services = dict(base.services)
+            services.update(zip(names, choice))
+
+            description = {
+                'deductible': deductible,
+                'services': {name: describe_offered(offered)
+                    for name, offered in zip(names, choice)}}
+
+            yield description, NetworkDetails(
+                deductible, math.inf, services, base.in_network)
+
+
+def weighted_suffix_sums(totals):
+    '''
+    Given sorted (total, weight) pairs, return the sorted totals, and suffix
+    sums of weight and of weight * total
+    '''
+    values = [total for total, _ in totals]
+    weights = [0] * (len(totals) + 1)
+    weighted = [0] * (len(totals) + 1)
+
+    for index in range(len(totals) - 1, -1, -1):
+        total, weight = totals[index]
+        weights[index] = weights[index + 1] + weight
+        weighted[index] = weighted[index + 1] + weight * total
+
+    return values, weights, weighted
+
+
+def weighted_prefix_sums(points):
+    '''
+    Given sorted (x, weight) pairs, return the sorted xs, and prefix sums of
+    weight and of weight * x
+    '''
+    values = [x for x, _ in points]
+    weights = [0]
+    weighted = [0]
+
+    for x, weight in points:
+        weights.append(weights[-1] + weight)
+        weighted.append(weighted[-1] + weight * x)
+
+    return values, weights, weighted
+
+
+def weighted_excess(sums, maximum):
+    '''
+    The sum of weight * max(maximum - x, 0), from weighted_prefix_sums
+    '''
+    values, weights, weighted = sums
+    index = bisect_left(values, maximum)
+    return maximum * weights[index] - weighted[index]
+
+
+def capped_sums(costs, offsets, weights, maximums):
+    '''
+    For each maximum, the sum of weight * max(min(maximum, cost) + offset, 0)
+    over members, from one sort. With low = -offset, a member's term is 0 up
+    to low, rises with the maximum up to its cost, and is flat after, so
+    it's max(maximum - low, 0) - max(maximum - cost, 0) for members with a
+    cost above low, and 0 for the rest.
+    '''
+    lows = []
+    highs = []
+    for cost, offset, weight in zip(costs, offsets, weights):
+        if cost + offset > 0:
+            lows.append((-offset, weight))
+            highs.append((cost, weight))
+
+    uncapped = sum(weight * (cost - low) for (low, weight), (cost, _)
+        in zip(lows, highs)) if lows else 0
+    lows = weighted_prefix_sums(sorted(lows))
+    highs = weighted_prefix_sums(sorted(highs))
+
+    return [uncapped if math.isinf(maximum) else
+            weighted_excess(lows, maximum) - weighted_excess(highs, maximum)
+        for maximum in maximums]
+
+
+def services_costs(in_costs, out_costs, weights,
+        in_maximums, out_maximums, contributions):
+    '''
+    The sum over members of weight * max(min(in_maximum, in_cost) +
+    min(out_maximum, out_cost) - contribution, 0), what the members pay
+    after the HSA, for every (in_maximum, out_maximum, contribution). The
+    members are sorted once for every combination of the two shorter axes.
+    '''
+    costs = {}
+    sorts = {
+        'contribution': len(in_maximums) * len(out_maximums),
+        'in_network': len(out_maximums) * len(contributions),
+        'out_of_network': len(in_maximums) * len(contributions),
+    }
+    inner = min(sorts, key=sorts.get)
+
+    if inner == 'contribution':
+        for in_maximum, out_maximum in product(in_maximums, out_maximums):
+            values, suffix_weights, suffix_weighted = weighted_suffix_sums(
+                sorted(
+                    (min(in_maximum, in_cost) + min(out_maximum, out_cost),
+                        weight)
+                    for in_cost, out_cost, weight in zip(
+                        in_costs, out_costs, weights)))
+
+            for contribution in contributions:
+                # Members whose costs exceed the HSA pay the difference
+                index = bisect_right(values, contribution)
+                costs[in_maximum, out_maximum, contribution] = (
+                    suffix_weighted[index] -
+                    contribution * suffix_weights[index])
+
+    elif inner == 'in_network':
+        for out_maximum, contribution in product(out_maximums, contributions):
+            sums = capped_sums(in_costs,
+                [min(out_maximum, out_cost) - contribution
+                    for out_cost in out_costs],
+                weights, in_maximums)
+            for in_maximum, cost in zip(in_maximums, sums):
+                costs[in_maximum, out_maximum, contribution] = cost
+
+    else:
+        for in_maximum, contribution in product(in_maximums, contributions):
+            sums = capped_sums(out_costs,
+                [min(in_maximum, in_cost) - contribution
+                    for in_cost in in_costs],
+                weights, out_maximums)
+            for out_maximum, cost in zip(out_maximums, sums):
+                costs[in_maximum, out_maximum, contribution] = cost
+
+    return costs
+
+
+def grid_search(base_plan, population,
+        premium=None, hsa_contribution=None,
+        in_network=NetworkAxes(), out_of_network=NetworkAxes(), months=12):
+    '''
+    Evaluate the full cross-product of plan designs around `base_plan`
+    against `population`, an iterable of members' services in the frontend
+    request format. `premium` and `hsa_contribution` are sequences of values
+    to try, and `in_network` and `out_of_network` are NetworkAxes.
+
+    Returns a list of designs, each a dict of its parameters along with:
+
+        employee_cost: premiums plus out of pocket costs after the HSA
+        employer_cost: HSA contributions plus claims paid (sticker prices
+            less what members paid)
+    '''
+    members = Counter(
+        tuple(convert_services(services)) for services in population)
+    member_count = sum(members.values())
+    weights = list(members.values())
+    members = list(members)
+
+    premiums = premium or (base_plan.premium,)
+    contributions = hsa_contribution or (base_plan.hsa_contribution,)
+
+    networks = []
+    for base, axes in (
+            (base_plan.in_network, in_network),
+            (base_plan.out_of_network, out_of_network)):
+        maximums = axes.out_of_pocket_max or (base.out_of_pocket_max,)
+
+        # Each variant's claims paid only needs its own costs, capped by each
+        # maximum
+        variants = []
+        for description, network in network_variants(base, axes):
+            costs = [network.compiled_sim(services).out_of_pocket
+                for services in members]
+            variants.append((description, costs,
+                capped_sums(costs, [0] * len(costs), weights, maximums)))
+
+        sticker = sum(weight * service.cost
+            for services, weight in zip(members, weights)
+            for service in services
+            if service.in_network == base.in_network)
+
+        networks.append((variants, maximums, sticker))
+
+    (in_variants, in_maximums, in_sticker), \
+        (out_variants, out_maximums, out_sticker) = networks
+    sticker = in_sticker + out_sticker
+
+    designs = []
+    for (in_description, in_costs, in_totals), \
+            (out_description, out_costs, out_totals) in product(
+                in_variants, out_variants):
+        costs = services_costs(in_costs, out_costs, weights,
+            in_maximums, out_maximums, contributions)
+
+        for (in_maximum, in_total), (out_maximum, out_total) in product(
+                zip(in_maximums, in_totals), zip(out_maximums, out_totals)):
+            network_total = in_total + out_total
+
+            for contribution in contributions:
+                services_cost = costs[in_maximum, out_maximum, contribution]
+
+                for plan_premium in premiums:
+                    designs.append({
+                        'premium': plan_premium,
+                        'hsa_contribution': contribution,
+                        'in_network': dict(in_description,
+                            out_of_pocket_max=in_maximum),
+                        'out_of_network': dict(out_description,
+                            out_of_pocket_max=out_maximum),
+                        'members': member_count,
+                        'employee_cost':
+                            services_cost + plan_premium * months * member_count,
+                        'employer_cost':
+                            contribution * member_count + sticker - network_total,
+                    })
+
+    return designs
@@ -0,0 +1,165 @@
+'''
+A dominance index over a catalog's plans, for finding the cheapest plans
+without simulating all of them.
+
+Each plan is reduced, once, to a few constants per network: the deductible,
+the out of pocket maximum, and the lowest and highest fraction of a
+service's cost that its coverage rules can charge. From those, a plan's
+total cost is bounded by the spend in each network alone:
+
+- Services subject to the deductible pay their full cost until it's met,
+  and at least the lowest post-deductible rate after it. Services that
+  ignore the deductible pay at least their own lowest rate. Mixing the two
+  kinds of service can only land between spending everything on one kind
+  or the other, so the lower bound is the cheaper of those.
+- No service pays more than the highest rate (at least 1, as uncovered
+  services pay in full), so the upper bound is that rate times the spend.
+- Both are capped by the out of pocket maximum, and the HSA contribution and
+  premiums are applied as in Plan.combine_results.
+
+A plan whose lower bound is above the N-th lowest upper bound can't be among
+the N cheapest, and once N plans have been simulated, any plan whose lower
+bound is above the N-th cheapest result can't be either.
+'''
+
+from collections import namedtuple
+import heapq
+import math
+
+
+def rule_rates(mod):
+    '''
+    The (lowest, highest) fraction of a cost that a mod can charge
+    '''
+    kind, value = getattr(mod, 'rule', (None, None))
+    if kind == 'copay':
+        return 0, 1
+    elif kind == 'coinsure':
+        return value / 100, value / 100
+    elif kind == 'covered':
+        return 0, 0
+    elif kind == 'not_covered':
+        return 1, 1
+    else:
+        # Nothing is known about untagged mods
+        return 0, math.inf
+
+
+class NetworkRates(namedtuple('NetworkRates', ('deductible',
+        'out_of_pocket_max', 'deductible_rate', 'ignore_rate', 'upper_rate'))):
+    '''
+    The constants bounding a network's cost. `ignore_rate` is None if no
+    service ignores the deductible.
+    '''
+    @classmethod
+    def from_network(cls, network):
+        # Unlisted services aren't covered, and are subject to the deductible
+        deductible_rate = 1
+        ignore_rate = None
+        upper_rate = 1
+
+        for offered in network.services.values():
+            lowest, highest = rule_rates(offered.mod)
+            upper_rate = max(upper_rate, highest)
+            if offered.ignore_deductible:
+                ignore_rate = lowest if ignore_rate is None else min(ignore_rate, lowest)
+            else:
+                deductible_rate = min(deductible_rate, lowest)
+
+        return cls(network.deductible, network.out_of_pocket_max,
+            deductible_rate, ignore_rate, upper_rate)
+
+    def bounds(self, spend):
+        '''
+        The (lowest, highest) out of pocket cost for services costing `spend`
+        '''
+        if spend <= 0:
+            return 0, 0
+
+        low = (min(self.deductible, spend) +
+            self.deductible_rate * max(spend - self.deductible, 0))
+        if self.ignore_rate is not None:
+            low = min(low, self.ignore_rate * spend)
+
+        return (
+            min(self.out_of_pocket_max, low),
+            min(self.out_of_pocket_max, self.upper_rate * spend))
+
+
+class PlanBounds(namedtuple('PlanBounds',
+        ('premium', 'hsa_contribution', 'in_network', 'out_of_network'))):
+    @classmethod
+    def from_plan(cls, plan):
+        return cls(plan.premium, plan.hsa_contribution,
+            NetworkRates.from_network(plan.in_network),
+            NetworkRates.from_network(plan.out_of_network))
+
+    def bounds(self, in_network_spend, out_of_network_spend, months=12):
+        '''
+        The (lowest, highest) total out of pocket cost, premiums included
+        '''
+        in_low, in_high = self.in_network.bounds(in_network_spend)
+        out_low, out_high = self.out_of_network.bounds(out_of_network_spend)
+        premiums = self.premium * months
+
+        return (
+            premiums + max(in_low + out_low - self.hsa_contribution, 0),
+            premiums + max(in_high + out_high - self.hsa_contribution, 0))
+
+
+def network_spend(services):
+    '''
+    The total cost of the in-network and out-of-network Services
+    '''
+    spend = {True: 0, False: 0}
+    for service in services:
+        spend[service.in_network] += service.cost
+    return spend[True], spend[False]
+
+
+def find_best_plans(plans, plan_bounds, services, count, months=12):
+    '''
+    Find the `count` cheapest of `plans` ({name: Plan}) for the Services,
+    using `plan_bounds` ({name: PlanBounds}) to skip plans that can't be
+    among them. Returns the ranked [(name, SimResult)] and a report of the
+    simulation work avoided.
+    '''
+    services = tuple(services)
+    in_spend, out_spend = network_spend(services)
+
+    bounds = sorted(
+        (plan_bounds[name].bounds(in_spend, out_spend, months), name)
+        for name in plans)
+
+    # At least `count` plans cost no more than this
+    uppers = sorted(high for (_, high), _ in bounds)
+    cutoff = uppers[min(count, len(uppers)) - 1] if uppers else math.inf
+
+    # Max heap (by negated cost) of the best results so far
+    best = []
+    simulated = []
+    for (low, _), name in bounds:
+        if low > cutoff:
+            break
+        if len(best) == count and low > -best[0][0]:
+            break
+
+        result = plans[name].run_sim(services, months)
+        simulated.append(name)
+        entry = (-result.out_of_pocket, name, result)
+        if len(best) < count:
+            heapq.heappush(best, entry)
+        elif entry > best[0]:
+            heapq.heapreplace(best, entry)
+
+    ranked = [(name, result)
+        for _, name, result in sorted(best, key=lambda entry: (-entry[0], entry[1]))]
+    skipped = sorted(set(plans) - set(simulated))
+
+    return ranked, {
+        'plans': len(plans),
+        'simulated': len(simulated),
+        'skipped': skipped,
+        # Each skipped plan would have simulated every service
+        'services_avoided': len(skipped) * len(services),
+    }
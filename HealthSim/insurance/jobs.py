@@ -0,0 +1,517 @@
+'''
+Asynchronous simulation jobs, for work too big to finish within a request:
+large batches of named scenarios, aggregates over many scenarios (given, or
+random usage drawn from the catalog), and plan design grid searches.
+
+Jobs are queued in a table of a local SQLite database, so the web processes
+and the workers (see the run_jobs management command) only share a file. A
+worker claims the oldest queued job, runs it in chunks, and after each chunk
+records its progress and the partial aggregate of the results so far, which
+is also when it notices the job was cancelled. Finished results are written
+as JSON files to the result directory, to be downloaded, and are purged
+after a while by the workers.
+
+Job ids are random, and act as the capability to poll, cancel and download.
+'''
+
+import json
+import math
+import os
+import random
+import sqlite3
+import time
+import uuid
+
+from .aggregate import ResultAggregator
+from .catalogs import get_catalog
+from .design import NetworkAxes, grid_search
+from .kernel import OfferedService, rule_mod
+from .plans import convert_services
+
+
+schema = '''
+CREATE TABLE IF NOT EXISTS simulation_jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    partial TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+)
+'''
+
+job_fields = ('id', 'kind', 'params', 'status', 'done', 'total', 'partial',
+    'error', 'created', 'started', 'finished')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def random_scenarios(catalog, count, seed=None, mean_services=8):
+    '''
+    Yield `count` random scenarios in the frontend request format: a random
+    number of services from the catalog, with lognormal prices, mostly in
+    network
+    '''
+    rng = random.Random(seed)
+    services = sorted(name for name, _ in catalog.get_service_list())
+
+    for _ in range(count):
+        yield {'me': [{
+                'service': rng.choice(services),
+                'price': round(rng.lognormvariate(5, 1), 2),
+                'in_network': rng.random() < 0.85}
+            for _ in range(int(rng.expovariate(1 / mean_services)) + 1)]}
+
+
+def network_axes(params):
+    '''
+    NetworkAxes from a job's JSON description: lists of "deductible" and
+    "out_of_pocket_max" values, and {service: [options]}, where each option
+    is {"rule": [kind, value], "ignore_deductible": bool}
+    '''
+    services = params.get('services')
+    if services is not None:
+        services = {name: [
+                OfferedService(rule_mod(*option['rule']),
+                    option.get('ignore_deductible', False))
+                for option in options]
+            for name, options in services.items()}
+
+    return NetworkAxes(params.get('deductible'),
+        params.get('out_of_pocket_max'), services)
+
+
+def json_safe(value):
+    '''
+    Replace the infinite and NaN floats in a result, which JSON can't
+    represent, with None
+    '''
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    elif isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    return value
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def check_scenarios(scenarios, what):
+    '''
+    Check that `scenarios` is a list of scenarios in the frontend request
+    format. Raises ValueError (or InvalidService) if not.
+    '''
+    if not isinstance(scenarios, list):
+        raise ValueError('"{}" must be a list of scenarios'.format(what))
+    for scenario in scenarios:
+        if not isinstance(scenario, dict):
+            raise ValueError('Each of the "{}" must be {{"me": '
+                '[services...]}}'.format(what))
+        for _ in convert_services(scenario):
+            pass
+
+
+def check_numbers(params, name):
+    '''
+    Check that the optional `name` parameter is a list of numbers
+    '''
+    values = params.get(name)
+    if values is not None and (not isinstance(values, list) or
+            not all(is_number(value) for value in values)):
+        raise ValueError('"{}" must be a list of numbers'.format(name))
+
+
+def check_batch_params(params):
+    scenarios = params.get('scenarios')
+    if not isinstance(scenarios, dict):
+        raise ValueError('A batch job needs "scenarios", an object of named '
+            'scenarios')
+    check_scenarios(list(scenarios.values()), 'scenarios')
+
+
+def check_aggregate_params(params):
+    if 'random' not in params:
+        check_scenarios(params.get('scenarios'), 'scenarios')
+        return
+
+    options = params['random']
+    if (not isinstance(options, dict) or
+            not isinstance(options.get('count'), int) or
+            isinstance(options['count'], bool) or options['count'] < 0):
+        raise ValueError('"random" must give a "count" of scenarios')
+    if not isinstance(options.get('seed'), (type(None), int, str)):
+        raise ValueError('The "seed" must be a number or a string')
+
+
+def check_grid_params(params):
+    if not isinstance(params.get('plan'), str):
+        raise ValueError('A grid job needs the name of a base "plan"')
+    check_scenarios(params.get('population'), 'population')
+    check_numbers(params, 'premium')
+    check_numbers(params, 'hsa_contribution')
+
+    months = params.get('months', 12)
+    if not is_number(months) or months <= 0:
+        raise ValueError('"months" must be a positive number')
+
+    for network in ('in_network', 'out_of_network'):
+        axes = params.get(network, {})
+        if not isinstance(axes, dict):
+            raise ValueError('"{}" must be an object'.format(network))
+        check_numbers(axes, 'deductible')
+        check_numbers(axes, 'out_of_pocket_max')
+        try:
+            network_axes(axes)
+        except (AttributeError, KeyError, TypeError):
+            raise ValueError('"{}" services must be {{service: [{{"rule": '
+                '[kind, value], "ignore_deductible": bool}}]}}'.format(network))
+
+
+class JobQueue:
+    def __init__(self, path=None, result_dir=None, chunk_size=100):
+        self.path = path
+        self.result_dir = result_dir
+        self.chunk_size = chunk_size
+
+    def configure(self, path, result_dir, chunk_size=None):
+        self.path = path
+        self.result_dir = result_dir
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+
+    def connect(self):
+        '''
+        A new connection, in autocommit mode. Connections aren't shared, as
+        the queue is used from many processes.
+        '''
+        if self.path is None:
+            raise RuntimeError('The job queue isn\'t configured')
+
+        connection = sqlite3.connect(self.path, timeout=30,
+            isolation_level=None)
+        connection.execute(schema)
+        return connection
+
+    def execute(self, query, args=()):
+        connection = self.connect()
+        try:
+            return connection.execute(query, args)
+        finally:
+            connection.close()
+
+    def result_path(self, job_id):
+        return os.path.join(self.result_dir, '{}.json'.format(job_id))
+
+    def submit(self, kind, params):
+        '''
+        Queue a job, returning its id. Raises ValueError for unknown kinds,
+        and for params the kind can't run.
+        '''
+        if kind not in job_runners:
+            raise ValueError('Unknown job kind {}'.format(kind))
+        job_param_checks[kind](params)
+
+        job_id = uuid.uuid4().hex
+        self.execute(
+            'INSERT INTO simulation_jobs (id, kind, params, status, created) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (job_id, kind, json.dumps(params), 'queued', time.time()))
+        return job_id
+
+    def get(self, job_id):
+        '''
+        A job's status, progress and partial results. Raises KeyError for
+        unknown jobs.
+        '''
+        connection = self.connect()
+        try:
+            row = connection.execute(
+                'SELECT {} FROM simulation_jobs WHERE id = ?'.format(
+                    ', '.join(job_fields)),
+                (job_id,)).fetchone()
+        finally:
+            connection.close()
+
+        if row is None:
+            raise KeyError(job_id)
+
+        job = dict(zip(job_fields, row))
+        job['params'] = json.loads(job['params'])
+        job['partial'] = json.loads(job['partial']) if job['partial'] else None
+        return job
+
+    def status(self, job_id):
+        '''
+        The job's public state, without its parameters
+        '''
+        job = self.get(job_id)
+        del job['params']
+        job['progress'] = job['done'] / job['total'] if job['total'] else None
+        return job
+
+    def cancel(self, job_id):
+        '''
+        Cancel a queued or running job. Running jobs stop after their current
+        chunk. Returns the job's status afterwards.
+        '''
+        self.execute(
+            'UPDATE simulation_jobs SET status = ?, finished = ? '
+            'WHERE id = ? AND status IN (?, ?)',
+            ('cancelled', time.time(), job_id, 'queued', 'running'))
+        return self.get(job_id)['status']
+
+    def claim(self):
+        '''
+        Atomically take the oldest queued job, marking it running. Returns
+        (id, kind, params), or None if nothing is queued.
+        '''
+        connection = self.connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute(
+                'SELECT id, kind, params FROM simulation_jobs '
+                'WHERE status = ? ORDER BY created LIMIT 1',
+                ('queued',)).fetchone()
+            if row is not None:
+                connection.execute(
+                    'UPDATE simulation_jobs SET status = ?, started = ? '
+                    'WHERE id = ?',
+                    ('running', time.time(), row[0]))
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+        if row is None:
+            return None
+        job_id, kind, params = row
+        return job_id, kind, json.loads(params)
+
+    def progress(self, job_id, done, total, partial=None):
+        '''
+        Record a running job's progress. Raises JobCancelled if the job isn't
+        running anymore.
+        '''
+        updated = self.execute(
+            'UPDATE simulation_jobs SET done = ?, total = ?, partial = ? '
+            'WHERE id = ? AND status = ?',
+            (done, total,
+                None if partial is None else json.dumps(json_safe(partial)),
+                job_id, 'running')).rowcount
+        if not updated:
+            raise JobCancelled(job_id)
+
+    def finish(self, job_id, result):
+        '''
+        Write a job's result for download, and mark it done (unless it was
+        cancelled in the meantime)
+        '''
+        os.makedirs(self.result_dir, exist_ok=True)
+        path = self.result_path(job_id)
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as result_file:
+            json.dump(json_safe(result), result_file)
+        os.replace(temporary, path)
+
+        updated = self.execute(
+            'UPDATE simulation_jobs SET status = ?, finished = ? '
+            'WHERE id = ? AND status = ?',
+            ('done', time.time(), job_id, 'running')).rowcount
+        if not updated:
+            os.remove(path)
+
+    def fail(self, job_id, error):
+        self.execute(
+            'UPDATE simulation_jobs SET status = ?, error = ?, finished = ? '
+            'WHERE id = ? AND status = ?',
+            ('failed', error, time.time(), job_id, 'running'))
+
+    def requeue_running(self):
+        '''
+        Put jobs left running by workers that died back in the queue. Only
+        safe when no workers are running.
+        '''
+        return self.execute(
+            'UPDATE simulation_jobs SET status = ?, done = 0, partial = NULL, '
+            'started = NULL WHERE status = ?',
+            ('queued', 'running')).rowcount
+
+    def purge(self, max_age):
+        '''
+        Forget jobs that finished more than `max_age` seconds ago, and delete
+        their results. Returns the number of jobs purged.
+        '''
+        cutoff = time.time() - max_age
+        connection = self.connect()
+        try:
+            job_ids = [job_id for job_id, in connection.execute(
+                'SELECT id FROM simulation_jobs WHERE finished < ?',
+                (cutoff,))]
+            connection.execute(
+                'DELETE FROM simulation_jobs WHERE finished < ?', (cutoff,))
+        finally:
+            connection.close()
+
+        for job_id in job_ids:
+            try:
+                os.remove(self.result_path(job_id))
+            except FileNotFoundError:
+                pass
+        return len(job_ids)
+
+    def run(self, job_id, kind, params):
+        '''
+        Run a claimed job to completion, cancellation or failure
+        '''
+        try:
+            result = job_runners[kind](self, job_id, params)
+        except JobCancelled:
+            return
+        except Exception as error:
+            self.fail(job_id, '{}: {}'.format(type(error).__name__, error))
+            return
+
+        self.finish(job_id, result)
+
+    def run_next(self):
+        '''
+        Claim and run one job. Returns False if nothing was queued.
+        '''
+        job = self.claim()
+        if job is None:
+            return False
+        self.run(*job)
+        return True
+
+    def work(self, poll_interval=1, max_age=None, purge_interval=60 * 60):
+        '''
+        Run jobs forever, waiting `poll_interval` seconds when idle. With a
+        `max_age`, jobs that finished longer ago than that are purged every
+        `purge_interval` seconds, between jobs.
+        '''
+        purged = time.monotonic()
+        while True:
+            if (max_age is not None and
+                    time.monotonic() - purged >= purge_interval):
+                self.purge(max_age)
+                purged = time.monotonic()
+
+            if not self.run_next():
+                time.sleep(poll_interval)
+
+
+def job_catalog(params):
+    return get_catalog(params.get('employer'), params.get('year'))
+
+
+def run_scenario_chunks(queue, job_id, scenarios, total, simulate):
+    '''
+    Feed `scenarios` to `simulate(chunk, aggregator)` a chunk at a time,
+    recording progress and the partial summary after each chunk
+    '''
+    aggregator = ResultAggregator()
+    queue.progress(job_id, 0, total)
+
+    done = 0
+    chunk = []
+    for scenario in scenarios:
+        chunk.append(scenario)
+        if len(chunk) == queue.chunk_size:
+            simulate(chunk, aggregator)
+            done += len(chunk)
+            chunk = []
+            queue.progress(job_id, done, total, aggregator.summary())
+    if chunk:
+        simulate(chunk, aggregator)
+        done += len(chunk)
+        queue.progress(job_id, done, total, aggregator.summary())
+
+    return aggregator.summary()
+
+
+def run_batch_job(queue, job_id, params):
+    '''
+    {"scenarios": {name: {"me": [services...]}}}: every scenario's results,
+    like the batch endpoint, and their summary
+    '''
+    catalog = job_catalog(params)
+    scenarios = params['scenarios']
+    results = {}
+
+    def simulate(chunk, aggregator):
+        for name, scenario_results in catalog.run_batch(dict(chunk)).items():
+            results[name] = {plan_name: result.to_dict()
+                for plan_name, result in scenario_results.items()}
+            for plan_name, result in scenario_results.items():
+                aggregator.add(plan_name, result)
+
+    summary = run_scenario_chunks(queue, job_id, sorted(scenarios.items()),
+        len(scenarios), simulate)
+    return {'summary': summary, 'results': results}
+
+
+def run_aggregate_job(queue, job_id, params):
+    '''
+    {"scenarios": [{"me": [services...]}, ...]}, or {"random": {"count": n,
+    "seed": s}} for random usage: only the summary of the results is kept
+    '''
+    catalog = job_catalog(params)
+    if 'random' in params:
+        total = int(params['random']['count'])
+        scenarios = random_scenarios(catalog, total,
+            params['random'].get('seed'))
+    else:
+        scenarios = params['scenarios']
+        total = len(scenarios)
+
+    summary = run_scenario_chunks(queue, job_id, scenarios, total,
+        catalog.aggregate_simulations)
+    return {'summary': summary}
+
+
+def run_grid_job(queue, job_id, params):
+    '''
+    {"plan": name, "population": [{"me": [services...]}, ...], "premium":
+    [...], "hsa_contribution": [...], "in_network": axes, "out_of_network":
+    axes}: design.grid_search around a catalog plan. The grid is resolved in
+    one step, so progress goes from 0 to 1.
+    '''
+    catalog = job_catalog(params)
+    base_plan = catalog.plans[params['plan']]
+    queue.progress(job_id, 0, 1)
+
+    designs = grid_search(base_plan, params['population'],
+        premium=params.get('premium'),
+        hsa_contribution=params.get('hsa_contribution'),
+        in_network=network_axes(params.get('in_network', {})),
+        out_of_network=network_axes(params.get('out_of_network', {})),
+        months=params.get('months', 12))
+
+    queue.progress(job_id, 1, 1)
+    return {'designs': designs}
+
+
+job_runners = {
+    'batch': run_batch_job,
+    'aggregate': run_aggregate_job,
+    'grid': run_grid_job,
+}
+
+job_param_checks = {
+    'batch': check_batch_params,
+    'aggregate': check_aggregate_params,
+    'grid': check_grid_params,
+}
+
+
+jobs = JobQueue()
+configure_jobs = jobs.configure
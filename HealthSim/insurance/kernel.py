@@ -0,0 +1,243 @@
+'''
+The simulation kernel shared by the notebook engine (insurance.py, with its
+month by month trackers) and the web engine (plans.py): the threshold
+arithmetic, coverage rules, the literal services they apply to, and the
+network loop itself. codegen.py compiles the same loop, specialized to a
+network's rules; the conformance tests check that every front end agrees.
+
+Services a network doesn't list aren't covered: they're paid in full,
+toward the deductible and the out of pocket maximum.
+'''
+
+from collections import namedtuple
+
+
+def apply_to_threshold(threshold, cost):
+    '''
+    Given some maximum cumulative threshold, apply a cost to the threshold.
+    Returns the amount applied to the threshold, the remaining value of the
+    threshold, and any overflow to the cost.
+
+    Examples:
+
+    100, 10 -> 10, 90, 0
+    60, 100 -> 60, 0, 40
+    '''
+    from_max = min(threshold, cost)
+    return from_max, threshold - from_max, cost - from_max
+
+
+def threshold_overflow(threshold, cost):
+    '''
+    Perfom an apply_to_threshold, returning the new threshold and the overflow.
+    Discard the amount applied to the threshold
+    '''
+    return apply_to_threshold(threshold, cost)[1:3]
+
+
+def at_threshold(threshold, cost):
+    '''
+    Perform an apply_to_threshold, returning the amount applied and the
+    remaining value of the threshold. Discard the overflow.
+    '''
+    return apply_to_threshold(threshold, cost)[0:2]
+
+
+def run_payments(deductible, cost, mod, ignore_deductible, count):
+    '''
+    Resolve `count` identical services at once, without the out of pocket
+    maximum. Returns the total paid and the remaining deductible. Some
+    services are paid entirely toward the deductible, at most one is split
+    across it, and the rest are paid after it's met. The out of pocket
+    maximum is a cap on the running total, so it can be applied to the
+    returned total at once.
+
+    Because this multiplies rather than adding one service at a time, float
+    results can differ from a one-by-one simulation in the last place.
+    '''
+    if ignore_deductible or deductible <= 0 or cost <= 0:
+        return mod(cost) * count, deductible
+
+    absorbed = min(count, int(deductible // cost))
+    payments = absorbed * (cost + mod(0))
+    deductible = max(deductible - absorbed * cost, 0)
+    count -= absorbed
+
+    if count and deductible > 0:
+        payments += deductible + mod(cost - deductible)
+        deductible = 0
+        count -= 1
+
+    return payments + mod(cost) * count, deductible
+
+
+def coverage_rule(kind, value=None):
+    '''
+    Tag a mod function with the rule it implements, as (kind, value), so that
+    plans can be described and compared without calling the mods.
+    '''
+    def decorator(mod):
+        mod.rule = (kind, value)
+        return mod
+    return decorator
+
+
+def copay(amount):
+    return coverage_rule('copay', amount)(lambda cost: min(cost, amount))
+
+
+def coinsure(percent):
+    mult = percent / 100
+    return coverage_rule('coinsure', percent)(lambda cost: cost * mult)
+
+
+def covered():
+    return coverage_rule('covered')(lambda cost: 0)
+
+
+def not_covered():
+    return coverage_rule('not_covered')(lambda cost: cost)
+
+
+rule_mods = {
+    'copay': copay,
+    'coinsure': coinsure,
+    'covered': covered,
+    'not_covered': not_covered,
+}
+
+
+def rule_mod(kind, value=None):
+    '''
+    Create the mod for a coverage rule, the reverse of mod.rule
+    '''
+    if value is None:
+        return rule_mods[kind]()
+    return rule_mods[kind](value)
+
+
+class OfferedService(namedtuple('OfferedService',
+        ('mod', 'ignore_deductible'))):
+    '''
+    OfferedService represents data about a service offered by a single plan.
+    For instance, in-network PCP.
+
+    type is a function which, when called with a price, returns the updated
+    price under the plan. This mod is called *after* the deductible is met, and
+    before the out-of-pocket max is met. This is a function which modifies the
+    price correctly. The assumption is that, before deductible, the user is
+    paying 100%, and after out of pocket max, they are paying 0%.
+
+    If ignore_deductible is True, the mod should be applied right away to the
+    cost of the service.
+    '''
+    def __new__(cls, mod=not_covered(), ignore_deductible=False):
+        return super().__new__(cls, mod, ignore_deductible)
+
+
+uncovered = OfferedService()
+
+
+def offered_service(details):
+    '''
+    Normalize a network's entry for a service, which may be an
+    OfferedService, a (mod, ignore_deductible) pair, a bare mod, or None for
+    a service the network doesn't list
+    '''
+    if details is None:
+        return uncovered
+    if isinstance(details, OfferedService):
+        return details
+    if isinstance(details, tuple):
+        return OfferedService(*details)
+    return OfferedService(details)
+
+
+def coverage(services, name):
+    '''
+    Look up how a network covers a service by name
+    '''
+    return offered_service(services.get(name))
+
+
+class LiteralService(namedtuple('LiteralService',
+        ('cost', 'mod', 'ignore_deductible', 'count'))):
+    '''
+    LiteralService is the internal representation of a service requested by a
+    user. It is generated by combining a Service with an Offered service. This
+    is the object used to actually perform the calculations. `count` identical
+    services in a row are resolved at once.
+    '''
+    def __new__(cls, cost, mod, ignore_deductible=False, count=1):
+        return super().__new__(cls, cost, mod, ignore_deductible, count)
+
+    @classmethod
+    def create(cls, requested_service, offered_service):
+        '''
+        Combine a requested_service and an offered_service
+        '''
+        return cls(
+            requested_service.cost,
+            offered_service.mod,
+            offered_service.ignore_deductible)
+
+
+class NetworkSimResult(namedtuple('NetworkSimResult',
+        ('out_of_pocket', 'deductible', 'oop_maximum'))):
+    '''
+    The result of a individual network simulation. Contains the amount paid,
+    the remaining deductible, and the remaining out of pocket maximum.
+    '''
+
+
+class Network(namedtuple('Network',
+        ('deductible', 'out_of_pocket_max', 'services', 'in_network'))):
+    '''
+    The static description of a network that codegen.compile_network needs,
+    for front ends without a NetworkDetails
+    '''
+
+
+def run_network(services, deductible, oop_maximum):
+    '''
+    Simulate literal services through a network, starting from the given
+    remaining deductible and out of pocket maximum. Returns a
+    NetworkSimResult of the amount paid and the remaining thresholds.
+
+    Once the deductible and out of pocket maximum are both used up, every
+    further service is free, so the services aren't looked at anymore.
+    '''
+    out_of_pocket = 0
+
+    for cost, mod, ignore_deductible, count in services:
+        if oop_maximum <= 0 and deductible <= 0:
+            # Saturated: everything from here on is free
+            break
+
+        if count != 1:
+            # Resolve a run of identical services at once
+            payments, deductible = run_payments(
+                deductible, cost, mod, ignore_deductible, count)
+            pocket_cost, oop_maximum = at_threshold(oop_maximum, payments)
+            out_of_pocket += pocket_cost
+            continue
+
+        if not ignore_deductible:
+            # Apply the deductible
+            # `pre_deduct` is the amount applied to the deductible.
+            # `deductible` is the remaining deductible
+            # `cost` is any remaining cost after the deductible
+            pre_deduct, deductible, cost = apply_to_threshold(deductible, cost)
+
+            # Apply the out of pocket maximum
+            # `pocket_cost` is the amount allowed by the out of pocket max
+            # `oop_maximum` is the remaining out of pocket maximum
+            pocket_cost, oop_maximum = at_threshold(oop_maximum, pre_deduct)
+            out_of_pocket += pocket_cost
+
+        # Apply the mod (coinsurance or copay) to the cost after or ignoring
+        # the deductible, then apply the out of pocket maximum
+        pocket_cost, oop_maximum = at_threshold(oop_maximum, mod(cost))
+        out_of_pocket += pocket_cost
+
+    return NetworkSimResult(out_of_pocket, deductible, oop_maximum)
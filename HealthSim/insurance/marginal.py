@@ -0,0 +1,127 @@
+'''
+Marginal costs: how much a network's out of pocket cost changes when one
+service is removed, or one more is added, without re-running the simulation
+for each.
+
+The out of pocket maximum caps the running total, so a network's cost is
+min(out of pocket maximum, sum of the uncapped payments). The deductible
+doesn't depend on the out of pocket maximum, so the uncapped payments only
+depend on how much deductible is left when each service is received. One
+forward pass saves, for the services subject to the deductible, the running
+totals of their costs, of what they paid, and of what they would have paid
+had all of their cost gone toward the deductible.
+
+Removing a service leaves its share of the deductible to the services after
+it. Those that were already entirely within the deductible are unchanged, as
+are those after the (larger) deductible is met, so only a window of services
+in between pays differently: all but the last pay in full toward the
+deductible, and the last may be split across it. The window is found by
+bisecting the running costs, so each removal is O(log n).
+'''
+
+from bisect import bisect_right
+
+
+def payment(cost, mod, ignore_deductible, deductible):
+    '''
+    The uncapped payment for a service, with `deductible` remaining
+    '''
+    if ignore_deductible:
+        return mod(cost)
+
+    absorbed = min(deductible, cost)
+    return absorbed + mod(cost - absorbed)
+
+
+class NetworkTrace:
+    '''
+    The saved state of a network simulation of single literal (cost, mod,
+    ignore_deductible, 1) services, for marginal costs.
+    '''
+    def __init__(self, services, deductible, out_of_pocket_max):
+        self.services = list(services)
+        self.deductible = deductible
+        self.out_of_pocket_max = out_of_pocket_max
+
+        # For each service, its position among the deductible services, or
+        # None if it ignores the deductible
+        self.positions = []
+        self.deductible_services = [None]
+
+        # Running totals over the deductible services: cost, payment, and the
+        # payment had the service been entirely within the deductible
+        self.spent = [0]
+        self.paid = [0]
+        self.absorbed = [0]
+
+        fixed = 0
+        remaining = deductible
+        for cost, mod, ignore_deductible, count in self.services:
+            if count != 1:
+                raise ValueError('Marginal costs need single services')
+
+            if ignore_deductible:
+                self.positions.append(None)
+                fixed += mod(cost)
+                continue
+
+            self.positions.append(len(self.spent))
+            self.deductible_services.append((cost, mod))
+            self.paid.append(self.paid[-1] + payment(cost, mod, False, remaining))
+            self.absorbed.append(self.absorbed[-1] + cost + mod(0))
+            self.spent.append(self.spent[-1] + cost)
+            remaining = max(remaining - cost, 0)
+
+        self.remaining = remaining
+        self.uncapped = fixed + self.paid[-1]
+
+    def total(self, uncapped=None):
+        '''
+        The network's out of pocket cost, given the uncapped payments
+        '''
+        if uncapped is None:
+            uncapped = self.uncapped
+        return min(self.out_of_pocket_max, uncapped)
+
+    def without(self, index):
+        '''
+        The network's out of pocket cost without the service at `index`
+        '''
+        cost, mod, ignore_deductible, _ = self.services[index]
+        position = self.positions[index]
+        if position is None:
+            return self.total(self.uncapped - mod(cost))
+
+        uncapped = self.uncapped - (self.paid[position] - self.paid[position - 1])
+        if self.spent[position - 1] >= self.deductible:
+            # The deductible was already met, so nothing after it changes
+            return self.total(uncapped)
+
+        # Later services see this one's share of the deductible, so in terms
+        # of the running costs (which include this one), the deductible is
+        # met at `limit` instead
+        spent = self.spent
+        limit = self.deductible + cost
+
+        # The window starts at the first service that wasn't entirely within
+        # the deductible, and services up to `end` now are
+        start = max(bisect_right(spent, self.deductible), position + 1)
+        end = max(bisect_right(spent, limit, start), start)
+
+        uncapped += self.absorbed[end - 1] - self.absorbed[start - 1]
+        if end < len(spent):
+            # The next service is split across the deductible
+            split_cost, split_mod = self.deductible_services[end]
+            uncapped += payment(split_cost, split_mod, False, limit - spent[end - 1])
+            end += 1
+
+        uncapped -= self.paid[end - 1] - self.paid[start - 1]
+        return self.total(uncapped)
+
+    def with_extra(self, cost, mod, ignore_deductible):
+        '''
+        The network's out of pocket cost with one more service, received
+        after all the others
+        '''
+        return self.total(self.uncapped +
+            payment(cost, mod, ignore_deductible, self.remaining))
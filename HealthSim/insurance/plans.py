@@ -1,7 +1,21 @@
 from collections import namedtuple
 from functools import wraps
+from itertools import groupby
+import hashlib
+import json
 import traceback
 
+from .aggregate import ResultAggregator
+from .bounds import network_bounds
+from .codegen import compile_network
+from .dominance import PlanBounds, find_best_plans
+from .kernel import (threshold_overflow, copay, coinsure,
+    covered, not_covered, rule_mod, OfferedService, LiteralService,
+    NetworkSimResult, coverage, run_network)
+from .marginal import NetworkTrace
+from .procedures import lookup_procedure
+from .schedule import run_dated_sim
+
 def unroll(t):
     def decorator(func):
         @wraps(func)
@@ -11,70 +25,27 @@ def unroll(t):
     return decorator
 
 
+class InvalidService(ValueError):
+    '''
+    Raised by convert_services for a requested service that can't be
+    simulated: an unknown service or procedure, or a procedure with no price
+    '''
+
+
 def dump_trace(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
+        except InvalidService:
+            # The request's fault, answered with a 400
+            raise
         except Exception:
             traceback.print_exc()
             raise
     return wrapper
 
 
-def copay(amount):
-    return lambda cost: min(cost, amount)
-
-
-def coinsure(percent):
-    mult = percent / 100
-    return lambda cost: cost * mult
-
-
-def covered():
-    return lambda cost: 0
-
-
-def not_covered():
-    return lambda cost: cost
-
-class OfferedService(namedtuple('OfferedService',
-        ('mod', 'ignore_deductible'))):
-    '''
-    OfferedService represents data about a service offered by a single plan.
-    For instance, in-network PCP.
-
-    type is a function which, when called with a price, returns the updated
-    price under the plan. This mod is called *after* the deductible is met, and
-    before the out-of-pocket max is met. This is a function which modifies the
-    price correctly. The assumption is that, before deductible, the user is
-    paying 100%, and after out of pocket max, they are paying 0%.
-
-    If ignore_deductible is True, the mod should be applied right away to the
-    cost of the service.
-    '''
-    def __new__(cls, mod=not_covered(), ignore_deductible=False):
-        return super().__new__(cls, mod, ignore_deductible)
-
-
-class LiteralService(namedtuple('LiteralService',
-        ('cost', 'mod', 'ignore_deductible'))):
-    '''
-    LiteralService is the internal representation of a service requested by a
-    user. It is generated by combining a Service with an Offered service. This
-    is the object used to actually perform the calculations.
-    '''
-    @classmethod
-    def create(cls, requested_service, offered_service):
-        '''
-        Combine a requested_service and an offered_service
-        '''
-        return cls(
-            requested_service.cost,
-            offered_service.mod,
-            offered_service.ignore_deductible)
-
-
 class Service(namedtuple('Service', ('name', 'cost', 'in_network'))):
     '''
     A Service represents a service requested by a user.
@@ -88,43 +59,19 @@ class Service(namedtuple('Service', ('name', 'cost', 'in_network'))):
         return super().__new__(cls, name, cost, in_network)
 
 
-def apply_to_threshold(threshold, cost):
-    '''
-    Given some maximum cumulative threshold, apply a cost to the threshold.
-    Returns the amount applied to the threshold, the remaining value of the
-    threshold, and any overflow to the cost.
-
-    Examples:
-
-    100, 10 -> 10, 90, 0
-    60, 100 -> 60, 0, 40
-    '''
-    from_max = min(threshold, cost)
-    return from_max, threshold - from_max, cost - from_max
-
-
-def threshold_overflow(threshold, cost):
-    '''
-    Perfom an apply_to_threshold, returning the new threshold and the overflow.
-    Discard the amount applied to the threshold
-    '''
-    return apply_to_threshold(threshold, cost)[1:3]
-
-
-def at_threshold(threshold, cost):
+class ServiceRun(namedtuple('ServiceRun', ('service', 'count'))):
     '''
-    Perform an apply_to_threshold, returning the amount applied and the
-    remaining value of the threshold. Discard the overflow.
+    A run-length encoded Service: `count` identical services in a row, like
+    a year of monthly refills.
     '''
-    return apply_to_threshold(threshold, cost)[0:2]
 
 
-class NetworkSimResult(namedtuple('NetworkSimResult',
-        ('out_of_pocket', 'deductible', 'oop_maximum'))):
+def run_length_encode(services):
     '''
-    The result of a individual network simulation. Contains the amount paid,
-    the remaining deductible, and the remaining out of pocket maximum.
+    Collapse consecutive identical Services into ServiceRuns
     '''
+    for service, run in groupby(services):
+        yield ServiceRun(service, sum(1 for _ in run))
 
 
 class SimResult(namedtuple('SimResult',
@@ -153,19 +100,78 @@ class NetworkDetails:
         self.services = services
         self.in_network = in_network
 
+        # Specialized equivalents of run_sim, which only take Services or
+        # ServiceRuns. run_sim is kept as the reference implementation.
+        self.compiled_sim = compile_network(self, NetworkSimResult)
+        self.compiled_run_sim = compile_network(
+            self, NetworkSimResult, runs=True)
+
     def service_list(self):
         return self.services.keys()
 
+    def to_dict(self):
+        '''
+        A JSON-serializable description of this network. Each service is
+        stored as [kind, value, ignore_deductible], from its coverage rule.
+        '''
+        return {
+            'deductible': self.deductible,
+            'out_of_pocket_max': self.out_of_pocket_max,
+            'in_network': self.in_network,
+            'services': {name: list(offered.mod.rule) + [offered.ignore_deductible]
+                for name, offered in self.services.items()}}
+
+    @classmethod
+    def from_dict(cls, details):
+        return cls(
+            deductible=details['deductible'],
+            out_of_pocket_max=details['out_of_pocket_max'],
+            in_network=details['in_network'],
+            services={name: OfferedService(rule_mod(kind, value), ignore_deductible)
+                for name, (kind, value, ignore_deductible)
+                in details['services'].items()})
+
+    def describe(self):
+        '''
+        A hashable, order-independent description of this network
+        '''
+        return (
+            self.deductible, self.out_of_pocket_max, self.in_network,
+            tuple(sorted(
+                (name, offered.mod.rule, offered.ignore_deductible)
+                for name, offered in self.services.items())))
+
     def get_service(self, service_name):
-        return self.services[service_name]
+        return coverage(self.services, service_name)
 
     def run_sim(self, services):
-        deductible = self.deductible
-        oop_maximum = self.out_of_pocket_max
-        year_out_of_pocket = 0
+        '''
+        Simulate Services (or LiteralServices) through the kernel's
+        interpreted network loop. This is the reference implementation that
+        the compiled simulations must agree with.
+        '''
+        literal_services = []
+        for service in services:
+            if isinstance(service, Service):
+                if service.in_network != self.in_network:
+                    continue
+
+                service = LiteralService.create(
+                    service,
+                    self.get_service(service.name))
 
-        print("Deductible is {}, OOP max is {}".format(deductible, oop_maximum))
+            literal_services.append(service)
 
+        return run_network(
+            literal_services, self.deductible, self.out_of_pocket_max)
+
+    def run_bounds(self, services):
+        '''
+        Compute the cheapest and most expensive results that run_sim could
+        give for these services, over every order they could be received in.
+        Returns a (best, worst) pair of NetworkSimResults.
+        '''
+        literal_services = []
         for service in services:
             if isinstance(service, Service):
                 if service.in_network != self.in_network:
@@ -175,43 +181,12 @@ class NetworkDetails:
                     service,
                     self.get_service(service.name))
 
-            cost = service.cost
-
-            if not service.ignore_deductible:
-                # Apply the deductible
-                # `pre_deduct` is the amount applied to the deductible.
-                # `deductible` is the remaining deductible
-                # `cost` is any remaining cost after the deductible
-                print("Paying {} toward deductible".format(service.cost))
-                pre_deduct, deductible, cost = apply_to_threshold(
-                    deductible,
-                    cost)
-                print("{} deductible remaining".format(deductible))
-
-                # Update the out of pocket maximum
-                # `pocket_cost` is the amount allowed by the out of pocket max.
-                # `oop_maximum` is the remaining out of pocket maximum
-                pocket_cost, oop_maximum = at_threshold(
-                    oop_maximum,
-                    pre_deduct)
-
-                year_out_of_pocket += pocket_cost
-
-            # Apply the mod (coinsurance or copay) to the cost after or
-            # ignoring or applying the deductible, then apply the out of pocket
-            # maximum
-            # `pocket_cost` is the amount allowed by the out of pocket max
-            # `oop_maximum` is the remaining out of pocket maximum
-            print("Made copay/coinsure of {} for cost {}".format(
-                service.mod(cost), cost))
-            pocket_cost, oop_maximum = at_threshold(
-                oop_maximum,
-                service.mod(cost))
-
-            print("{} out of pocket remaining".format(oop_maximum))
-            year_out_of_pocket += pocket_cost
-
-        return NetworkSimResult(year_out_of_pocket, deductible, oop_maximum)
+            literal_services.append(service)
+
+        best, worst = network_bounds(
+            literal_services, self.deductible, self.out_of_pocket_max)
+
+        return NetworkSimResult(*best), NetworkSimResult(*worst)
 
 
 class Plan:
@@ -224,6 +199,26 @@ class Plan:
         self.in_network = in_network
         self.out_of_network = out_of_network
 
+    def describe(self):
+        return (
+            self.premium, self.hsa_contribution,
+            self.in_network.describe(), self.out_of_network.describe())
+
+    def to_dict(self):
+        return {
+            'premium': self.premium,
+            'hsa_contribution': self.hsa_contribution,
+            'in_network': self.in_network.to_dict(),
+            'out_of_network': self.out_of_network.to_dict()}
+
+    @classmethod
+    def from_dict(cls, details):
+        return cls(
+            premium=details['premium'],
+            hsa_contribution=details['hsa_contribution'],
+            in_network=NetworkDetails.from_dict(details['in_network']),
+            out_of_network=NetworkDetails.from_dict(details['out_of_network']))
+
     @unroll(set)
     def service_list(self):
         for network in self.in_network, self.out_of_network:
@@ -242,6 +237,45 @@ class Plan:
                     service, network.get_service(service.name))
 
     def run_sim(self, services, months=12):
+        return self.combine_results(*self.run_network_sims(services),
+            months=months)
+
+    def run_network_sims(self, services):
+        '''
+        Simulate just the networks, returning the (in_network,
+        out_of_network) pair of NetworkSimResults
+        '''
+        services = tuple(services)
+
+        return (
+            self.in_network.compiled_sim(services),
+            self.out_of_network.compiled_sim(services))
+
+    def run_encoded_sim(self, runs, months=12):
+        '''
+        Like run_sim, but takes ServiceRuns (see run_length_encode). Each run
+        is resolved in closed form rather than service by service.
+        '''
+        runs = tuple(runs)
+
+        return self.combine_results(
+            self.in_network.compiled_run_sim(runs),
+            self.out_of_network.compiled_run_sim(runs),
+            months)
+
+    def run_dated_sim(self, services, start, until, plan_year_start=(1, 1)):
+        '''
+        Simulate Dated and Recurring services over one or more plan years.
+        See schedule.run_dated_sim.
+        '''
+        return run_dated_sim(self, services, start, until, plan_year_start)
+
+    def run_reference_sim(self, services, months=12):
+        '''
+        Run the simulation through the NetworkDetails.run_sim interpreter
+        rather than the compiled networks. This is the reference that the
+        compiled simulation must agree with.
+        '''
         services = tuple(services)
 
         in_network = self.in_network.run_sim(
@@ -249,6 +283,88 @@ class Plan:
         out_of_network = self.out_of_network.run_sim(
             self.convert_services(services, self.out_of_network))
 
+        return self.combine_results(in_network, out_of_network, months)
+
+    def run_bounds(self, services, months=12):
+        '''
+        Compute the cheapest and most expensive SimResults over every order
+        the services could be received in. The networks are independent and
+        the HSA is applied to their sum, so the plan bounds are the sums of
+        the network bounds. Returns a (best, worst) pair.
+        '''
+        services = tuple(services)
+
+        in_network = self.in_network.run_bounds(
+            self.convert_services(services, self.in_network))
+        out_of_network = self.out_of_network.run_bounds(
+            self.convert_services(services, self.out_of_network))
+
+        return tuple(
+            self.combine_results(in_result, out_result, months)
+            for in_result, out_result in zip(in_network, out_of_network))
+
+    def run_marginal(self, services, prices=(), months=12):
+        '''
+        Simulate the services, and find how much the out of pocket cost
+        would change without each of them, with another of each of them, and
+        with one more of each service type in `prices`, a {name: price} dict,
+        in each network. Added services are received after all the others.
+
+        Returns the SimResult and a dict of the changes, as lists in the order
+        of `services` for 'remove' and 'add', and as
+        {name: {'in_network': change, 'out_of_network': change}} for
+        'services'.
+        '''
+        services = tuple(services)
+        result = self.run_sim(services, months)
+
+        traces = {}
+        indexes = {}
+        for network in self.in_network, self.out_of_network:
+            network_indexes = [index for index, service in enumerate(services)
+                if service.in_network == network.in_network]
+            traces[network.in_network] = NetworkTrace(
+                self.convert_services(
+                    (services[index] for index in network_indexes), network),
+                network.deductible, network.out_of_pocket_max)
+            indexes[network.in_network] = {index: local
+                for local, index in enumerate(network_indexes)}
+
+        def plan_cost(in_network, changed):
+            # Only the network with the changed service is different
+            totals = {True: traces[True].total(), False: traces[False].total()}
+            totals[in_network] = changed
+            return threshold_overflow(self.hsa_contribution,
+                totals[True] + totals[False])[1]
+
+        base = plan_cost(True, traces[True].total())
+
+        remove = []
+        add = []
+        for index, service in enumerate(services):
+            trace = traces[service.in_network]
+            local = indexes[service.in_network][index]
+            remove.append(plan_cost(service.in_network, trace.without(local)) - base)
+            add.append(plan_cost(service.in_network,
+                trace.with_extra(*trace.services[local][:3])) - base)
+
+        changes = {}
+        for name, price in dict(prices).items():
+            changes[name] = {}
+            for network in self.in_network, self.out_of_network:
+                key = 'in_network' if network.in_network else 'out_of_network'
+                offered = network.get_service(name)
+                changed = traces[network.in_network].with_extra(
+                    price, offered.mod, offered.ignore_deductible)
+                changes[name][key] = plan_cost(network.in_network, changed) - base
+
+        return result, {'remove': remove, 'add': add, 'services': changes}
+
+    def combine_results(self, in_network, out_of_network, months=12):
+        '''
+        Combine the NetworkSimResults for the two networks into a SimResult,
+        applying the HSA contribution and premiums.
+        '''
         hsa = self.hsa_contribution
 
         hsa, out_of_pocket = threshold_overflow(hsa,
@@ -319,21 +435,130 @@ global_service_names = {
 
 global_service_names_reverse = {key: value for value, key in global_service_names.items()}
 
+def service_name(name):
+    '''
+    The service id for a requested service id or name, which must be known
+    '''
+    if name in global_service_names:
+        return name
+    try:
+        return global_service_names_reverse[name]
+    except (KeyError, TypeError):
+        raise InvalidService('Unknown service {}'.format(name))
+
+
+def service_price(price, name):
+    '''
+    Check that a requested price for the named service is a number
+    '''
+    if isinstance(price, bool) or not isinstance(price, (int, float)):
+        raise InvalidService('The price of {} must be a number'.format(name))
+    return price
+
+
 def convert_services(services):
     '''
-    Convert the services dict from the frontend request into list of services
+    Convert the services dict from the frontend request into list of services.
+    A service may name a catalog procedure (by code, and optionally region)
+    instead of a service category, in which case the procedure's category is
+    used, and its typical price unless a price is given.
     '''
     #TODO: families
+    if not isinstance(services.get('me'), list):
+        raise InvalidService('Expected a list of services')
+
     for service in services['me']:
+        if not isinstance(service, dict):
+            raise InvalidService('Each service must be an object')
+        if not isinstance(service.get('in_network'), bool):
+            raise InvalidService('Each service must give in_network as true '
+                'or false')
+
+        if service.get('procedure'):
+            try:
+                procedure = lookup_procedure(
+                    service['procedure'], service.get('region'))
+            except (KeyError, TypeError):
+                raise InvalidService(
+                    'Unknown procedure {}'.format(service['procedure']))
+
+            price = service.get('price')
+            if price is None:
+                price = procedure.price
+            if price is None:
+                raise InvalidService('No price for procedure {} in that '
+                    'region, so one must be given'.format(procedure.code))
+
+            yield Service(procedure.category,
+                service_price(price, procedure.code), service['in_network'])
+            continue
+
+        if 'service' not in service:
+            raise InvalidService('Each service must give a service or a '
+                'procedure')
+
         yield Service(
-            service['service'],
-            service['price'],
+            service_name(service['service']),
+            service_price(service.get('price'), service['service']),
             service['in_network'])
 
 
+def service_input(service):
+    '''
+    Convert a Service into the frontend request format, the reverse of
+    convert_services
+    '''
+    return {
+        'service': global_service_names[service.name],
+        'price': service.cost,
+        'in_network': service.in_network}
+
+
+# The canonical scenarios from the notebook, which most users start from.
+# Yearly services are listed once per occurrence.
+scenario_presets = {
+    'Monthly prescription': [Service('rg', 100)] * 12,
+
+    'Low cost': [
+        Service('rapei', 75),
+        Service('sov', 75),
+        Service('sov', 75),
+        Service('rg', 25),
+        Service('rg', 25),
+        Service('rb', 225)],
+
+    'Medium cost': [
+        Service('er', 550),
+        Service('sov', 75),
+        Service('sov', 75),
+        Service('sov', 75),
+        Service('sov', 75),
+        Service('rg', 25),
+        Service('rg', 25),
+        Service('rg', 25),
+        Service('rg', 25),
+        Service('ucp', 800)],
+
+    'High cost': [Service('er', 550)] * 3 + [Service('sov', 380)] * 10 + [
+        Service('rnf', 220)] * 3 + [Service('ic', 8000)],
+}
+
+
 class GlobalPlans:
+    '''
+    A catalog of plans, with the simulations over all of them. The module
+    level `plans` is the built-in catalog; per-employer catalogs are loaded
+    from storage by catalogs.PlanCatalogs.
+    '''
     def __init__(self):
         self.plans = None
+        self.version = None
+
+        # {plan name: PlanBounds}, for pruning plans that can't be cheapest
+        self.plan_bounds = {}
+
+        # (catalog version, {preset: {plan: result dict}}, serialized JSON)
+        self.preset_results = (None, None, None)
 
     def load_plans(self):
         self.plans = {
@@ -570,6 +795,68 @@ class GlobalPlans:
                         'monf' : OfferedService(not_covered()),
                     }))}
 
+        self.version = self.compute_version()
+        self.plan_bounds = self.compute_plan_bounds()
+        self.simulate_presets()
+
+    def set_plans(self, plans):
+        '''
+        Replace the plans with a {name: Plan} dict. Preset results are
+        simulated when they're first asked for.
+        '''
+        self.plans = plans
+        self.version = self.compute_version()
+        self.plan_bounds = self.compute_plan_bounds()
+
+    def to_dict(self):
+        return {name: plan.to_dict() for name, plan in self.plans.items()}
+
+    @classmethod
+    def from_dict(cls, plans):
+        catalog = cls()
+        catalog.set_plans({name: Plan.from_dict(details)
+            for name, details in plans.items()})
+        return catalog
+
+    def simulate_presets(self):
+        '''
+        Simulate every scenario preset against every plan, and keep the
+        results, already serialized, until the catalog version changes.
+        '''
+        if self.preset_results[0] == self.version:
+            return
+
+        results = {preset: {plan_name: plan.run_sim(services).to_dict()
+                for plan_name, plan in self.plans.items()}
+            for preset, services in scenario_presets.items()}
+
+        self.preset_results = (
+            self.version, results, json.dumps(results, sort_keys=True))
+
+    def get_preset_results(self):
+        self.simulate_presets()
+        return self.preset_results[1]
+
+    def get_preset_results_json(self):
+        self.simulate_presets()
+        return self.preset_results[2]
+
+    def compute_version(self):
+        '''
+        A short content hash of the plans and presets. Anything derived from
+        the catalog (rendered pages, precomputed results) can be cached
+        against this.
+        '''
+        description = (
+            sorted((name, plan.describe()) for name, plan in self.plans.items()),
+            sorted((name, tuple(services))
+                for name, services in scenario_presets.items()))
+        return hashlib.sha1(repr(description).encode()).hexdigest()[:12]
+
+    def compute_plan_bounds(self):
+        return {name: PlanBounds.from_plan(plan)
+            for name, plan in self.plans.items()}
+
     @unroll(set)
     @dump_trace
     def get_service_list(self):
@@ -577,14 +864,121 @@ class GlobalPlans:
             for service in plan.service_list():
                 yield global_service_names.get(service, service), service
 
+    @dump_trace
+    def get_presets(self):
+        return {name: [service_input(service) for service in services]
+            for name, services in scenario_presets.items()}
+
     @dump_trace
     def run_simulations(self, services):
+        return { plan_name: result.to_dict()
+            for plan_name, result in self.run_simulation_results(services).items() }
+
+    def run_simulation_results(self, services):
+        '''
+        Like run_simulations, but returns the SimResults themselves
+        '''
         services = list(convert_services(services))
-        return { plan_name: plan.run_sim(services).to_dict()
+        return { plan_name: plan.run_sim(services)
             for plan_name, plan in self.plans.items() }
 
+    @dump_trace
+    def run_batch(self, scenarios):
+        '''
+        Simulate many named scenarios, each in the frontend request format,
+        against every plan. Returns {scenario: {plan: SimResult}}.
+        '''
+        return { scenario: self.run_simulation_results(services)
+            for scenario, services in scenarios.items() }
+
+    def aggregate_simulations(self, scenarios, aggregator=None):
+        '''
+        Simulate an iterable of scenarios, each in the frontend request format,
+        against every plan, feeding the results into a ResultAggregator rather
+        than keeping them. Returns the aggregator.
+        '''
+        if aggregator is None:
+            aggregator = ResultAggregator()
+
+        for services in scenarios:
+            services = list(convert_services(services))
+            for plan_name, plan in self.plans.items():
+                networks = plan.run_network_sims(services)
+                aggregator.add(plan_name, plan.combine_results(*networks),
+                    networks, (plan.in_network.deductible,
+                        plan.out_of_network.deductible))
+
+        return aggregator
+
+    @dump_trace
+    def run_marginal(self, services):
+        '''
+        Simulate a frontend request against every plan, with the marginal
+        cost of each service (see Plan.run_marginal). Catalog service types
+        are priced from the request's "prices" {service: price}, falling back
+        on the last price the request gives for that service.
+        '''
+        converted = list(convert_services(services))
+        prices = {}
+        for service in services['me']:
+            if 'service' in service and service.get('price') is not None:
+                prices[service['service']] = service['price']
+        requested = services.get('prices', {})
+        if not isinstance(requested, dict):
+            raise InvalidService('"prices" must be an object of service prices')
+        prices.update(requested)
+
+        # Price keys may be service names or ids
+        prices = {service_name(name): service_price(price, name)
+            for name, price in prices.items()}
+        services = converted
+
+        results = {}
+        for plan_name, plan in self.plans.items():
+            offered = plan.service_list()
+            plan_prices = {name: price for name, price in prices.items()
+                if name in offered}
+            result, changes = plan.run_marginal(services, plan_prices)
+            changes['result'] = result.to_dict()
+            results[plan_name] = changes
+        return results
+
+    @dump_trace
+    def best_plans(self, services, count=3):
+        '''
+        Find the `count` cheapest plans for a frontend request, skipping
+        plans that the dominance index shows can't be among them. Returns the
+        ranked plans with their results, and a report of the plans skipped.
+        '''
+        ranked, report = find_best_plans(self.plans, self.plan_bounds,
+            convert_services(services), count)
+
+        report['best'] = [dict(result.to_dict(), plan=plan_name)
+            for plan_name, result in ranked]
+        return report
+
+    @dump_trace
+    def run_bounds(self, services):
+        services = list(convert_services(services))
+        results = {}
+        for plan_name, plan in self.plans.items():
+            best, worst = plan.run_bounds(services)
+            results[plan_name] = {
+                'best': best.to_dict(),
+                'worst': worst.to_dict()}
+        return results
+
 
 plans = GlobalPlans()
 load_plans = plans.load_plans
 get_service_list = plans.get_service_list
 run_simulations = plans.run_simulations
+run_simulation_results = plans.run_simulation_results
+run_batch = plans.run_batch
+run_bounds = plans.run_bounds
+run_marginal = plans.run_marginal
+best_plans = plans.best_plans
+aggregate_simulations = plans.aggregate_simulations
+get_presets = plans.get_presets
+get_preset_results = plans.get_preset_results
+get_preset_results_json = plans.get_preset_results_json
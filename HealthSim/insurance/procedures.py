@@ -0,0 +1,238 @@
+'''
+A procedure-level price catalog, with an autocomplete index.
+
+The catalog is loaded from a CSV file with the columns:
+
+    code, description, category, <region>, <region>, ...
+
+where `category` is one of the service categories (by key, like 'sov', or
+by name) and each region column holds the typical price of the procedure in
+that region (blank if unknown).
+
+Procedures are stored column-wise (parallel lists and typed arrays) rather
+than as an object per procedure. Search uses two indexes:
+
+- A sorted list of every distinct word (and code), each with an array of the
+  procedures containing it. A prefix is a bisection into the word list, so
+  typing "card" finds "cardiac" and "cardiology" in O(log n).
+- A trigram index, used when no procedure matches the prefixes (typos, or
+  text in the middle of a word), ranking procedures by shared trigrams.
+'''
+
+import csv
+import heapq
+import logging
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter, namedtuple
+
+
+logger = logging.getLogger(__name__)
+
+word_pattern = re.compile(r'[a-z0-9]+')
+
+# Past this many candidates, ranking only looks at the first ones found
+candidate_limit = 5000
+
+
+def words(text):
+    return word_pattern.findall(text.lower())
+
+
+def trigrams(text):
+    text = ' {} '.format(' '.join(words(text)))
+    return {text[index:index + 3] for index in range(len(text) - 2)}
+
+
+class Procedure(namedtuple('Procedure',
+        ('code', 'description', 'category', 'price'))):
+    '''
+    A single procedure, with its price in one region
+    '''
+    def to_dict(self):
+        return {field: value for field, value in zip(self._fields, self)}
+
+
+class ProcedureCatalog:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.codes = []
+        self.descriptions = []
+        self.categories = []
+        self.category_ids = array('H')
+        self.regions = []
+        self.prices = {}
+        self.by_code = {}
+
+        self.index_words = []
+        self.index_postings = []
+        self.trigram_postings = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def load(self, path, categories=None):
+        '''
+        Load the catalog from a CSV file, replacing anything loaded before.
+        A missing file leaves the catalog empty. Given the known service
+        `categories` (keys and names), procedures in any other category are
+        skipped with a warning, as they couldn't be simulated.
+        '''
+        self.clear()
+        try:
+            source = open(path, newline='')
+        except FileNotFoundError:
+            logger.warning('No procedure catalog at %s', path)
+            return
+
+        with source:
+            reader = csv.reader(source)
+            header = next(reader, None)
+            if header is None:
+                return
+
+            self.regions = [region.strip() for region in header[3:]]
+            self.prices = {region: array('d') for region in self.regions}
+            category_lookup = {}
+
+            for row in reader:
+                if len(row) < 3:
+                    continue
+                code, description, category = (value.strip() for value in row[:3])
+                if categories is not None and category not in categories:
+                    logger.warning('Skipping procedure %s in unknown category '
+                        '%s', code, category)
+                    continue
+
+                self.by_code[code] = len(self.codes)
+                self.codes.append(code)
+                self.descriptions.append(description)
+
+                if category not in category_lookup:
+                    category_lookup[category] = len(self.categories)
+                    self.categories.append(category)
+                self.category_ids.append(category_lookup[category])
+
+                # NaN marks an unknown price
+                for region, price in zip(self.regions, row[3:] + [''] * len(self.regions)):
+                    price = price.strip()
+                    self.prices[region].append(float(price) if price else float('nan'))
+
+        self.build_indexes()
+
+    def build_indexes(self):
+        word_postings = {}
+        trigram_postings = {}
+
+        for procedure_id, (code, description) in enumerate(
+                zip(self.codes, self.descriptions)):
+            for word in set(words(description)) | {code.lower()}:
+                word_postings.setdefault(word, array('I')).append(procedure_id)
+
+            for trigram in trigrams(description):
+                trigram_postings.setdefault(trigram, array('I')).append(procedure_id)
+
+        self.index_words = sorted(word_postings)
+        self.index_postings = [word_postings[word] for word in self.index_words]
+        self.trigram_postings = trigram_postings
+
+    def procedure(self, procedure_id, region):
+        price = self.prices[region][procedure_id] if region in self.prices else None
+        if price is not None and price != price:
+            price = None
+
+        return Procedure(
+            self.codes[procedure_id],
+            self.descriptions[procedure_id],
+            self.categories[self.category_ids[procedure_id]],
+            price)
+
+    def lookup(self, code, region=None):
+        '''
+        Get a Procedure by its code. Raises KeyError for unknown codes.
+        '''
+        return self.procedure(self.by_code[code], region or self.default_region())
+
+    def default_region(self):
+        return self.regions[0] if self.regions else None
+
+    def prefix_postings(self, prefix):
+        '''
+        Yield the postings of every indexed word starting with `prefix`
+        '''
+        index = bisect_left(self.index_words, prefix)
+        while (index < len(self.index_words) and
+                self.index_words[index].startswith(prefix)):
+            yield self.index_postings[index]
+            index += 1
+
+    def prefix_candidates(self, query_words):
+        '''
+        Procedures with a word starting with each of the query words
+        '''
+        candidates = None
+
+        # Start from the rarest prefix, so the sets stay small
+        ranked = sorted(query_words,
+            key=lambda word: sum(map(len, self.prefix_postings(word))))
+
+        for word in ranked:
+            matches = set()
+            for postings in self.prefix_postings(word):
+                if candidates is None:
+                    matches.update(postings)
+                else:
+                    matches.update(
+                        procedure_id for procedure_id in postings
+                        if procedure_id in candidates)
+                if len(matches) >= candidate_limit and candidates is None:
+                    break
+
+            candidates = matches
+            if not candidates:
+                break
+
+        return candidates or set()
+
+    def trigram_candidates(self, query, limit):
+        counts = Counter()
+        for trigram in trigrams(query):
+            counts.update(self.trigram_postings.get(trigram, ()))
+        return [procedure_id for procedure_id, _ in counts.most_common(limit)]
+
+    def search(self, query, region=None, limit=10):
+        '''
+        Autocomplete a query against the catalog, returning up to `limit`
+        Procedures. An exact code match comes first, then procedures matching
+        every word of the query as a prefix, shortest description first.
+        '''
+        region = region or self.default_region()
+        query_words = words(query)
+        if not query_words:
+            return []
+
+        results = []
+        exact = self.by_code.get(query.strip())
+        if exact is not None:
+            results.append(exact)
+
+        candidates = self.prefix_candidates(query_words)
+        if candidates:
+            candidates.discard(exact)
+            results.extend(heapq.nsmallest(limit - len(results), candidates,
+                key=lambda procedure_id: (
+                    len(self.descriptions[procedure_id]), procedure_id)))
+        elif not results:
+            results = self.trigram_candidates(query, limit)
+
+        return [self.procedure(procedure_id, region)
+            for procedure_id in results[:limit]]
+
+
+catalog = ProcedureCatalog()
+load_catalog = catalog.load
+lookup_procedure = catalog.lookup
+search_procedures = catalog.search
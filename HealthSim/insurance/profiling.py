@@ -0,0 +1,145 @@
+'''
+Opt-in profiling of single simulation calls, to track the allocation and
+time spent per service across releases.
+
+The call is run three times, as measuring everything at once would skew
+each figure: once untraced, for the elapsed time, once under tracemalloc,
+for the memory it allocates, and once under cProfile, for where the time
+goes. Simulations are pure, so every run does the same work. A JSON report
+is written to the report directory, with the scenario's size and
+per-service figures, along with the raw cProfile stats (for pstats or
+snakeviz).
+
+tracemalloc is process-wide (as is cProfile, from Python 3.12), so
+profiled calls are serialized: concurrent requests wait for each other's
+profiles.
+
+tracemalloc only sees what's still allocated when it's asked, so the peak is
+the best measure of short-lived churn: every Service, LiteralService and
+result tuple alive at once during the call counts towards it. The number of
+calls to the namedtuple constructors in the cProfile stats counts them all.
+'''
+
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+
+profile_lock = threading.Lock()
+
+# Tells apart reports from calls in the same millisecond
+report_ids = itertools.count()
+
+
+def scenario_size(services, plan_count):
+    '''
+    The size of a simulation request in the frontend format: the number of
+    services, and of plans each is simulated under
+    '''
+    return {
+        'services': len(services.get('me', ())),
+        'plans': plan_count,
+    }
+
+
+def allocation_sites(differences, limit):
+    return [{
+            'site': '{}:{}'.format(stat.traceback[0].filename,
+                stat.traceback[0].lineno),
+            'bytes': stat.size_diff,
+            'blocks': stat.count_diff}
+        for stat in differences[:limit]]
+
+
+def hot_spots(profile, limit):
+    stats = pstats.Stats(profile)
+    spots = []
+    for (filename, line, name), (primitive_calls, calls, own_time, total_time,
+            _) in stats.stats.items():
+        spots.append({
+            'function': '{}:{}({})'.format(filename, line, name),
+            'calls': calls,
+            'own_time': own_time,
+            'total_time': total_time})
+    spots.sort(key=lambda spot: spot['own_time'], reverse=True)
+    return stats.total_calls, spots[:limit]
+
+
+def profile_call(report_dir, label, size, func, *args, limit=25):
+    '''
+    Call func(*args) untraced, under tracemalloc and then under cProfile,
+    and write a report named after `label` to `report_dir`. `size`
+    describes the scenario, with a 'services' count for the per-service
+    figures. Returns the result of the first call and the report's path.
+    '''
+    with profile_lock:
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+
+        # Leave anyone else's traces alone. Their peak can only be reset to
+        # measure ours from here on Python 3.9 and later.
+        tracing = tracemalloc.is_tracing()
+        peak_known = not tracing or hasattr(tracemalloc, 'reset_peak')
+        if not tracing:
+            tracemalloc.start()
+        elif peak_known:
+            tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        start_size, _ = tracemalloc.get_traced_memory()
+
+        func(*args)
+
+        end_size, peak_size = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        if not tracing:
+            tracemalloc.stop()
+
+        profile = cProfile.Profile()
+        profile.runcall(func, *args)
+        report_id = next(report_ids)
+
+    total_calls, spots = hot_spots(profile, limit)
+
+    filters = (tracemalloc.Filter(False, tracemalloc.__file__),)
+    retained = after.filter_traces(filters).compare_to(
+        before.filter_traces(filters), 'lineno')
+
+    services = max(size.get('services', 0), 1)
+    peak = peak_size - start_size if peak_known else None
+    report = {
+        'label': label,
+        'time': time.time(),
+        'size': size,
+        'elapsed': elapsed,
+        'allocation': {
+            'peak_bytes': peak,
+            'retained_bytes': end_size - start_size,
+            'retained_blocks': sum(stat.count_diff for stat in retained),
+            'sites': allocation_sites(retained, limit),
+        },
+        'profile': {
+            'calls': total_calls,
+            'hot_spots': spots,
+        },
+        'per_service': {
+            'peak_bytes': None if peak is None else peak / services,
+            'calls': total_calls / services,
+            'elapsed': elapsed / services,
+        },
+    }
+
+    os.makedirs(report_dir, exist_ok=True)
+    name = '{}-{}-{}-{}'.format(label, int(report['time'] * 1000), os.getpid(),
+        report_id)
+    path = os.path.join(report_dir, name + '.json')
+    with open(path, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+    profile.dump_stats(os.path.join(report_dir, name + '.prof'))
+
+    return result, path
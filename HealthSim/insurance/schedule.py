@@ -0,0 +1,162 @@
+'''
+Date-aware simulation.
+
+Services can be given dates, either one at a time (Dated) or as recurring
+streams (Recurring, like a monthly prescription or weekly therapy). The
+streams are generated lazily and merged in date order with a heap, and split
+into plan years, where the deductible and out of pocket maximum reset. Only
+one plan year of services is held at a time, so a recurring service with no
+end date is never expanded past the end of the simulation.
+'''
+
+from calendar import monthrange
+from collections import namedtuple
+from datetime import date, timedelta
+from heapq import merge
+from operator import attrgetter
+
+
+class Dated(namedtuple('Dated', ('date', 'service'))):
+    '''
+    A Service received on a specific date
+    '''
+    def occurrences(self):
+        yield self
+
+
+class Months(namedtuple('Months', ('count',))):
+    '''
+    A recurrence interval of whole calendar months. Days past the end of a
+    shorter month are clamped, so a service on the 31st recurs on the last
+    day of each month.
+    '''
+    def advance(self, start, times):
+        month = start.month - 1 + self.count * times
+        year = start.year + month // 12
+        month = month % 12 + 1
+
+        day = start.day
+        while True:
+            try:
+                return date(year, month, day)
+            except ValueError:
+                day -= 1
+
+
+weekly = timedelta(weeks=1)
+monthly = Months(1)
+yearly = Months(12)
+
+
+class Recurring(namedtuple('Recurring', ('service', 'start', 'every', 'end'))):
+    '''
+    A Service received every `every` (a timedelta or Months) from `start`,
+    up to but not including `end`. With no end, it recurs forever. Raises
+    ValueError unless `every` moves forward in time.
+    '''
+    def __new__(cls, service, start, every=monthly, end=None):
+        if isinstance(every, Months):
+            forward = every.count > 0
+        else:
+            forward = every > timedelta(0)
+        if not forward:
+            raise ValueError('Services must recur at a positive interval')
+        return super().__new__(cls, service, start, every, end)
+
+    def occurrences(self):
+        times = 0
+        while True:
+            # Always step from the start, so clamped days don't drift
+            if isinstance(self.every, Months):
+                when = self.every.advance(self.start, times)
+            else:
+                when = self.start + self.every * times
+
+            if self.end is not None and when >= self.end:
+                return
+
+            yield Dated(when, self.service)
+            times += 1
+
+
+def merge_services(services):
+    '''
+    Lazily merge Dated and Recurring services into a single stream of Dated
+    services, in date order
+    '''
+    return merge(*(service.occurrences() for service in services),
+        key=attrgetter('date'))
+
+
+def plan_year_boundary(year, plan_year_start):
+    '''
+    The date the plan year starting on the (month, day) `plan_year_start`
+    begins in `year`. Like Months, a day past the end of the month is
+    clamped, so a plan year starting on February 29th starts on the 28th in
+    other years.
+    '''
+    month, day = plan_year_start
+    return date(year, month, min(day, monthrange(year, month)[1]))
+
+
+def plan_year_starting(when, plan_year_start):
+    start = plan_year_boundary(when.year, plan_year_start)
+    if start > when:
+        start = plan_year_boundary(when.year - 1, plan_year_start)
+    return start
+
+
+def plan_years(start, until, plan_year_start=(1, 1)):
+    '''
+    Yield the (start, end) of each plan year, or part of a plan year, from
+    `start` (such as a mid-year enrollment) to `until`
+    '''
+    boundary = plan_year_starting(start, plan_year_start)
+
+    while boundary < until:
+        next_boundary = plan_year_boundary(boundary.year + 1, plan_year_start)
+        yield max(boundary, start), min(next_boundary, until)
+        boundary = next_boundary
+
+
+def months_between(start, end, day=None):
+    '''
+    The number of monthly premiums due from start to end, counting a
+    partial month as a whole one. Months run from `day` of the month, by
+    default the start's: a plan year that starts on a clamped day (see
+    plan_year_boundary) still runs from the day it was configured with.
+    '''
+    months = (end.year - start.year) * 12 + end.month - start.month
+    if end.day > (start.day if day is None else day):
+        months += 1
+    return max(months, 0)
+
+
+def run_dated_sim(plan, services, start, until, plan_year_start=(1, 1)):
+    '''
+    Simulate Dated and Recurring services under `plan` from `start` (the
+    enrollment date) up to `until`. Thresholds reset at each plan year,
+    which starts on the (month, day) `plan_year_start`, and premiums are
+    charged for each month enrolled. The full HSA contribution is available
+    in each plan year, including a partial first year.
+
+    Yields a (plan year start, SimResult) for each plan year.
+    '''
+    stream = merge_services(services)
+    pending = next(stream, None)
+
+    for year_start, year_end in plan_years(start, until, plan_year_start):
+        year_services = []
+        while pending is not None and pending.date < year_end:
+            if pending.date >= year_start:
+                year_services.append(pending.service)
+            pending = next(stream, None)
+
+        # Unless enrollment started it, a plan year's months run from its
+        # own day
+        on_boundary = year_start == plan_year_starting(year_start,
+            plan_year_start)
+        months = months_between(year_start, year_end,
+            plan_year_start[1] if on_boundary else None)
+
+        yield year_start, plan.run_sim(year_services, months=months)
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from HealthSim.insurance.catalogs import catalogs, configure_catalogs
+from HealthSim.insurance.plans import load_plans, plans
+
+
+class Command(BaseCommand):
+    help = ('Store the built-in plans as an employer\'s plan year under '
+        'PLAN_CATALOG_ROOT, as a starting point for editing.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('employer')
+        parser.add_argument('year', type=int)
+
+    def handle(self, *args, **options):
+        load_plans()
+        configure_catalogs(settings.PLAN_CATALOG_ROOT)
+
+        try:
+            catalogs.save(options['employer'], options['year'], plans)
+        except KeyError:
+            raise CommandError('Bad employer name {}'.format(options['employer']))
+
+        self.stdout.write(catalogs.catalog_path(options['employer'], options['year']))
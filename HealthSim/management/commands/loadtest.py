@@ -0,0 +1,331 @@
+import http.client
+import json
+import random
+from bisect import bisect
+from itertools import accumulate
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from HealthSim.insurance import plans
+
+
+endpoints = ('landing', 'get_service_list', 'ajax_json_0', 'api_simulate')
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def latency_summary(latencies):
+    ordered = sorted(latencies)
+    return {
+        'mean': sum(ordered) / len(ordered) if ordered else None,
+        'p50': percentile(ordered, 0.50),
+        'p90': percentile(ordered, 0.90),
+        'p99': percentile(ordered, 0.99),
+        'max': ordered[-1] if ordered else None,
+    }
+
+
+class Client:
+    '''
+    Sends requests to the server, one keep-alive connection per thread, with
+    the CSRF and API tokens from a landing page load attached
+    '''
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        self.host = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.local = threading.local()
+        self.cookies = {}
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection(
+                self.host, timeout=self.timeout)
+        return connection
+
+    def login(self):
+        '''
+        Load the landing page once for its csrftoken and api_token cookies
+        '''
+        status, headers = self.send({'method': 'GET', 'path': '/HealthSim/'},
+            headers_only=True)
+        if status != 200:
+            raise CommandError('Landing page returned {}'.format(status))
+
+        for name, value in headers:
+            if name.lower() == 'set-cookie':
+                for morsel in SimpleCookie(value).values():
+                    self.cookies[morsel.key] = morsel.value
+
+    def prepare(self, request):
+        headers = dict(request.get('headers', {}))
+        body = request.get('body')
+
+        if self.cookies:
+            headers['Cookie'] = '; '.join(
+                '{}={}'.format(name, value) for name, value in self.cookies.items())
+
+        if request['path'].startswith('/api/'):
+            headers['X-API-Token'] = self.cookies.get('api_token', '')
+        elif request['method'] == 'POST':
+            body = '&'.join(filter(None, (body, urlencode({
+                'csrfmiddlewaretoken': self.cookies.get('csrftoken', '')}))))
+
+        if body is not None:
+            body = body.encode('utf-8')
+            headers.setdefault('Content-Type', request.get('content_type',
+                'application/x-www-form-urlencoded'))
+
+        return headers, body
+
+    def send(self, request, headers_only=False):
+        headers, body = self.prepare(request)
+        connection = self.connection()
+        try:
+            connection.request(request['method'], self.prefix + request['path'],
+                body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except Exception:
+            connection.close()
+            self.local.connection = None
+            raise
+
+        if headers_only:
+            return response.status, response.getheaders()
+        return response.status
+
+
+class Synthesizer:
+    '''
+    Generates realistic requests: scenarios built from the service catalog
+    and the scenario presets, with a mix of endpoints
+    '''
+    def __init__(self, mix, rng):
+        self.endpoints, weights = zip(*sorted(mix.items()))
+        self.cumulative_weights = list(accumulate(weights))
+        self.rng = rng
+        self.services = sorted(name for name, _ in plans.get_service_list())
+        self.presets = list(plans.get_presets().values())
+
+    def scenario(self):
+        if self.rng.random() < 0.3:
+            return self.rng.choice(self.presets)
+
+        return [{
+                'service': self.rng.choice(self.services),
+                'price': round(self.rng.lognormvariate(5, 1), 2),
+                'in_network': self.rng.random() < 0.85}
+            for _ in range(int(self.rng.expovariate(1 / 8)) + 1)]
+
+    def request(self):
+        endpoint = self.endpoints[bisect(self.cumulative_weights,
+            self.rng.random() * self.cumulative_weights[-1])]
+
+        if endpoint == 'landing':
+            return {'endpoint': endpoint, 'method': 'GET', 'path': '/HealthSim/'}
+        elif endpoint == 'get_service_list':
+            return {'endpoint': endpoint, 'method': 'POST',
+                'path': '/HealthSim/get_service_list',
+                'body': urlencode({'client_ajax_input_0': '1'})}
+        elif endpoint == 'ajax_json_0':
+            return {'endpoint': endpoint, 'method': 'POST',
+                'path': '/HealthSim/ajax_json_0',
+                'body': urlencode({
+                    'client_input_dict': json.dumps(self.scenario())})}
+        else:
+            return {'endpoint': endpoint, 'method': 'POST',
+                'path': '/api/simulate',
+                'body': json.dumps({'me': self.scenario()}),
+                'content_type': 'application/json'}
+
+
+def read_log(path):
+    '''
+    Read recorded requests, one JSON object per line with "method", "path"
+    and optionally "body", "content_type", "headers" and "endpoint". Lines
+    that aren't requests are skipped.
+    '''
+    requests = []
+    with open(path) as log:
+        for line in log:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(request, dict) and 'path' in request:
+                request.setdefault('method', 'GET')
+                request.setdefault('endpoint', request['path'])
+                requests.append(request)
+
+    if not requests:
+        raise CommandError('No replayable requests in {}'.format(path))
+    return requests
+
+
+class Command(BaseCommand):
+    help = ('Fire realistic requests at a running server and report '
+        'throughput, latency percentiles and error rates as JSON. Every '
+        'request comes from one address, so for API requests, run the server '
+        'with HEALTHSIM_API_RATE_LIMIT=0.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--rate', type=float, default=None,
+            help='Open-loop arrival rate in requests per second (Poisson). '
+                'Without it, each worker sends its next request as soon as '
+                'the last one finishes.')
+        parser.add_argument('--mix',
+            default='landing=1,get_service_list=1,ajax_json_0=8',
+            help='Weights of the synthesized endpoints, from: ' +
+                ', '.join(endpoints))
+        parser.add_argument('--replay', default=None,
+            help='Replay requests from a JSON lines log instead of '
+                'synthesizing them')
+        parser.add_argument('--record', default=None,
+            help='Write the requests sent to a JSON lines log, for replay')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--output', default=None,
+            help='Write the report to this file as well as stdout')
+        parser.add_argument('--compare', default=None,
+            help='A previous report to compare against')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        count = options['requests']
+
+        if options['replay']:
+            log = read_log(options['replay'])
+            requests = [log[index % len(log)] for index in range(count)]
+        else:
+            mix = {}
+            for entry in options['mix'].split(','):
+                endpoint, _, weight = entry.partition('=')
+                if endpoint not in endpoints:
+                    raise CommandError('Unknown endpoint {}'.format(endpoint))
+                mix[endpoint] = float(weight or 1)
+
+            # Scenarios are drawn from the built-in catalog
+            plans.load_plans()
+            synthesizer = Synthesizer(mix, rng)
+            requests = [synthesizer.request() for _ in range(count)]
+
+        if options['record']:
+            with open(options['record'], 'w') as log:
+                for request in requests:
+                    log.write(json.dumps(request) + '\n')
+
+        client = Client(options['url'], options['timeout'])
+        client.login()
+
+        report = self.run(client, requests, options['concurrency'],
+            options['rate'], rng)
+        report['config'] = {key: options[key] for key in (
+            'url', 'requests', 'concurrency', 'rate', 'mix', 'replay', 'seed')}
+
+        limited = report['statuses'].get('429', 0)
+        if limited:
+            self.stderr.write('{} requests were rate limited. The API limits '
+                'each client address, so run the server with '
+                'HEALTHSIM_API_RATE_LIMIT=0.'.format(limited))
+
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                report['comparison'] = self.compare(json.load(baseline), report)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as target:
+                target.write(output + '\n')
+        self.stdout.write(output)
+
+    def run(self, client, requests, concurrency, rate, rng):
+        # Open loop: requests are due at Poisson arrival times, and latency
+        # is measured from when they were due, so queueing counts
+        due = [0.0] * len(requests)
+        if rate:
+            for index in range(1, len(requests)):
+                due[index] = due[index - 1] + rng.expovariate(rate)
+
+        results = []
+        results_lock = threading.Lock()
+        start = time.perf_counter()
+
+        def fire(index):
+            request = requests[index]
+            scheduled = start + due[index]
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if not rate:
+                scheduled = time.perf_counter()
+
+            try:
+                status = client.send(request)
+            except Exception as error:
+                status = type(error).__name__
+            latency = time.perf_counter() - scheduled
+
+            with results_lock:
+                results.append((request['endpoint'], status, latency))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(fire, range(len(requests))))
+
+        elapsed = time.perf_counter() - start
+
+        def summarize(entries):
+            errors = sum(1 for _, status, _ in entries
+                if not isinstance(status, int) or status >= 400)
+            return {
+                'requests': len(entries),
+                'errors': errors,
+                'error_rate': errors / len(entries) if entries else 0,
+                'statuses': dict(Counter(str(status) for _, status, _ in entries)),
+                'latency_ms': latency_summary(
+                    [latency * 1000 for _, _, latency in entries]),
+            }
+
+        report = summarize(results)
+        report['duration'] = elapsed
+        report['throughput'] = len(results) / elapsed if elapsed else None
+        report['endpoints'] = {endpoint: summarize(
+                [entry for entry in results if entry[0] == endpoint])
+            for endpoint in sorted({entry[0] for entry in results})}
+        return report
+
+    def compare(self, baseline, report):
+        '''
+        Relative change of the headline numbers against a baseline report
+        '''
+        def change(before, after):
+            if not before or after is None:
+                return None
+            return (after - before) / before
+
+        return {
+            'throughput': change(baseline.get('throughput'), report['throughput']),
+            'error_rate': report['error_rate'] - baseline.get('error_rate', 0),
+            'latency_ms': {key: change(
+                    baseline.get('latency_ms', {}).get(key),
+                    report['latency_ms'][key])
+                for key in ('p50', 'p90', 'p99')},
+        }
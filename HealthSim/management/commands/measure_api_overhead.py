@@ -0,0 +1,91 @@
+import io
+import json
+import time
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from FidHealth.wsgi import application
+from HealthSim.api import rate_limiter
+from HealthSim.insurance.plans import get_presets
+from HealthSim.tokens import issue_token
+
+
+class Command(BaseCommand):
+    help = ('Measure the per-request time and database queries of a '
+        'simulation through the legacy ajax_json_0 endpoint and through the '
+        '/api/ namespace, calling the WSGI application in process.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--preset', default='Medium cost')
+
+    def handle(self, *args, **options):
+        services = get_presets()[options['preset']]
+
+        # Every measured API call comes from the same address
+        rate_limiter.limit = options['requests'] + 1
+        csrf_token = 'x' * 32
+
+        legacy = self.environ('/HealthSim/ajax_json_0',
+            urlencode({
+                'client_input_dict': json.dumps(services),
+                'csrfmiddlewaretoken': csrf_token}),
+            'application/x-www-form-urlencoded',
+            HTTP_COOKIE='csrftoken=' + csrf_token)
+
+        api = self.environ('/api/simulate',
+            json.dumps({'me': services}),
+            'application/json',
+            HTTP_X_API_TOKEN=issue_token())
+
+        report = {
+            'legacy': self.measure(legacy, options['requests']),
+            'api': self.measure(api, options['requests']),
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def environ(self, path, body, content_type, **extra):
+        body = body.encode('utf-8')
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': path,
+            'CONTENT_TYPE': content_type,
+            'CONTENT_LENGTH': str(len(body)),
+            'SERVER_NAME': 'localhost',
+            'body': body,
+        }
+        environ.update(extra)
+        setup_testing_defaults(environ)
+        return environ
+
+    def measure(self, environ, requests):
+        statuses = []
+
+        def start_response(status, headers, exc_info=None):
+            statuses.append(status)
+
+        def call():
+            request_environ = dict(environ)
+            request_environ['wsgi.input'] = io.BytesIO(environ['body'])
+            for chunk in application(request_environ, start_response):
+                pass
+
+        # Warm up, so one-time setup isn't measured
+        call()
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(requests):
+                call()
+            elapsed = time.perf_counter() - start
+
+        return {
+            'path': environ['PATH_INFO'],
+            'status': statuses[-1],
+            'microseconds_per_request': elapsed / requests * 1e6,
+            'queries_per_request': len(queries) / requests,
+        }
@@ -0,0 +1,53 @@
+import multiprocessing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from HealthSim.insurance.catalogs import configure_catalogs
+from HealthSim.insurance.jobs import JobQueue, configure_jobs, jobs
+from HealthSim.insurance.plans import load_plans
+
+
+def worker(path, result_dir, chunk_size, catalog_root, catalog_budget,
+        poll_interval, max_age, purge_interval):
+    load_plans()
+    configure_catalogs(catalog_root, catalog_budget)
+    configure_jobs(path, result_dir, chunk_size)
+    jobs.work(poll_interval, max_age, purge_interval)
+
+
+class Command(BaseCommand):
+    help = ('Run queued simulation jobs in worker processes, at most '
+        'JOBS_CONCURRENCY (or --concurrency) at a time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int,
+            default=settings.JOBS_CONCURRENCY)
+        parser.add_argument('--poll-interval', type=float, default=1)
+
+    def handle(self, *args, **options):
+        queue = JobQueue(settings.JOBS_DATABASE, settings.JOBS_RESULT_DIR)
+
+        # Any running jobs were left by workers that died with this command
+        requeued = queue.requeue_running()
+        purged = queue.purge(settings.JOBS_RESULT_MAX_AGE)
+        self.stdout.write('Requeued {} jobs, purged {} finished jobs'.format(
+            requeued, purged))
+
+        workers = [multiprocessing.Process(target=worker, args=(
+                settings.JOBS_DATABASE, settings.JOBS_RESULT_DIR,
+                settings.JOBS_CHUNK_SIZE, settings.PLAN_CATALOG_ROOT,
+                settings.PLAN_CATALOG_CACHE_BYTES, options['poll_interval'],
+                settings.JOBS_RESULT_MAX_AGE, settings.JOBS_PURGE_INTERVAL))
+            for _ in range(max(options['concurrency'], 1))]
+
+        for process in workers:
+            process.start()
+        self.stdout.write('Running {} workers'.format(len(workers)))
+
+        try:
+            for process in workers:
+                process.join()
+        except KeyboardInterrupt:
+            for process in workers:
+                process.terminate()
@@ -0,0 +1,81 @@
+import gzip
+
+from django.contrib.staticfiles.storage import (ManifestStaticFilesStorage,
+    StaticFilesStorage)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    '''
+    Static files storage that content-hashes file names (so `{% static %}`
+    resolves to names that can be cached forever), and writes precompressed
+    .gz and .br variants of each hashed file next to it during collectstatic.
+    Brotli variants are only written if the `brotli` package is installed.
+    '''
+    compressible_extensions = ('.css', '.js', '.html', '.svg', '.txt', '.json')
+
+    # Files smaller than this aren't worth a second request header
+    minimum_size = 256
+
+    def post_process(self, paths, dry_run=False, **options):
+        processed_files = super().post_process(paths, dry_run, **options)
+
+        for name, hashed_name, processed in processed_files:
+            if (not dry_run and hashed_name and
+                    not isinstance(processed, Exception)):
+                self.compress(hashed_name)
+
+            yield name, hashed_name, processed
+
+    def compress(self, name):
+        if not name.endswith(self.compressible_extensions):
+            return
+
+        with self.open(name) as source:
+            data = source.read()
+
+        if len(data) < self.minimum_size:
+            return
+
+        variants = [('.gz', gzip.compress(data, 9))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(data)))
+
+        for suffix, compressed in variants:
+            # Only keep variants that actually save bytes
+            if len(compressed) < len(data):
+                with open(self.path(name) + suffix, 'wb') as target:
+                    target.write(compressed)
+
+    def url(self, name, force=False):
+        '''
+        Link the hashed names whenever collectstatic has written a manifest,
+        even with DEBUG on, where Django would otherwise link the plain names.
+        Files that haven't been collected (like everything in development,
+        before collectstatic) are linked by their plain names, and served
+        from the finders by static_asset_view.
+        '''
+        if force:
+            return super().url(name, force)
+
+        if self.hashed_files:
+            try:
+                return super().url(name, True)
+            except ValueError:
+                pass
+
+        return StaticFilesStorage.url(self, name)
+
+    def is_hashed(self, name):
+        return name in self.hashed_names
+
+    @property
+    def hashed_names(self):
+        names = getattr(self, '_hashed_names', None)
+        if names is None:
+            names = self._hashed_names = frozenset(self.hashed_files.values())
+        return names
@@ -1,3 +1,1279 @@
-from django.test import TestCase
+from itertools import permutations, product
+import gzip
+import io
+from datetime import date, timedelta
+import json
+import math
+import os
+import random
+import re
+import shutil
+import statistics
+import struct
+import tempfile
+import threading
+import time
+import tracemalloc
+from unittest import skipIf
+from wsgiref.util import setup_testing_defaults
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.test import (LiveServerTestCase, RequestFactory, TestCase,
+    override_settings)
+
+import insurance
+
+from .insurance import aggregate
+from .insurance import catalogs
+from .insurance import design
+from .insurance import dominance
+from .insurance import jobs
+from .insurance import kernel
+from .insurance import plans
+from .insurance import procedures
+from .insurance import profiling
+from .insurance import schedule
+from . import encoding
+from .management.commands import loadtest
+from .api import rate_limiter
+from .tokens import issue_token, token_signer
+from .views import HealthSimView, script_json, service_catalog
+
+
+plans.load_plans()
+
+
+class BoundsTest(TestCase):
+    services = (
+        plans.Service('sov', 75),
+        plans.Service('sov', 380),
+        plans.Service('er', 550),
+        plans.Service('rg', 25),
+        plans.Service('rapei', 200),
+        plans.Service('ovtpcp', 1200, False),
+    )
+
+    def test_bounds_match_every_ordering(self):
+        for plan in plans.plans.plans.values():
+            costs = [plan.run_sim(ordering).out_of_pocket
+                for ordering in permutations(self.services)]
+            best, worst = plan.run_bounds(self.services)
+
+            self.assertAlmostEqual(best.out_of_pocket, min(costs))
+            self.assertAlmostEqual(worst.out_of_pocket, max(costs))
+
+    def test_repeated_copays(self):
+        # Copays are only owed on whatever's left of a service after the
+        # deductible, so they can't be bounded by filling it greedily
+        for plan in plans.plans.plans.values():
+            services = [plans.Service('rg', 100)] * 20
+            best, worst = plan.run_bounds(services)
+            cost = plan.run_sim(services).out_of_pocket
+            self.assertAlmostEqual(best.out_of_pocket, cost)
+            self.assertAlmostEqual(worst.out_of_pocket, cost)
+
+            services = ([plans.Service('rg', 700)] * 3 +
+                [plans.Service('sov', 450)] * 3 + [plans.Service('rg', 40)] * 2)
+            costs = [plan.run_sim(ordering).out_of_pocket
+                for ordering in set(permutations(services))]
+            best, worst = plan.run_bounds(services)
+
+            self.assertAlmostEqual(best.out_of_pocket, min(costs))
+            self.assertAlmostEqual(worst.out_of_pocket, max(costs))
+
+    def test_bounds_contain_random_orderings(self):
+        rng = random.Random(1)
+        names = sorted(plans.global_service_names)
+        costs = (15, 25, 30, 75, 200, 550, 800, 1200)
+
+        for plan in plans.plans.plans.values():
+            for _ in range(50):
+                services = [plans.Service(rng.choice(names), rng.choice(costs),
+                        rng.random() < 0.8)
+                    for _ in range(rng.randint(1, 6))]
+                best, worst = plan.run_bounds(services)
+
+                for ordering in permutations(services):
+                    cost = plan.run_sim(ordering).out_of_pocket
+                    self.assertLessEqual(best.out_of_pocket, cost + 1e-9)
+                    self.assertGreaterEqual(worst.out_of_pocket, cost - 1e-9)
+
+    def test_many_services(self):
+        rng = random.Random(2)
+        names = sorted(plans.global_service_names)
+        services = [plans.Service(rng.choice(names),
+                round(rng.lognormvariate(5, 1), 2), rng.random() < 0.8)
+            for _ in range(500)]
+
+        for plan in plans.plans.plans.values():
+            best, worst = plan.run_bounds(services)
+            cost = plan.run_sim(services).out_of_pocket
+            self.assertLessEqual(best.out_of_pocket, cost + 1e-9)
+            self.assertGreaterEqual(worst.out_of_pocket, cost - 1e-9)
+
+    @override_settings(BOUNDS_MAX_SERVICES=5)
+    def test_size_cap(self):
+        services = [{'service': 'er', 'price': 550, 'in_network': True}]
+        for count, status in ((5, 200), (6, 400)):
+            response = self.client.post('/HealthSim/ajax_bounds',
+                {'client_input_dict': json.dumps(services * count)})
+            self.assertEqual(response.status_code, status)
+
+
+class CompiledSimTest(TestCase):
+    def random_services(self, rng, plan):
+        names = sorted(plan.service_list() &
+            set(plan.in_network.service_list()) &
+            set(plan.out_of_network.service_list()))
+        costs = (0, 15, 25, 30, 33.3, 75, 200, 550, 800, 1200, 3000)
+
+        return [plans.Service(
+                rng.choice(names), rng.choice(costs), rng.random() < 0.7)
+            for _ in range(rng.randint(0, 40))]
+
+    def test_compiled_matches_reference(self):
+        rng = random.Random(0)
+
+        for plan in plans.plans.plans.values():
+            for _ in range(200):
+                services = self.random_services(rng, plan)
+                expected = plan.run_reference_sim(services)
+                result = plan.run_sim(services)
+
+                self.assertEqual(result, expected)
+                self.assertEqual(
+                    [type(value) for value in result],
+                    [type(value) for value in expected])
+
+
+class RunPaymentsTest(TestCase):
+    '''
+    Runs of identical services are resolved at once, and must match paying
+    for them one at a time, wherever the run starts and ends relative to the
+    deductible and the out of pocket maximum
+    '''
+    mods = (kernel.copay(20), kernel.copay(500), kernel.coinsure(20),
+        kernel.covered(), kernel.not_covered())
+
+    def test_runs_match_one_at_a_time(self):
+        for mod, cost, ignore_deductible, deductible, oop_maximum in product(
+                self.mods, (0, 30, 75, 333.3, 1200),
+                (False, True), (0, 100, 500, 1250), (0, 400, 2000, math.inf)):
+            for count in range(1, 25):
+                run = kernel.run_network(
+                    [kernel.LiteralService(cost, mod, ignore_deductible, count)],
+                    deductible, oop_maximum)
+                one_at_a_time = kernel.run_network(
+                    [kernel.LiteralService(cost, mod, ignore_deductible)] * count,
+                    deductible, oop_maximum)
+
+                for value, expected in zip(run, one_at_a_time):
+                    self.assertAlmostEqual(value, expected)
+
+    def test_encoded_sim(self):
+        rng = random.Random(0)
+        costs = (25, 75, 200, 550, 1200)
+
+        for plan in plans.plans.plans.values():
+            names = sorted(set(plan.in_network.service_list()) &
+                set(plan.out_of_network.service_list()))
+
+            for _ in range(100):
+                # Long runs, to cross the deductible and out of pocket max
+                services = [service
+                    for _ in range(rng.randint(0, 5))
+                    for service in [plans.Service(rng.choice(names),
+                        rng.choice(costs), rng.random() < 0.7)] *
+                        rng.randint(1, 30)]
+
+                encoded = plan.run_encoded_sim(plans.run_length_encode(services))
+                for value, expected in zip(encoded, plan.run_sim(services)):
+                    self.assertAlmostEqual(value, expected)
+
+
+class ConformanceTest(TestCase):
+    '''
+    The notebook engine (insurance.py) and the web engine (plans.py) both
+    run on the kernel, and must agree on randomized scenarios, including
+    services a network doesn't list
+    '''
+    costs = (0, 15, 25, 30, 33.3, 75, 200, 550, 800, 1200, 3000)
+
+    def notebook_details(self, network):
+        details = {
+            'deductible': network.deductible,
+            'out_of_pocket_max': network.out_of_pocket_max}
+        for name, offered in network.services.items():
+            details[name] = ((offered.mod, True) if offered.ignore_deductible
+                else offered.mod)
+        return details
+
+    def random_months(self, rng):
+        names = sorted(plans.global_service_names)
+        return [[insurance.Service(rng.choice(names), rng.choice(self.costs),
+                    rng.random() < 0.7, rng.choice((1, 1, 1, 2, 12)))
+                for _ in range(rng.randint(0, 4))]
+            for _ in range(12)]
+
+    def test_engines_agree(self):
+        rng = random.Random(0)
+
+        for plan in plans.plans.plans.values():
+            in_details = self.notebook_details(plan.in_network)
+            out_details = self.notebook_details(plan.out_of_network)
+            sim = insurance.plan_sim(plan.premium, plan.hsa_contribution,
+                in_details, out_details)
+            tracker = insurance.plan_tracker(plan.premium, plan.hsa_contribution,
+                (plan.in_network.deductible, plan.in_network.out_of_pocket_max),
+                (plan.out_of_network.deductible, plan.out_of_network.out_of_pocket_max))
+
+            for _ in range(200):
+                months = self.random_months(rng)
+                services = [plans.Service(service.name, service.cost, service.in_network)
+                    for month in months for service in month
+                    for _ in range(service.count)]
+
+                network_months = [
+                    [[service.as_literal_service(details) for service in month
+                        if service.in_network == in_network] for month in months]
+                    for details, in_network in ((in_details, True), (out_details, False))]
+                compiled = tuple(sim(months))[-1]
+                interpreted = tuple(tracker(*network_months))[-1]
+
+                # The year end fast paths give exactly the last month's state
+                self.assertEqual(sim.year_end(iter(months)), compiled)
+                self.assertEqual(tracker.year_end(*network_months), interpreted)
+                self.assertEqual(
+                    insurance.run_batch({'plan': sim}, {'months': months}),
+                    {'months': {'plan': compiled}})
+                result = plan.run_sim(services)
+                reference = plan.run_reference_sim(services)
+
+                for state in compiled, interpreted:
+                    for expected in result, reference:
+                        self.assertAlmostEqual(state.year_total, expected.out_of_pocket)
+                        self.assertAlmostEqual(state.year_service, expected.services)
+                        self.assertAlmostEqual(state.coverage_remaining,
+                            expected.hsa_remaining)
+
+                    for network_state, network in (
+                            (state.in_network_state, plan.in_network),
+                            (state.out_of_network_state, plan.out_of_network)):
+                        expected = network.run_sim(services)
+                        self.assertAlmostEqual(network_state.year_total,
+                            expected.out_of_pocket)
+                        self.assertAlmostEqual(network_state.deductible,
+                            expected.deductible)
+                        self.assertAlmostEqual(network_state.oop_maximum,
+                            expected.oop_maximum)
+
+
+class MarginalCostTest(TestCase):
+    random_services = CompiledSimTest.random_services
+
+    def test_marginal_matches_rerun(self):
+        rng = random.Random(0)
+
+        for plan in plans.plans.plans.values():
+            names = sorted(plan.service_list())
+            for _ in range(50):
+                services = self.random_services(rng, plan)
+                prices = {name: rng.choice((25, 200, 1200))
+                    for name in rng.sample(names, 3)}
+
+                result, changes = plan.run_marginal(services, prices)
+                base = plan.run_sim(services).out_of_pocket
+                self.assertEqual(result.out_of_pocket, base)
+
+                for index, service in enumerate(services):
+                    removed = services[:index] + services[index + 1:]
+                    self.assertAlmostEqual(changes['remove'][index],
+                        plan.run_sim(removed).out_of_pocket - base)
+                    self.assertAlmostEqual(changes['add'][index],
+                        plan.run_sim(services + [service]).out_of_pocket - base)
+
+                for name, price in prices.items():
+                    for key, in_network in (('in_network', True), ('out_of_network', False)):
+                        added = services + [plans.Service(name, price, in_network)]
+                        self.assertAlmostEqual(changes['services'][name][key],
+                            plan.run_sim(added).out_of_pocket - base)
+
+
+class DominanceTest(TestCase):
+    random_services = CompiledSimTest.random_services
+
+    def random_plan(self, rng, base):
+        rules = (('copay', 20), ('copay', 50), ('coinsure', 10), ('coinsure', 30),
+            ('covered', None), ('not_covered', None))
+
+        def network(base_network):
+            return plans.NetworkDetails(
+                deductible=rng.choice((0, 250, 1000, 2500)),
+                out_of_pocket_max=rng.choice((1500, 3000, 6000)),
+                in_network=base_network.in_network,
+                services={name: plans.OfferedService(
+                        plans.rule_mod(*rng.choice(rules)), rng.random() < 0.2)
+                    for name in base_network.services})
+
+        return plans.Plan(
+            premium=rng.choice((0, 30, 55, 90)),
+            hsa_contribution=rng.choice((0, 500, 1000)),
+            in_network=network(base.in_network),
+            out_of_network=network(base.out_of_network))
+
+    def test_best_plans_match_every_plan(self):
+        rng = random.Random(0)
+        base = plans.plans.plans['HDHP']
+        catalog = plans.GlobalPlans()
+        catalog.set_plans({'plan {}'.format(index): self.random_plan(rng, base)
+            for index in range(20)})
+
+        skipped = 0
+        for _ in range(100):
+            services = self.random_services(rng, base)
+            spend = dominance.network_spend(services)
+            results = {name: plan.run_sim(services)
+                for name, plan in catalog.plans.items()}
+
+            for name, result in results.items():
+                low, high = catalog.plan_bounds[name].bounds(*spend)
+                self.assertLessEqual(low, result.out_of_pocket + 1e-9)
+                self.assertGreaterEqual(high, result.out_of_pocket - 1e-9)
+
+            ranked, report = dominance.find_best_plans(
+                catalog.plans, catalog.plan_bounds, services, 3)
+            expected = sorted(result.out_of_pocket for result in results.values())[:3]
+            self.assertEqual([result.out_of_pocket for _, result in ranked], expected)
+            skipped += len(report['skipped'])
+
+        # The index should be doing something
+        self.assertGreater(skipped, 0)
+
+
+class DesignTest(TestCase):
+    def random_population(self, rng, base, count):
+        names = sorted(set(base.in_network.service_list()) &
+            set(base.out_of_network.service_list()))
+        costs = (0, 25, 75, 200, 550, 1200, 3000, 8000)
+
+        return [{'me': [{
+                'service': rng.choice(names),
+                'price': rng.choice(costs),
+                'in_network': rng.random() < 0.7}
+            for _ in range(rng.randint(0, 12))]}
+            for _ in range(count)]
+
+    def brute_force(self, base, population, design, months=12):
+        def network(base_network, description):
+            services = dict(base_network.services)
+            services.update({name: plans.OfferedService(
+                    plans.rule_mod(*offered['rule']),
+                    offered['ignore_deductible'])
+                for name, offered in description['services'].items()})
+            return plans.NetworkDetails(description['deductible'],
+                description['out_of_pocket_max'], services,
+                base_network.in_network)
+
+        plan = plans.Plan(design['premium'], design['hsa_contribution'],
+            network(base.in_network, design['in_network']),
+            network(base.out_of_network, design['out_of_network']))
+
+        employee_cost = employer_cost = 0
+        for services in population:
+            services = list(plans.convert_services(services))
+            employee_cost += plan.run_reference_sim(services, months).out_of_pocket
+
+            # Claims paid are the sticker prices less what the member paid
+            employer_cost += plan.hsa_contribution
+            for details in plan.in_network, plan.out_of_network:
+                employer_cost += sum(service.cost for service in services
+                    if service.in_network == details.in_network)
+                employer_cost -= details.run_sim(
+                    plan.convert_services(services, details)).out_of_pocket
+
+        return employee_cost, employer_cost
+
+    def test_grid_matches_reference(self):
+        rng = random.Random(0)
+        base = plans.plans.plans['HDHP']
+        population = self.random_population(rng, base, 40)
+        population += population[:10]
+
+        # Each grid has a different longest axis, which is the one the
+        # members are sorted once for
+        grids = (
+            {'hsa_contribution': [0, 250, 1000, 2500, 6000]},
+            {'in_network': design.NetworkAxes(
+                out_of_pocket_max=[0, 500, 1500, 3000, math.inf])},
+            {'out_of_network': design.NetworkAxes(
+                out_of_pocket_max=[1000, 2500, 5000, 10000])},
+        )
+        common = {
+            'premium': [0, 80],
+            'in_network': design.NetworkAxes(deductible=[0, 1500],
+                out_of_pocket_max=[2000, 4000],
+                services={'sov': [plans.copay(40), plans.coinsure(20)]}),
+            'out_of_network': design.NetworkAxes(deductible=[500, 3000]),
+        }
+
+        for grid in grids:
+            designs = design.grid_search(base, population,
+                **dict(common, **grid))
+            self.assertTrue(designs)
+
+            for result in designs:
+                employee_cost, employer_cost = self.brute_force(
+                    base, population, result)
+                self.assertEqual(result['members'], len(population))
+                self.assertAlmostEqual(result['employee_cost'], employee_cost,
+                    delta=1e-6 * max(employee_cost, 1))
+                self.assertAlmostEqual(result['employer_cost'], employer_cost,
+                    delta=1e-6 * max(abs(employer_cost), 1))
+
+
+class ScheduleTest(TestCase):
+    def test_recurring(self):
+        office_visit = plans.Service('sov', 75)
+        prescription = plans.Service('rg', 25)
+
+        visits = schedule.Recurring(office_visit, date(2023, 1, 31))
+        self.assertEqual(
+            [dated.date for _, dated in zip(range(4), visits.occurrences())],
+            [date(2023, 1, 31), date(2023, 2, 28), date(2023, 3, 31),
+                date(2023, 4, 30)])
+
+        merged = list(schedule.merge_services([
+            schedule.Recurring(prescription, date(2023, 1, 10),
+                schedule.weekly, date(2023, 2, 1)),
+            schedule.Dated(date(2023, 1, 20), office_visit),
+        ]))
+        self.assertEqual([dated.date for dated in merged], [
+            date(2023, 1, 10), date(2023, 1, 17), date(2023, 1, 20),
+            date(2023, 1, 24), date(2023, 1, 31)])
+        self.assertEqual(merged[2].service, office_visit)
+
+    def test_recurring_intervals(self):
+        office_visit = plans.Service('sov', 75)
+        for every in (timedelta(0), timedelta(days=-7), schedule.Months(0),
+                schedule.Months(-1)):
+            self.assertRaises(ValueError, schedule.Recurring, office_visit,
+                date(2023, 1, 1), every)
+
+    def test_plan_years(self):
+        self.assertEqual(
+            list(schedule.plan_years(date(2023, 3, 15), date(2024, 12, 1),
+                (7, 1))),
+            [(date(2023, 3, 15), date(2023, 7, 1)),
+                (date(2023, 7, 1), date(2024, 7, 1)),
+                (date(2024, 7, 1), date(2024, 12, 1))])
+
+        # A leap day start is clamped in other years
+        self.assertEqual(
+            list(schedule.plan_years(date(2023, 1, 1), date(2025, 6, 1),
+                (2, 29))),
+            [(date(2023, 1, 1), date(2023, 2, 28)),
+                (date(2023, 2, 28), date(2024, 2, 29)),
+                (date(2024, 2, 29), date(2025, 2, 28)),
+                (date(2025, 2, 28), date(2025, 6, 1))])
+
+    def test_dated_sim(self):
+        plan = plans.plans.plans['HDHP']
+        surgery = plans.Service('ic', 3000)
+        visits = schedule.Recurring(plans.Service('sov', 200),
+            date(2023, 1, 15))
+        services = [visits, schedule.Dated(date(2023, 2, 1), surgery),
+            schedule.Dated(date(2024, 3, 1), surgery)]
+
+        results = list(plan.run_dated_sim(services, date(2023, 1, 1),
+            date(2025, 1, 1), (2, 29)))
+        self.assertEqual([start for start, _ in results], [date(2023, 1, 1),
+            date(2023, 2, 28), date(2024, 2, 29)])
+
+        # Thresholds reset each plan year, and whole plan years charge 12
+        # premiums, clamped or not
+        first, second, third = [result for _, result in results]
+        self.assertEqual(first, plan.run_sim(
+            [visits.service, surgery, visits.service], months=2))
+        self.assertEqual(second, plan.run_sim([visits.service] * 12, months=12))
+        self.assertEqual(third, plan.run_sim(
+            [surgery] + [visits.service] * 10, months=11))
+
+
+class ProcedureCatalogTest(TestCase):
+    rows = (
+        'code,description,category,national,west',
+        '99213,Office visit established patient,sov,120,140',
+        '99214,Office visit established patient moderate,sov,180,',
+        '71045,Chest x-ray single view,Diagnostic Laboratory and X-ray,45,60',
+        '93000,Electrocardiogram complete,dlaxr,,30',
+    )
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w') as source:
+            source.write('\n'.join(self.rows) + '\n')
+
+        self.catalog = procedures.ProcedureCatalog()
+        self.catalog.load(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_search(self):
+        codes = lambda query, **kwargs: [procedure.code
+            for procedure in self.catalog.search(query, **kwargs)]
+
+        self.assertEqual(codes('off vis'), ['99213', '99214'])
+        self.assertEqual(codes('off vis', limit=1), ['99213'])
+        self.assertEqual(codes('93000'), ['93000'])
+        self.assertEqual(codes('xray'), ['71045'])
+        self.assertEqual(codes(''), [])
+
+    def test_regional_prices(self):
+        self.assertEqual(self.catalog.lookup('99213').price, 120)
+        self.assertEqual(self.catalog.lookup('99213', 'west').price, 140)
+        self.assertIsNone(self.catalog.lookup('99214', 'west').price)
+        self.assertRaises(KeyError, self.catalog.lookup, '00000')
+
+    def test_procedure_requests(self):
+        procedures.catalog.load(self.path)
+        services = list(plans.convert_services({'me': [
+            {'procedure': '99213', 'in_network': True},
+            {'procedure': '71045', 'region': 'west', 'in_network': False},
+            {'procedure': '99214', 'price': 99, 'in_network': True},
+        ]}))
+        procedures.catalog.clear()
+
+        self.assertEqual(services, [
+            plans.Service('sov', 120, True),
+            plans.Service('dlaxr', 60, False),
+            plans.Service('sov', 99, True),
+        ])
+
+    def test_invalid_requests(self):
+        invalid = (
+            {'procedure': '00000', 'in_network': True},
+            {'procedure': '99214', 'region': 'west', 'in_network': True},
+            {'procedure': '99213', 'region': 'mars', 'in_network': True},
+            {'service': 'nonsense', 'price': 10, 'in_network': True},
+            3,
+            {'price': 10, 'in_network': True},
+            {'service': 'er', 'in_network': True},
+            {'service': 'er', 'price': 550},
+            {'service': 'er', 'price': 'abc', 'in_network': True},
+            {'procedure': '99213', 'price': 'abc', 'in_network': True},
+        )
+
+        procedures.catalog.load(self.path)
+        rate_limiter.counts = {}
+        try:
+            for service in invalid:
+                self.assertRaises(plans.InvalidService, list,
+                    plans.convert_services({'me': [service]}))
+
+                response = self.client.post('/api/simulate',
+                    json.dumps({'me': [service]}),
+                    content_type='application/json',
+                    HTTP_X_API_TOKEN=issue_token())
+                self.assertEqual(response.status_code, 400, service)
+                self.assertIn('error', json.loads(response.content.decode('utf-8')))
+
+                response = self.client.post('/HealthSim/ajax_json_0',
+                    {'client_input_dict': json.dumps([service])})
+                self.assertEqual(response.status_code, 400, service)
+        finally:
+            procedures.catalog.clear()
+
+    def test_unknown_categories(self):
+        with open(self.path, 'a') as source:
+            source.write('12345,Unheard of procedure,nonsense,10,20\n')
+
+        categories = (plans.global_service_names.keys() |
+            plans.global_service_names_reverse.keys())
+        with self.assertLogs(procedures.logger, 'WARNING'):
+            self.catalog.load(self.path, categories)
+
+        self.assertEqual(len(self.catalog), len(self.rows) - 1)
+        self.assertRaises(KeyError, self.catalog.lookup, '12345')
+        self.assertNotIn('12345', [procedure.code
+            for procedure in self.catalog.search('unheard of')])
+        self.assertEqual(self.catalog.lookup('71045').category,
+            'Diagnostic Laboratory and X-ray')
+
+
+class PlanCatalogsTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.catalogs = catalogs.PlanCatalogs(plans.plans, self.root)
+
+        for employer, year in (('acme', 2015), ('acme', 2016), ('initech', 2016)):
+            self.catalogs.save(employer, year, plans.plans)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_round_trip(self):
+        catalog = self.catalogs.get('acme', 2015)
+        self.assertIsNot(catalog, plans.plans)
+        self.assertEqual(catalog.version, plans.plans.version)
+        self.assertEqual(catalog.get_preset_results(), plans.get_preset_results())
+
+    def test_selection(self):
+        self.assertIs(self.catalogs.get(), plans.plans)
+        self.assertIs(self.catalogs.get('acme'), self.catalogs.get('acme', '2016'))
+        self.assertIs(self.catalogs.get('acme', 2015), self.catalogs.get('acme', 2015))
+
+        for employer, year in (('acme', 2014), ('globex', None), ('../acme', 2015),
+                ('acme', 'latest')):
+            self.assertRaises(KeyError, self.catalogs.get, employer, year)
+
+    def test_latest_year_cached(self):
+        listed = []
+        years = self.catalogs.years
+        self.catalogs.years = lambda employer: listed.append(employer) or years(employer)
+
+        latest = self.catalogs.get('acme')
+        self.assertIs(self.catalogs.get('acme'), latest)
+        self.assertEqual(listed, ['acme'])
+
+        # A newly saved year is picked up, listing again only when it loads
+        self.catalogs.save('acme', 2017, plans.plans)
+        latest = self.catalogs.get('acme')
+        self.assertIs(latest, self.catalogs.get('acme', 2017))
+        self.assertIs(self.catalogs.get('acme'), latest)
+        self.assertEqual(listed, ['acme', 'acme'])
+
+    def test_eviction(self):
+        first = self.catalogs.get('acme', 2015)
+        self.catalogs.budget = self.catalogs.resident_size * 2
+
+        self.catalogs.get('acme', 2016)
+        self.catalogs.get('acme', 2015)
+        self.catalogs.get('initech', 2016)
+
+        self.assertEqual(list(self.catalogs.resident),
+            [('acme', 2015), ('initech', 2016)])
+        self.assertEqual(self.catalogs.stats()['evictions'], 1)
+        self.assertIs(self.catalogs.get('acme', 2015), first)
+
+
+class JobQueueTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.queue = jobs.JobQueue(os.path.join(self.root, 'jobs.sqlite3'),
+            os.path.join(self.root, 'results'), chunk_size=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_batch_job(self):
+        scenarios = {name: {'me': services}
+            for name, services in plans.get_presets().items()}
+        job_id = self.queue.submit('batch', {'scenarios': scenarios})
+        self.assertEqual(self.queue.status(job_id)['status'], 'queued')
+
+        self.assertTrue(self.queue.run_next())
+        self.assertFalse(self.queue.run_next())
+
+        status = self.queue.status(job_id)
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(status['progress'], 1)
+        self.assertEqual(set(status['partial']), set(plans.plans.plans))
+
+        with open(self.queue.result_path(job_id)) as result_file:
+            result = json.load(result_file)
+        expected = plans.run_batch(scenarios)
+        for name, scenario_results in expected.items():
+            for plan_name, sim_result in scenario_results.items():
+                self.assertEqual(result['results'][name][plan_name],
+                    sim_result.to_dict())
+
+    def test_partial_and_cancel(self):
+        job_id = self.queue.submit('aggregate',
+            {'random': {'count': 10, 'seed': 1}})
+        progress = []
+
+        def cancel_midway(job_id, done, total, partial=None):
+            progress.append((done, total))
+            if done == 6:
+                self.queue.cancel(job_id)
+            record(job_id, done, total, partial)
+
+        record = self.queue.progress
+        self.queue.progress = cancel_midway
+        self.queue.run_next()
+
+        status = self.queue.status(job_id)
+        self.assertEqual(status['status'], 'cancelled')
+        self.assertEqual(progress, [(0, 10), (3, 10), (6, 10)])
+        self.assertEqual(status['done'], 3)
+        self.assertEqual(status['partial'][next(iter(plans.plans.plans))]['count'], 3)
+        self.assertFalse(os.path.exists(self.queue.result_path(job_id)))
+
+        self.assertRaises(ValueError, self.queue.submit, 'nonsense', {})
+        self.assertRaises(KeyError, self.queue.status, 'missing')
+
+    def test_work_purges(self):
+        scenarios = {'er': {'me': [{'service': 'er', 'price': 550, 'in_network': True}]}}
+        old = self.queue.submit('batch', {'scenarios': scenarios})
+        self.queue.run_next()
+        self.queue.execute('UPDATE simulation_jobs SET finished = ? WHERE id = ?',
+            (time.time() - 120, old))
+        recent = self.queue.submit('batch', {'scenarios': scenarios})
+
+        class Stop(Exception):
+            pass
+
+        polls = []
+        run_next = self.queue.run_next
+
+        def poll():
+            polls.append(len(polls))
+            if len(polls) > 2:
+                raise Stop
+            return run_next()
+
+        self.queue.run_next = poll
+        self.assertRaises(Stop, self.queue.work, 0, 60, 0)
+
+        self.assertRaises(KeyError, self.queue.status, old)
+        self.assertFalse(os.path.exists(self.queue.result_path(old)))
+        self.assertEqual(self.queue.status(recent)['status'], 'done')
+        self.assertTrue(os.path.exists(self.queue.result_path(recent)))
+
+    def test_bad_params(self):
+        service = {'service': 'er', 'price': 550, 'in_network': True}
+        invalid = (
+            ('batch', {}),
+            ('batch', {'scenarios': 3}),
+            ('batch', {'scenarios': {'er': 3}}),
+            ('batch', {'scenarios': {'er': {'me': [dict(service, price='abc')]}}}),
+            ('aggregate', {}),
+            ('aggregate', {'scenarios': [{'me': 3}]}),
+            ('aggregate', {'random': {}}),
+            ('aggregate', {'random': {'count': '10'}}),
+            ('aggregate', {'random': {'count': 10, 'seed': [1]}}),
+            ('grid', {}),
+            ('grid', {'plan': 'HDHP'}),
+            ('grid', {'plan': 'HDHP', 'population': [{'me': [service]}],
+                'premium': 'abc'}),
+            ('grid', {'plan': 'HDHP', 'population': [{'me': [service]}],
+                'in_network': {'services': {'er': [{'rule': ['nonsense']}]}}}),
+        )
+        for kind, params in invalid:
+            self.assertRaises(ValueError, self.queue.submit, kind, params)
+        self.assertIsNone(self.queue.claim())
+
+    def test_infinite_results(self):
+        job_id = self.queue.submit('aggregate', {'random': {'count': 1}})
+        self.queue.claim()
+        self.queue.finish(job_id, {'designs': [{'out_of_pocket_max': math.inf}]})
+
+        with open(self.queue.result_path(job_id)) as result_file:
+            self.assertEqual(result_file.read(),
+                '{"designs": [{"out_of_pocket_max": null}]}')
+
+    def test_bad_submissions(self):
+        rate_limiter.counts = {}
+        for body in ('{', '[]', '{"kind": "batch", "params": []}',
+                '{"kind": "nonsense"}',
+                '{"kind": "batch", "params": {"scenarios": 3}}',
+                '{"kind": "grid", "params": {}}'):
+            response = self.client.post('/api/jobs', body,
+                content_type='application/json', HTTP_X_API_TOKEN=issue_token())
+            self.assertEqual(response.status_code, 400, body)
+            self.assertIn('error', json.loads(response.content.decode('utf-8')))
+
+
+class ProfilingTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_report(self):
+        services = {'me': [{'service': 'er', 'price': 550, 'in_network': True},
+            {'service': 'sov', 'price': 75, 'in_network': False}] * 10}
+        size = profiling.scenario_size(services, len(plans.plans.plans))
+
+        result, path = profiling.profile_call(self.root, 'simulate', size,
+            plans.run_simulation_results, services)
+        self.assertEqual(result, plans.run_simulation_results(services))
+
+        with open(path) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(report['size'], {'services': 20, 'plans': len(plans.plans.plans)})
+        self.assertGreater(report['allocation']['peak_bytes'], 0)
+        self.assertGreater(report['profile']['calls'], 20)
+        self.assertEqual(report['per_service']['calls'], report['profile']['calls'] / 20)
+        self.assertTrue(os.path.exists(path[:-len('.json')] + '.prof'))
+
+    def test_concurrent_calls(self):
+        services = {'me': [{'service': 'er', 'price': 550, 'in_network': True}]}
+        size = profiling.scenario_size(services, len(plans.plans.plans))
+        paths = []
+        errors = []
+
+        def profile():
+            try:
+                paths.append(profiling.profile_call(self.root, 'simulate',
+                    size, plans.run_simulation_results, services)[1])
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=profile) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(paths)), 8)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_outside_trace(self):
+        services = {'me': [{'service': 'er', 'price': 550, 'in_network': True}]}
+        tracemalloc.start()
+        try:
+            _, path = profiling.profile_call(self.root, 'simulate', {},
+                plans.run_simulation_results, services)
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+
+        with open(path) as report_file:
+            report = json.load(report_file)
+        if hasattr(tracemalloc, 'reset_peak'):
+            self.assertGreater(report['allocation']['peak_bytes'], 0)
+        else:
+            self.assertIsNone(report['allocation']['peak_bytes'])
+
+
+class StaticAssetTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.settings = override_settings(STATIC_ROOT=self.root)
+        self.settings.enable()
+
+        files = {
+            'app.css': b'body {}',
+            'app.0123456789ab.css': b'body {}',
+            'app.0123456789ab.css.gz': b'gzip',
+            'app.0123456789ab.css.br': b'brotli',
+            'staticfiles.json': json.dumps({'version': '1.0',
+                'paths': {'app.css': 'app.0123456789ab.css'}}).encode(),
+        }
+        for name, content in files.items():
+            with open(os.path.join(self.root, name), 'wb') as asset:
+                asset.write(content)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.root)
+
+    def get(self, path, accept_encoding=''):
+        return self.client.get('/static/' + path,
+            HTTP_ACCEPT_ENCODING=accept_encoding)
+
+    def test_encoding_negotiation(self):
+        for accept_encoding, content_encoding, content in (
+                ('', None, b'body {}'),
+                ('gzip', 'gzip', b'gzip'),
+                ('gzip, deflate, br', 'br', b'brotli'),
+                ('br;q=1.0, identity', 'br', b'brotli'),
+                ('br;q=0, gzip', 'gzip', b'gzip'),
+                ('gzip;q=0', None, b'body {}'),
+                ('*', 'br', b'brotli'),
+                ('*, br;q=0', 'gzip', b'gzip'),
+                ('deflate', None, b'body {}')):
+            response = self.get('app.0123456789ab.css', accept_encoding)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get('Content-Encoding'), content_encoding)
+            self.assertEqual(b''.join(response.streaming_content), content)
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertEqual(response['Content-Type'], 'text/css')
+
+    def test_cache_control(self):
+        self.assertIn('immutable', self.get('app.0123456789ab.css')['Cache-Control'])
+        self.assertEqual(self.get('app.css')['Cache-Control'],
+            'public, max-age=0, must-revalidate')
+
+        self.assertEqual(self.get('missing.css').status_code, 404)
+        self.assertEqual(self.get('../settings.py').status_code, 400)
+
+    @override_settings(DEBUG=True)
+    def test_hashed_urls_in_debug(self):
+        self.assertEqual(staticfiles_storage.url('app.css'),
+            '/static/app.0123456789ab.css')
+
+
+class LandingPageTest(TestCase):
+    def setUp(self):
+        HealthSimView.rendered = {}
+
+    def embedded(self, content, name):
+        match = re.search(r'var {} = (.*);'.format(name), content)
+        return json.loads(match.group(1))
+
+    def test_embedded_catalog(self):
+        response = self.client.get('/HealthSim/')
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode('utf-8')
+
+        self.assertEqual(self.embedded(content, 'service_catalog'),
+            service_catalog())
+        self.assertEqual(self.embedded(content, 'scenario_presets'),
+            plans.get_presets())
+        self.assertEqual(self.embedded(content, 'preset_results'),
+            json.loads(json.dumps(plans.get_preset_results())))
+        self.assertIn(plans.plans.version, content)
+
+        # The CSRF and API tokens come in cookies, not in the page
+        self.assertIn('csrftoken', response.cookies)
+        self.assertIn('api_token', response.cookies)
+        self.assertNotIn(response.cookies['csrftoken'].value, content)
+
+    def test_rendered_once_per_version(self):
+        first = self.client.get('/HealthSim/')
+        self.assertEqual(list(HealthSimView.rendered), [plans.plans.version])
+
+        second = self.client.get('/HealthSim/')
+        self.assertEqual(first.content, second.content)
+        self.assertNotEqual(first.cookies['api_token'].value,
+            second.cookies['api_token'].value)
+
+    def test_script_json(self):
+        self.assertEqual(script_json({'name': '</script><script>'}),
+            '{"name": "<\\/script><script>"}')
+
+
+class ApiTest(TestCase):
+    services = {'me': [{'service': 'er', 'price': 550, 'in_network': True}]}
+
+    def setUp(self):
+        rate_limiter.counts = {}
+        rate_limiter.window_start = time.monotonic()
+
+    def post(self, path, body, token=None, **extra):
+        if token is None:
+            token = issue_token()
+        return self.client.post(path, body, content_type='application/json',
+            HTTP_X_API_TOKEN=token, **extra)
+
+    def test_tokens(self):
+        body = json.dumps(self.services)
+        self.assertEqual(self.post('/api/simulate', body).status_code, 200)
+
+        expired = token_signer.sign('0' * 32)
+        for token in ('', 'nonsense', issue_token() + 'x'):
+            self.assertEqual(self.post('/api/simulate', body, token).status_code, 403)
+        with self.settings(API_TOKEN_MAX_AGE=-1):
+            self.assertEqual(self.post('/api/simulate', body, expired).status_code, 403)
+
+        self.assertEqual(self.client.get('/api/simulate').status_code, 405)
+
+    def test_rate_limit(self):
+        body = json.dumps(self.services)
+        limit = rate_limiter.limit
+        rate_limiter.limit = 3
+        try:
+            # A fresh token for every request doesn't get around the limit
+            statuses = [self.post('/api/simulate', body).status_code
+                for _ in range(5)]
+            other = self.post('/api/simulate', body, REMOTE_ADDR='10.0.0.2')
+        finally:
+            rate_limiter.limit = limit
+
+        self.assertEqual(statuses, [200, 200, 200, 429, 429])
+        self.assertEqual(other.status_code, 200)
+
+    def test_bad_requests(self):
+        for path in ('/api/simulate', '/api/bounds', '/api/best', '/api/batch'):
+            for body in ('{', '[]', '"me"', '\xff', '{"me": 3}'):
+                if path == '/api/batch' and body == '{"me": 3}':
+                    body = '{"scenario": {"me": 3}}'
+                response = self.post(path, body)
+                self.assertEqual(response.status_code, 400, (path, body))
+                self.assertIn('error', json.loads(response.content.decode('utf-8')))
+
+    def test_bad_batch_scenarios(self):
+        for service in (3, {'service': 'er', 'price': 'abc', 'in_network': True}):
+            body = json.dumps({'good': self.services, 'bad': {'me': [service]}})
+            response = self.post('/api/batch', body)
+            self.assertEqual(response.status_code, 400, service)
+            self.assertIn('error', json.loads(response.content.decode('utf-8')))
+
+    def test_bad_marginal_prices(self):
+        for prices in (3, [], {'nonsense': 20}, {'er': 'abc'}, {'er': None}):
+            body = json.dumps(dict(self.services, prices=prices))
+            response = self.post('/api/marginal', body)
+            self.assertEqual(response.status_code, 400, prices)
+            self.assertIn('error', json.loads(response.content.decode('utf-8')))
+
+        body = json.dumps(dict(self.services, prices={'er': 600, 'rg': 25}))
+        self.assertEqual(self.post('/api/marginal', body).status_code, 200)
+
+    def test_middleware_chain(self):
+        from FidHealth.wsgi import api_application, application
+
+        api_application.load_middleware()
+        loaded = {method.__self__.__class__.__module__ + '.' +
+                method.__self__.__class__.__name__
+            for method in api_application._request_middleware +
+                api_application._response_middleware}
+        self.assertEqual(loaded, set(settings.API_MIDDLEWARE_CLASSES))
+
+        body = json.dumps(self.services).encode('utf-8')
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': '/api/simulate',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(body)),
+            'HTTP_X_API_TOKEN': issue_token(),
+            'wsgi.input': io.BytesIO(body),
+        }
+        setup_testing_defaults(environ)
+        started = []
+
+        with self.assertNumQueries(0):
+            content = b''.join(application(environ,
+                lambda status, headers, exc_info=None: started.append((status, headers))))
+
+        status, headers = started[0]
+        self.assertEqual(status, '200 OK')
+        self.assertNotIn('Set-Cookie', dict(headers))
+        self.assertEqual(set(json.loads(content.decode('utf-8'))),
+            set(plans.plans.plans))
+
+
+class LoadTestTest(LiveServerTestCase):
+    def setUp(self):
+        self.limit = rate_limiter.limit
+        rate_limiter.counts = {}
+        handle, self.log = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+
+    def tearDown(self):
+        rate_limiter.limit = self.limit
+        os.remove(self.log)
+        plans.load_plans()
+
+    def loadtest(self, **options):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('loadtest', url=self.live_server_url, requests=40,
+            concurrency=4, stdout=stdout, stderr=stderr, **options)
+        return json.loads(stdout.getvalue()), stderr.getvalue()
+
+    def test_synthesize_and_replay(self):
+        # Like a fresh manage.py process, which hasn't loaded the plans
+        plans.plans.plans = None
+        rate_limiter.limit = 0
+        report, warnings = self.loadtest(record=self.log,
+            mix='landing=1,get_service_list=1,ajax_json_0=2,api_simulate=2')
+
+        self.assertEqual(report['requests'], 40)
+        self.assertEqual(report['errors'], 0, report['statuses'])
+        self.assertEqual(set(report['endpoints']), set(loadtest.endpoints))
+        self.assertEqual(warnings, '')
+
+        # The recording replays the same requests, which the rate limit
+        # now turns away
+        rate_limiter.limit = 1
+        replayed, warnings = self.loadtest(replay=self.log)
+        self.assertEqual(replayed['endpoints'].keys(), report['endpoints'].keys())
+        self.assertGreater(replayed['statuses'].get('429', 0), 0)
+        self.assertIn('HEALTHSIM_API_RATE_LIMIT=0', warnings)
+
+
+class PresetResultsTest(TestCase):
+    def test_results_match_simulations(self):
+        results = plans.get_preset_results()
+        self.assertEqual(set(results), set(plans.get_presets()))
+
+        for name, services in plans.get_presets().items():
+            self.assertEqual(results[name], plans.run_simulations({'me': services}))
+        self.assertEqual(json.loads(plans.get_preset_results_json()), results)
+
+    def test_recomputed_with_version(self):
+        catalog = plans.GlobalPlans.from_dict(plans.plans.to_dict())
+        results = catalog.get_preset_results()
+        self.assertIs(catalog.get_preset_results(), results)
+        self.assertEqual(results, plans.get_preset_results())
+
+        changed = catalog.to_dict()
+        for details in changed.values():
+            details['premium'] += 100
+        catalog.set_plans(plans.GlobalPlans.from_dict(changed).plans)
+
+        self.assertNotEqual(catalog.version, plans.plans.version)
+        for name, preset in catalog.get_preset_results().items():
+            for plan_name, result in preset.items():
+                self.assertAlmostEqual(result['out_of_pocket'],
+                    results[name][plan_name]['out_of_pocket'] + 1200)
+
+    def test_presets_endpoint(self):
+        response = self.client.get('/api/presets', HTTP_X_API_TOKEN=issue_token())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode('utf-8'),
+            plans.get_preset_results_json())
+
+
+class EncodingTest(TestCase):
+    def setUp(self):
+        self.results = plans.run_batch({name: {'me': services}
+            for name, services in plans.get_presets().items()})
+        self.factory = RequestFactory()
+
+    def respond(self, accept='', accept_encoding='', single=False):
+        request = self.factory.get('/', HTTP_ACCEPT=accept,
+            HTTP_ACCEPT_ENCODING=accept_encoding)
+        results = self.results
+        if single:
+            name = sorted(results)[0]
+            results = {name: results[name]}
+        return encoding.results_response(request, results, single)
+
+    def expected(self):
+        return {scenario: {plan: result.to_dict()
+                for plan, result in scenario_results.items()}
+            for scenario, scenario_results in self.results.items()}
+
+    def from_columns(self, header, columns):
+        rows = iter(zip(*(columns[field] for field in header['fields'])))
+        return {scenario: {plan: dict(zip(header['fields'], next(rows)))
+                for plan in header['plans']}
+            for scenario in header['scenarios']}
+
+    def test_json(self):
+        response = self.respond()
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content.decode('utf-8')),
+            self.expected())
+
+        name = sorted(self.results)[0]
+        single = self.respond(single=True)
+        self.assertEqual(json.loads(single.content.decode('utf-8')),
+            self.expected()[name])
+
+    def test_columnar(self):
+        response = self.respond('application/x-healthsim-columnar')
+        self.assertEqual(response['Content-Type'], 'application/x-healthsim-columnar')
+
+        body = response.content
+        self.assertEqual(body[:4], b'HSC1')
+        (length,) = struct.unpack('<I', body[4:8])
+        header = json.loads(body[8:8 + length].decode('utf-8'))
+
+        offset = 8 + length
+        columns = {}
+        for field in header['fields']:
+            size = 8 * header['rows']
+            columns[field] = struct.unpack('<{}d'.format(header['rows']),
+                body[offset:offset + size])
+            offset += size
+
+        self.assertEqual(offset, len(body))
+        self.assertEqual(self.from_columns(header, columns), self.expected())
+
+    @skipIf(encoding.msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        response = self.respond('application/json;q=0.5, application/x-msgpack')
+        self.assertEqual(response['Content-Type'], 'application/x-msgpack')
+
+        header = encoding.msgpack.unpackb(response.content, raw=False)
+        self.assertEqual(self.from_columns(header, header['columns']),
+            self.expected())
+
+    def test_negotiation(self):
+        self.assertEqual(self.respond('text/html, */*')['Content-Type'],
+            'application/json')
+        self.assertEqual(self.respond(
+            'application/x-healthsim-columnar;q=0, application/json')['Content-Type'],
+            'application/json')
+
+        self.assertFalse(self.respond(accept_encoding='gzip').has_header(
+            'Content-Encoding'))
+
+        # Bodies big enough to benefit are gzipped
+        self.results = {'{} {}'.format(name, copy): scenario_results
+            for name, scenario_results in self.results.items()
+            for copy in range(20)}
+        self.assertFalse(self.respond(accept_encoding='gzip;q=0, deflate').has_header(
+            'Content-Encoding'))
+        response = self.respond(accept_encoding='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content).decode('utf-8')),
+            self.expected())
+        self.assertEqual(response['Vary'], 'Accept, Accept-Encoding')
+
+
+class AggregateTest(TestCase):
+    def setUp(self):
+        rng = random.Random(3)
+        self.values = [0] * 50 + [rng.lognormvariate(7, 1.5) for _ in range(2000)]
+        rng.shuffle(self.values)
+
+    def result(self, cost):
+        return plans.SimResult(*([cost] * len(plans.SimResult._fields)))
+
+    def aggregate(self, values):
+        aggregator = aggregate.ResultAggregator()
+        for value in values:
+            aggregator.add('plan', self.result(value))
+        return aggregator
+
+    def test_moments(self):
+        summary = self.aggregate(self.values).summary()['plan']
+        self.assertEqual(summary['count'], len(self.values))
+        self.assertAlmostEqual(summary['mean'], statistics.mean(self.values))
+        self.assertAlmostEqual(summary['variance'] / statistics.variance(self.values), 1)
+        self.assertEqual(summary['min'], 0)
+        self.assertEqual(summary['max'], max(self.values))
+
+    def test_quantile_accuracy(self):
+        ordered = sorted(self.values)
+        sketch = aggregate.QuantileSketch(0.01)
+        for value in self.values:
+            sketch.add(value)
+
+        for q in (0, 0.01, 0.02, 0.1, 0.25, 0.5, 0.9, 0.99, 0.999, 1):
+            expected = ordered[int(q * (len(ordered) - 1))]
+            estimate = sketch.quantile(q)
+            if expected == 0:
+                self.assertEqual(estimate, 0)
+            else:
+                self.assertLessEqual(abs(estimate - expected) / expected, 0.01)
+
+    def test_merge(self):
+        whole = self.aggregate(self.values)
+        merged = aggregate.ResultAggregator()
+        for start in range(0, len(self.values), 300):
+            merged.merge(self.aggregate(self.values[start:start + 300]))
+
+        expected = whole.summary()['plan']
+        summary = merged.summary()['plan']
+        for key in ('mean', 'variance'):
+            self.assertAlmostEqual(summary[key] / expected[key], 1)
+        for key in ('count', 'min', 'max', 'quantiles', 'histogram'):
+            self.assertEqual(summary[key], expected[key])
+
+        self.assertRaises(ValueError, aggregate.QuantileSketch(0.01).merge,
+            aggregate.QuantileSketch(0.02))
+
+    def test_thresholds_met(self):
+        network = plans.NetworkSimResult
+        aggregator = aggregate.PlanAggregator()
+        # In network has no deductible; out of network has one
+        for networks in (
+                (network(100, 0, 900), network(0, 500, 2000)),
+                (network(1000, 0, 0), network(500, 0, 1500))):
+            aggregator.add(self.result(0), networks, (0, 500))
+
+        summary = aggregator.summary()
+        self.assertEqual(summary['deductible_met'],
+            {'in_network': None, 'out_of_network': 0.5})
+        self.assertEqual(summary['oop_maximum_met'],
+            {'in_network': 0.5, 'out_of_network': 0})
@@ -0,0 +1,24 @@
+import uuid
+
+from django.conf import settings
+from django.core import signing
+
+
+token_signer = signing.TimestampSigner(salt='HealthSim.api')
+
+# The cookie the landing page sets with a fresh API token
+token_cookie = 'api_token'
+
+
+def issue_token():
+    return token_signer.sign(uuid.uuid4().hex)
+
+
+def check_token(token):
+    '''
+    Return the token's id if it's valid and not expired, or None
+    '''
+    try:
+        return token_signer.unsign(token, max_age=settings.API_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
@@ -2,21 +2,119 @@ import traceback
 import sys
 import json
 import socket
+import mimetypes
+import os
 
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
 from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils._os import safe_join
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import ensure_csrf_cookie
 
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, HttpResponseBadRequest, Http404, FileResponse
 from django.views.generic import TemplateView
 
 from .insurance import plans as plans
-from .insurance.plans import run_simulations
+from .insurance import procedures
+from .insurance import profiling
+from .insurance.catalogs import configure_catalogs, get_catalog
+from .insurance.jobs import configure_jobs
+from .tokens import issue_token, token_cookie
+from .encoding import accepts_encoding, results_response
 
 plans.load_plans()
+procedures.load_catalog(settings.PROCEDURE_CATALOG,
+    plans.global_service_names.keys() | plans.global_service_names_reverse.keys())
+configure_catalogs(settings.PLAN_CATALOG_ROOT, settings.PLAN_CATALOG_CACHE_BYTES)
+configure_jobs(settings.JOBS_DATABASE, settings.JOBS_RESULT_DIR,
+    settings.JOBS_CHUNK_SIZE)
+
+def script_json(value):
+    '''
+    JSON encode a value for embedding in an inline <script>
+    '''
+    return json.dumps(value).replace('</', '<\\/')
+
+def request_catalog(params):
+    '''
+    The plan catalog picked by the "employer" and "year" request parameters,
+    or the built-in one without them
+    '''
+    try:
+        return get_catalog(params.get('employer'), params.get('year'))
+    except KeyError:
+        raise Http404("Unknown plan catalog")
+
+def should_profile(request):
+    return settings.PROFILE_SIMULATIONS or (settings.PROFILE_REQUESTS_ALLOWED
+        and request.GET.get('profile') == '1')
+
+def simulation_results(request, catalog, services, label):
+    '''
+    catalog.run_simulation_results(services), profiled if the environment or
+    the request asks for it. Returns the results and the profile report's
+    path, or None.
+    '''
+    if not should_profile(request):
+        return catalog.run_simulation_results(services), None
+
+    return profiling.profile_call(settings.PROFILE_REPORT_DIR, label,
+        profiling.scenario_size(services, len(catalog.plans)),
+        catalog.run_simulation_results, services)
+
+def profiled_response(response, report):
+    if report is not None:
+        response['X-Profile-Report'] = os.path.basename(report)
+    return response
+
+def service_catalog(catalog=plans.plans):
+    return sorted(
+        ({"name" : name, "service" : service}
+            for name, service in catalog.get_service_list()),
+        key=lambda entry: entry["name"])
 
 class HealthSimView(TemplateView):
+    '''
+    The landing page. The service catalog and scenario presets are embedded
+    in the page, so it's usable without any further requests. The page has no
+    per-request content (the CSRF and API tokens are read from cookies), so
+    it's rendered once per catalog version and then served from memory. The
+    page's query string picks the employer's catalog, and is passed on to the
+    API calls the page makes.
+    '''
     template_name = "First.html"
     #template_name = "health_sim_template.html"
 
+    # {catalog version: rendered page}, dropped wholesale when it gets big
+    rendered = {}
+    rendered_limit = 256
+
+    @method_decorator(ensure_csrf_cookie)
+    def dispatch(self, *args, **kwargs):
+        return super().dispatch(*args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        catalog = request_catalog(request.GET)
+        page = HealthSimView.rendered.get(catalog.version)
+        if page is None:
+            page = render_to_string(self.template_name, {
+                "catalog_version" : catalog.version,
+                "service_catalog_json" : script_json(service_catalog(catalog)),
+                "presets_json" : script_json(catalog.get_presets()),
+                "preset_results_json" : script_json(catalog.get_preset_results()),
+            })
+            if len(HealthSimView.rendered) >= HealthSimView.rendered_limit:
+                HealthSimView.rendered = {}
+            HealthSimView.rendered[catalog.version] = page
+
+        response = HttpResponse(page)
+        response.set_cookie(token_cookie, issue_token(),
+            max_age=settings.API_TOKEN_MAX_AGE)
+        return response
+
 def ajax_view_0(request):
 
     if request.method == "POST":
@@ -26,10 +124,38 @@ def ajax_view_0(request):
         simulation_input = {"me" : json.loads(response_list[0])}
         # Run simulation if we have input
         simulation_result = {}
+        report = None
         if simulation_input:
-            simulation_result = run_simulations(simulation_input)
+            try:
+                simulation_result, report = simulation_results(request,
+                    request_catalog(request.POST), simulation_input,
+                    'ajax_json_0')
+            except plans.InvalidService as error:
+                return HttpResponseBadRequest(str(error))
 
-        return HttpResponse(json.dumps(simulation_result), content_type='application/json')
+        return profiled_response(
+            results_response(request, {"me" : simulation_result}, single=True),
+            report)
+    else:
+        raise Http404("IDK LOL")
+
+def too_many_bounds_services(services):
+    return len(services.get('me', ())) > settings.BOUNDS_MAX_SERVICES
+
+def ajax_bounds_view(request):
+    if request.method == "POST":
+        response_list = request.POST.getlist('client_input_dict')
+        simulation_input = {"me" : json.loads(response_list[0])}
+        if too_many_bounds_services(simulation_input):
+            return HttpResponseBadRequest("Too many services")
+        # Cheapest and most expensive results over every service ordering
+        try:
+            bounds_result = request_catalog(request.POST).run_bounds(
+                simulation_input)
+        except plans.InvalidService as error:
+            return HttpResponseBadRequest(str(error))
+
+        return HttpResponse(json.dumps(bounds_result), content_type='application/json')
     else:
         raise Http404("IDK LOL")
 
@@ -37,11 +163,55 @@ def get_service_list_view(request):
     if 'client_ajax_input_0' in request.POST:
         response_dict = {} 
         # Populate with Nate's method, for now use this
-        response_dict = {"service_list" : [{
-            "name" : name, "service" : service } 
-            for name, service in plans.get_service_list()]}
+        response_dict = {"service_list" : service_catalog(request_catalog(request.POST))}
         #response_dict.update({"service_list" : [{"name": "Primary Care Physician", "service": "pcp"}, {"name": "Emergency Room", "service": "er"}]});
         return HttpResponse(json.dumps(response_dict), content_type='application/json')
     else:
         raise Http404("IDK")
 
+
+# Precompressed variants written by CompressedManifestStaticFilesStorage, in
+# order of preference
+static_encodings = (('br', '.br'), ('gzip', '.gz'))
+
+def static_asset_view(request, path):
+    '''
+    Serve a collected static file, picking a precompressed variant if the
+    client accepts one. Content-hashed names never change, so they're served
+    with a far-future immutable Cache-Control.
+    '''
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except ValueError:
+        raise Http404("Bad static path")
+
+    if not os.path.isfile(full_path):
+        # Files that haven't been collected yet, in development
+        full_path = finders.find(path) if settings.DEBUG else None
+        if not full_path:
+            raise Http404("No such static file")
+
+    content_type, _ = mimetypes.guess_type(full_path)
+    encoding = None
+    for candidate, suffix in static_encodings:
+        if (accepts_encoding(request, candidate) and
+                os.path.isfile(full_path + suffix)):
+            encoding = candidate
+            full_path += suffix
+            break
+
+    response = FileResponse(open(full_path, 'rb'),
+        content_type=content_type or 'application/octet-stream')
+    response['Content-Length'] = os.path.getsize(full_path)
+    response['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response['Content-Encoding'] = encoding
+
+    is_hashed = getattr(staticfiles_storage, 'is_hashed', None)
+    if is_hashed is not None and is_hashed(path):
+        response['Cache-Control'] = 'public, max-age={}, immutable'.format(
+            settings.STATIC_HASHED_MAX_AGE)
+    else:
+        response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+
+    return response
@@ -4,6 +4,13 @@ from itertools import tee
 from functools import wraps
 from collections import namedtuple
 
+# The threshold logic lives in the kernel shared with the web engine
+from HealthSim.insurance.codegen import compile_network
+from HealthSim.insurance.kernel import (apply_to_threshold,
+    threshold_overflow, at_threshold, run_payments, LiteralService,
+    NetworkSimResult, Network, coverage, offered_service, run_network,
+    copay, coinsure, covered, not_covered)
+
 def _apply(result_type):
     def decorator(func):
         @wraps(func)
@@ -13,50 +20,17 @@ def _apply(result_type):
     return decorator
 
 
-def apply_to_threshold(threshold, cost):
-    '''
-    Given some maximum cumulative threshold, apply a cost to the threshold.
-    Returns the amount applied to the threshold, the remaining value of the
-    threshold, and any overflow to the cost.
-    '''
-    from_max = min(threshold, cost)
-    return from_max, threshold - from_max, cost - from_max
-
-
-def threshold_overflow(threshold, cost):
-    '''
-    Perfom an apply_to_threshold, returning the new threshold and the overflow.
-    Discard the amount applied to the threshold
-    '''
-    return apply_to_threshold(threshold, cost)[1:3]
-
-
-def at_threshold(threshold, cost):
+class Service(namedtuple('Service', ('name', 'cost', 'in_network', 'count'))):
     '''
-    Perform an apply_to_threshold, returning the amount applied and the
-    remaining value of the threshold. Discard the overflow.
+    A service, received `count` times in a row. Repeated services are
+    resolved all at once, rather than one at a time.
     '''
-    return apply_to_threshold(threshold, cost)[0:2]
-
-
-class LiteralService(namedtuple('LiteralService', ('cost', 'mod', 'ignore_deductible'))):
-    def __new__(cls, cost, mod, ignore_deductible=False):
-        return super().__new__(cls, cost, mod, ignore_deductible)
-
-
-class Service(namedtuple('Service', ('name', 'cost', 'in_network'))):
-    def __new__(cls, type, cost, in_network=True):
-        return super().__new__(cls, type, cost, in_network)
+    def __new__(cls, type, cost, in_network=True, count=1):
+        return super().__new__(cls, type, cost, in_network, count)
 
     def as_literal_service(self, plan_details):
-        details = plan_details.get(self.name, not_covered())
-
-        if isinstance(details, tuple):
-            mod, ignore_deductible = details
-        else:
-            mod, ignore_deductible = details, False
-
-        return LiteralService(self.cost, mod, ignore_deductible)
+        mod, ignore_deductible = coverage(plan_details, self.name)
+        return LiteralService(self.cost, mod, ignore_deductible, self.count)
 
 
 NetworkState = namedtuple('NetworkState',
@@ -68,7 +42,8 @@ PlanState = namedtuple('PlanState', (
     'coverage_remaining', 'in_network_state', 'out_of_network_state'))
 
 
-def network_tracker(network_deductible, network_oop_maximum):
+def network_tracker(network_deductible, network_oop_maximum,
+      run_month=run_network):
     '''
     Create a generator that tracks health service costs for a period of months.
     It tracks the deductible, out of pocket maximum, and out of pocket costs,
@@ -90,6 +65,10 @@ def network_tracker(network_deductible, network_oop_maximum):
 
     Note that this function creates the generator function- it's essentailly
     a template, so that the same plan can be reused.
+
+    Each month is simulated by `run_month(services, deductible, oop_maximum)`,
+    which returns the amount paid and the remaining thresholds. By default
+    that's the kernel's run_network, for literal services.
     '''
     def tracker(service_months):
         deductible = network_deductible
@@ -98,29 +77,8 @@ def network_tracker(network_deductible, network_oop_maximum):
         year_out_of_pocket = 0
 
         for services in service_months:
-            month_out_of_pocket = 0
-
-            for cost, mod, ignore_deductible in services:
-                # Handle the deductible
-                if not ignore_deductible:
-                    # Apply the deductible
-                    # `pre_deduct` is the amount applied to the deductible.
-                    # `deductible` is the remaining deductible
-                    # `cost` is any remaining cost after the deductible
-                    pre_deduct, deductible, cost = apply_to_threshold(deductible, cost)
-
-                    # Apply the out of pocket maximum
-                    # `pocket_cost` is the amount allowed by the out of pocket max
-                    # `oop_maximum` is the remaining out of pocket maximum
-                    pocket_cost, oop_maximum = at_threshold(oop_maximum, pre_deduct)
-                    month_out_of_pocket += pocket_cost
-
-                # Apply the mod (coinsurance or copay) to the cost after or ignoring
-                # the deductible, then apply the out of pocket maximum
-                # `pocket_cost` is the amount allowed by the out of pocket max
-                # `oop_maximum` is the remaining out of pocket maximum
-                pocket_cost, oop_maximum = at_threshold(oop_maximum, mod(cost))
-                month_out_of_pocket += pocket_cost
+            month_out_of_pocket, deductible, oop_maximum = run_month(
+                services, deductible, oop_maximum)
 
             # Apply this month's costs to the total
             year_out_of_pocket += month_out_of_pocket
@@ -140,7 +98,8 @@ def plan_tracker(premium, plan_employer_contribution,
     '''
     This creates a generator for a full plan. `in_network_init` and
     `out_of_network_init` are each tuples of (deductible, out_of_pocket_max)
-    for the two network types. It creates a generator which can be called with
+    for the two network types, optionally followed by the `run_month` for
+    network_tracker. It creates a generator which can be called with
     two separate service years- one for the in-network services and one for the
     out of network-services. See `network_tracker` for details in this. It
     yields the current state each month:
@@ -153,9 +112,15 @@ def plan_tracker(premium, plan_employer_contribution,
     Note that, like `network_tracker`, this function creates a generator
     function, which is called with the service years to create a generator for
     the simulation.
+
+    When only the state at the end of the year is needed, call the generator
+    function's `year_end` with the same arguments instead. It returns the
+    final PlanState without creating the states for the months before it.
     '''
     in_network = network_tracker(*in_network_init)
     out_of_network = network_tracker(*out_of_network_init)
+    run_months = plan_year_end(premium, plan_employer_contribution,
+        in_network_init, out_of_network_init)
 
     def tracker(in_network_services, out_of_network_services):
         employer_contribution = plan_employer_contribution
@@ -185,9 +150,61 @@ def plan_tracker(premium, plan_employer_contribution,
                 in_network_state,
                 out_of_network_state)
 
+    def year_end(in_network_services, out_of_network_services):
+        return run_months(zip(in_network_services, out_of_network_services))
+
+    tracker.year_end = year_end
     return tracker
 
 
+def plan_year_end(premium, plan_employer_contribution,
+      in_network_init, out_of_network_init):
+    '''
+    The year end only counterpart of plan_tracker: returns a function which
+    is called with an iterable of (in-network services, out-of-network
+    services) month pairs, and returns the PlanState after the last month.
+    The running totals are kept as plain numbers, so only the final states
+    are created. With no months, that's the state before the year starts.
+    '''
+    in_deductible, in_oop_maximum, in_run_month = (
+        tuple(in_network_init) + (run_network,))[:3]
+    out_deductible, out_oop_maximum, out_run_month = (
+        tuple(out_of_network_init) + (run_network,))[:3]
+
+    def run_months(month_pairs):
+        employer_contribution = plan_employer_contribution
+        year_out_of_pocket = year_service_cost = 0
+        month_out_of_pocket = month_service_cost = 0
+
+        in_deductible_left, in_oop_left = in_deductible, in_oop_maximum
+        out_deductible_left, out_oop_left = out_deductible, out_oop_maximum
+        in_month = in_year = out_month = out_year = 0
+
+        for in_services, out_services in month_pairs:
+            in_month, in_deductible_left, in_oop_left = in_run_month(
+                in_services, in_deductible_left, in_oop_left)
+            out_month, out_deductible_left, out_oop_left = out_run_month(
+                out_services, out_deductible_left, out_oop_left)
+            in_year += in_month
+            out_year += out_month
+
+            # The same steps as plan_tracker, so the totals match exactly
+            employer_contribution, month_service_cost = threshold_overflow(
+                employer_contribution, in_month + out_month)
+            month_out_of_pocket = month_service_cost + premium
+            year_out_of_pocket += month_out_of_pocket
+            year_service_cost += month_service_cost
+
+        return PlanState(
+            month_out_of_pocket, month_service_cost,
+            year_out_of_pocket, year_service_cost,
+            employer_contribution,
+            NetworkState(in_month, in_year, in_deductible_left, in_oop_left),
+            NetworkState(out_month, out_year, out_deductible_left, out_oop_left))
+
+    return run_months
+
+
 def plan_sim(
       premium, employer_contribution,
       in_network_service_details, out_of_network_service_details):
@@ -200,60 +217,52 @@ def plan_sim(
         - service name
         - service cost
         - in network
+        - count
 
-    It yields out the same state as plan_tracker
+    Services a network doesn't list aren't covered. It yields out the same
+    state as plan_tracker. Like plan_tracker's, the sim's `year_end` returns
+    only the final state; each month is read once and handed to both
+    networks, rather than being buffered for each by tee.
     '''
-
-    def convert_services(service_months, in_network, details):
-        '''
-        Given all the services in a year, filter to only the services on this
-        network, and convert to the literal (cost, mod, ignore_deductible)
-        format
-        '''
-        for services in service_months:
-            yield [service.as_literal_service(details)
-                for service in services
-                if service.in_network == in_network]
-
-
-    in_network_init = (
-        in_network_service_details['deductible'],
-        in_network_service_details['out_of_pocket_max'])
-
-    out_of_network_init = (
-        out_of_network_service_details['deductible'],
-        out_of_network_service_details['out_of_pocket_max'])
+    in_network_init = network_init(in_network_service_details, True)
+    out_of_network_init = network_init(out_of_network_service_details, False)
 
     tracker = plan_tracker(premium, employer_contribution,
         in_network_init, out_of_network_init)
+    run_months = plan_year_end(premium, employer_contribution,
+        in_network_init, out_of_network_init)
 
     def sim(service_months):
         in_service_months, out_of_service_months = tee(service_months)
 
-        for state in tracker(
-            convert_services(in_service_months, True, in_network_service_details),
-            convert_services(out_of_service_months, False, out_of_network_service_details)):
-
+        for state in tracker(in_service_months, out_of_service_months):
             yield state
 
-    return sim
-
+    def year_end(service_months):
+        return run_months((services, services) for services in service_months)
 
-def copay(amount):
-    return lambda cost: min(cost, amount)
-
-
-def coinsure(percent):
-    mult = percent / 100
-    return lambda cost: cost * mult
+    sim.year_end = year_end
+    return sim
 
 
-def covered():
-    return lambda cost: 0
+def network_init(details, in_network):
+    '''
+    Compile a network's service details (see plan_sim) with the kernel's code
+    generator, returning the network_tracker arguments for it. The compiled
+    network takes the Services for both networks and picks out its own.
+    '''
+    network = Network(
+        details['deductible'],
+        details['out_of_pocket_max'],
+        {name: offered_service(value) for name, value in details.items()
+            if name not in ('deductible', 'out_of_pocket_max')},
+        in_network)
 
+    return (
+        network.deductible,
+        network.out_of_pocket_max,
+        compile_network(network, NetworkSimResult, runs='counted'))
 
-def not_covered():
-    return lambda cost: cost
 
 @_apply(tuple)
 def generate_services(*general_services, yearly_services=(), monthly_services=(), months=12):
@@ -271,13 +280,36 @@ def generate_services(*general_services, yearly_services=(), monthly_services=()
     for month in range(1, 12):
         yield monthly_services
 
+def year_end(plan, service_months):
+    '''
+    The state at the end of the year for a plan sim, without the months
+    before it if the sim has a year end fast path
+    '''
+    final = getattr(plan, 'year_end', None)
+    if final is not None:
+        return final(service_months)
+    return tuple(plan(service_months))[-1]
+
+
+def run_batch(plans, simulations):
+    '''
+    Evaluate many named scenarios (service months, as from generate_services)
+    against many named plan sims, keeping only the year end states. Returns
+    {simulation name: {plan name: PlanState}}.
+    '''
+    plans = tuple(plans.items())
+    return {sim_name: {plan_name: year_end(plan, sim_services)
+            for plan_name, plan in plans}
+        for sim_name, sim_services in simulations.items()}
+
+
 @_apply(list)
 def run_simulation(POS, HDHP, simulations):
     plans = (('POS', POS), ('HDHP', HDHP))
     for sim_name, sim_services in simulations.items():
         print("For the {} simulation:".format(sim_name))
         for plan_name, plan in plans:
-            result = tuple(plan(sim_services))[-1]
+            result = year_end(plan, sim_services)
             yield result
 
             print("  {} Plan results:".format(plan_name))
@@ -1,3 +1,8 @@
 #!/bin/sh
 
-exec ./env/bin/python manage.py runserver 0.0.0.0:8000
+# Hash, compress and collect the static assets
+./env/bin/python manage.py collectstatic --noinput
+
+# --nostatic leaves /static/ to static_asset_view, which serves the collected
+# files with their precompressed variants and cache lifetimes
+exec ./env/bin/python manage.py runserver --nostatic 0.0.0.0:8000